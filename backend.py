@@ -0,0 +1,438 @@
+'''
+    Execution backends that shard the rows of large batches across workers.
+    Row-wise Manifold methods are decorated with sharded: when a backend is
+    configured, either on the manifold instance,
+
+        hyperboloid.backend = ThreadBackend(n_workers=8)
+
+    or for a block of code,
+
+        with use_backend(ThreadBackend(n_workers=8)):
+            hyperboloid.exponential_map(point, v_TpS)
+
+    calls with enough rows are split into one shard of rows per worker and
+    the results are written into a single output array. Without a backend
+    the methods run unchanged.
+
+    Sharded methods also take a where argument, a boolean mask of the rows
+    to evaluate, for sparse updates of large tables:
+
+        sphere.exponential_map(table, v_TpS, out=table, where=is_updated)
+
+    Only the selected rows are gathered and computed, before or without
+    sharding, so the cost follows the number of selected rows. Rows of out
+    outside the mask are left as they are; without out, they are given the
+    result of a trivial row of the method, such as point for a zero tangent
+    vector in exponential_map.
+
+    ThreadBackend shares the arrays between threads, relying on NumPy
+    releasing the GIL inside its kernels. ProcessBackend copies the inputs
+    once into shared memory blocks that the worker processes attach to, so
+    it only pays off for expensive operations such as pole ladder transport.
+'''
+from batch import chunk_slices
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from importlib import import_module
+from inspect import signature, unwrap
+from multiprocessing import shared_memory
+from numpy import asarray, broadcast_shapes, broadcast_to, dtype, empty, \
+    ndarray, result_type
+import os
+import threading
+
+# Smallest number of rows worth handing to a worker
+DEFAULT_MIN_ROWS = 16384
+
+# Backends installed by use_backend, innermost last
+_default_backends = []
+# Marks threads (and processes) that are running a shard, so that methods
+# called from within a shard run directly instead of sharding again
+_state = threading.local()
+
+
+@contextmanager
+def use_backend(backend):
+    '''
+    Run the sharded methods of every manifold without its own backend on
+    backend, for the duration of the with block
+    :param backend: Backend, or None to run single-threaded
+    '''
+    _default_backends.append(backend)
+    try:
+        yield backend
+    finally:
+        _default_backends.pop()
+
+
+def in_shard():
+    '''
+    :return: True in a thread or process that is running a shard of a call
+    '''
+    return getattr(_state, "in_shard", False)
+
+
+def _backend_for(manifold):
+    '''
+    :param manifold: Manifold whose method is called
+    :return: the Backend to run the call on, or None to run it directly
+    '''
+    backend = manifold.backend
+    if backend is None and _default_backends:
+        backend = _default_backends[-1]
+    if backend is None or in_shard():
+        return None
+    return backend
+
+
+def _shard_rows(value, rows, out):
+    '''
+    Rows of value in shard rows, if value is row-aligned with the batch.
+    Arrays with fewer dimensions or a single row broadcast against every
+    shard whole.
+    '''
+    if (isinstance(value, ndarray) and value.ndim == out.ndim and
+            value.shape[0] == out.shape[0]):
+        return value[rows]
+    return value
+
+
+def _run_shard(method, manifold, args, kwargs, out, rows):
+    '''
+    Evaluate the undecorated method on the rows of one shard, writing the
+    result into the same rows of out
+    :param method: method decorated with sharded
+    :param manifold: Manifold the method is bound to
+    :param args, kwargs: arguments of the call. Row-aligned arrays are sliced.
+    :param out: (m, k) np.array, the output of the whole batch
+    :param rows: slice, the rows of the shard
+    '''
+    _state.in_shard = True
+    try:
+        shard_args = [_shard_rows(arg, rows, out) for arg in args]
+        shard_kwargs = {key: _shard_rows(value, rows, out)
+                        for key, value in kwargs.items()}
+        if method.takes_out:
+            method.__wrapped__(manifold, *shard_args, out=out[rows], **shard_kwargs)
+        else:
+            out[rows] = method.__wrapped__(manifold, *shard_args, **shard_kwargs)
+    finally:
+        _state.in_shard = False
+
+
+def _selected_rows(where, shape):
+    '''
+    :param where: boolean np.array of the batch shape of a call, with or
+                  without a trailing axis of size 1, or broadcasting to it
+    :param shape: shape of the batch, (m, ..., k)
+    :return: tuple of np.arrays, the index of the rows selected by where
+    '''
+    where = asarray(where, dtype=bool)
+    if where.ndim == len(shape):
+        where = where[..., 0]
+    return broadcast_to(where, shape[:-1]).nonzero()
+
+
+def _gather_rows(value, index, shape):
+    '''
+    Selected rows of value, if value has the batch dimensions of the call
+    '''
+    if isinstance(value, ndarray) and value.ndim == len(shape):
+        return broadcast_to(value, shape[:-1] + value.shape[-1:])[index]
+    return value
+
+
+def _bind(method_signature, manifold, args, kwargs):
+    '''
+    :param method_signature: inspect.Signature of a method
+    :return: dict of the arguments of a call by name, without the manifold,
+             so that arrays passed by keyword are treated like positional ones
+    '''
+    arguments = method_signature.bind(manifold, *args, **kwargs).arguments
+    return dict(list(arguments.items())[1:])
+
+
+def _batch_shape(arguments):
+    '''
+    :param arguments: dict of the arguments of a call, see _bind
+    :return: shape of the batch of the call, broadcast from its array
+             arguments other than out and workspace
+    '''
+    return broadcast_shapes(*(
+        value.shape for key, value in arguments.items()
+        if isinstance(value, ndarray) and key not in ("out", "workspace")
+    ))
+
+
+def _call_masked(wrapper, manifold, arguments, where, n_cols, skipped):
+    '''
+    Evaluate a sharded method on the rows of the batch selected by where
+    :param wrapper: method decorated with sharded
+    :param manifold: Manifold the method is bound to
+    :param arguments: dict of the arguments of the call, see _bind
+    :param where: boolean mask of the rows to evaluate, see _selected_rows
+    :param n_cols: see sharded
+    :param skipped: function of arguments returning the value of unselected
+                    rows of a new output
+    :return: the output, with the results of the selected rows
+    '''
+    shape = _batch_shape(arguments)
+    index = _selected_rows(where, shape)
+    out = arguments.pop("out", None)
+    # Scratch space is sized for the whole batch
+    arguments.pop("workspace", None)
+    if out is None:
+        out = empty(shape[:-1] + (shape[-1] if n_cols is None else n_cols,),
+                    dtype=result_type(*(value for value in arguments.values()
+                                        if isinstance(value, ndarray))))
+        out[...] = skipped(arguments)
+    if index[0].size == 0:
+        return out
+    out[index] = wrapper(manifold, **{key: _gather_rows(value, index, shape)
+                                      for key, value in arguments.items()})
+    return out
+
+
+def sharded(n_cols=None, skipped=None):
+    '''
+    Decorator for row-wise Manifold methods, whose array arguments
+    broadcast to a (m, ..., k) batch and whose result has one row per row of
+    the batch. The method runs on the manifold's backend when one is
+    configured, sharding the first axis of the batch. The decorated method
+    takes an optional where argument, a boolean mask of the rows to
+    evaluate. Array arguments are split and masked whether they are passed
+    by position or by keyword.
+    :param n_cols: size of the last axis of the result, or None if it is
+                   that of the batch
+    :param skipped: name of the argument whose rows are the result of rows
+                    outside where, when there is no out argument, or None
+                    for zeros
+    :return: decorator
+    '''
+    def decorate(method):
+        method_signature = signature(method)
+        if skipped is None:
+            skipped_value = lambda arguments: 0
+        else:
+            skipped_value = lambda arguments: arguments[skipped]
+
+        @wraps(method)
+        def wrapper(self, *args, where=None, **kwargs):
+            backend = None if where is not None else _backend_for(self)
+            if where is None and backend is None:
+                return method(self, *args, **kwargs)
+            arguments = _bind(method_signature, self, args, kwargs)
+            if where is not None:
+                return _call_masked(wrapper, self, arguments, where, n_cols,
+                                    skipped_value)
+            shape = _batch_shape(arguments)
+            n_shards = backend.n_shards(shape[0]) if len(shape) > 1 else 0
+            if n_shards < 2:
+                return method(self, *args, **kwargs)
+            out = arguments.pop("out", None)
+            if out is None:
+                out = empty(shape[:-1] + (shape[-1] if n_cols is None else n_cols,),
+                            dtype=result_type(*(
+                                value for value in arguments.values()
+                                if isinstance(value, ndarray))))
+            return backend.map_shards(wrapper, self, (), arguments, out,
+                                      n_shards)
+        wrapper.takes_out = "out" in method_signature.parameters
+        return wrapper
+    return decorate
+
+
+class Backend:
+    '''
+        Base class for execution backends. The pool of workers is created on
+        first use and kept until close.
+    '''
+
+    def __init__(self, n_workers=None, min_rows=DEFAULT_MIN_ROWS):
+        '''
+
+        :param n_workers: number of workers. Defaults to the number of CPUs.
+        :param min_rows: calls are only split into shards of at least
+                         min_rows rows, so small batches run directly
+        '''
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.min_rows = min_rows
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def n_shards(self, n_rows):
+        '''
+        :param n_rows: number of rows of a call
+        :return: number of shards to split the call into
+        '''
+        return min(self.n_workers, n_rows//max(self.min_rows, 1))
+
+    def _make_executor(self):
+        '''
+        :return: concurrent.futures.Executor of n_workers workers
+        '''
+        raise NotImplementedError("Should be implemented by subclass")
+
+    def executor(self):
+        '''
+        :return: the pool of workers, created on first use
+        '''
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._make_executor()
+            return self._executor
+
+    def map_shards(self, method, manifold, args, kwargs, out, n_shards):
+        '''
+        Split a call into n_shards shards of rows and run them on the workers
+        :param method: method decorated with sharded
+        :param manifold: Manifold the method is bound to
+        :param args, kwargs: arguments of the call, without out
+        :param out: (m, k) np.array to write the result into
+        :param n_shards: number of shards
+        :return: out
+        '''
+        raise NotImplementedError("Should be implemented by subclass")
+
+    def close(self):
+        '''
+        Shut the pool of workers down. It is recreated if the backend is used
+        again.
+        '''
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def _shard_slices(n_rows, n_shards):
+    '''
+    :return: generator of n_shards slices of near-equal size covering n_rows
+    '''
+    return chunk_slices(n_rows, -(-n_rows//n_shards))
+
+
+class ThreadBackend(Backend):
+    '''
+        Shards run on a pool of threads, reading and writing the caller's
+        arrays directly.
+    '''
+
+    def _make_executor(self):
+        return ThreadPoolExecutor(self.n_workers)
+
+    def map_shards(self, method, manifold, args, kwargs, out, n_shards):
+        executor = self.executor()
+        futures = [
+            executor.submit(_run_shard, method, manifold, args, kwargs, out, rows)
+            for rows in _shard_slices(out.shape[0], n_shards)
+        ]
+        for future in futures:
+            future.result()
+        return out
+
+
+def _share(value, n_rows, blocks):
+    '''
+    Describe an argument of a call for a worker process, copying row-aligned
+    arrays into a new shared memory block
+    :param value: argument of the call
+    :param n_rows: number of rows of the call
+    :param blocks: list to which created SharedMemory blocks are appended
+    :return: ("shared", name, shape, dtype) or ("value", value)
+    '''
+    if not (isinstance(value, ndarray) and value.ndim > 0 and
+            value.shape[0] == n_rows):
+        return ("value", value)
+    block = shared_memory.SharedMemory(create=True, size=max(value.nbytes, 1))
+    blocks.append(block)
+    ndarray(value.shape, dtype=value.dtype, buffer=block.buf)[...] = value
+    return ("shared", block.name, value.shape, value.dtype.str)
+
+
+def _attach(spec, blocks):
+    '''
+    Inverse of _share, in a worker process
+    :param spec: description made by _share
+    :param blocks: list to which attached SharedMemory blocks are appended
+    :return: the argument
+    '''
+    if spec[0] == "value":
+        return spec[1]
+    _, name, shape, type_str = spec
+    block = shared_memory.SharedMemory(name=name)
+    blocks.append(block)
+    return ndarray(shape, dtype=dtype(type_str), buffer=block.buf)
+
+
+def _find_method(module_name, qualified_name):
+    '''
+    The method decorated with sharded of a given name, in a worker process.
+    Methods are sent by name rather than pickled, as further decorators,
+    such as validated, take their place as attributes of the class.
+    '''
+    method = import_module(module_name)
+    for name in qualified_name.split("."):
+        method = getattr(method, name)
+    return unwrap(method, stop=lambda wrapper: hasattr(wrapper, "takes_out"))
+
+
+def _run_process_shard(method_name, manifold, arg_specs, kwarg_specs, out_spec,
+                       rows):
+    '''
+    Attach to the shared arguments of a call and run one shard of it
+    :param method_name: (module, qualified name) of the sharded method
+    '''
+    method = _find_method(*method_name)
+    blocks = []
+    try:
+        args = [_attach(spec, blocks) for spec in arg_specs]
+        kwargs = {key: _attach(spec, blocks)
+                  for key, spec in kwarg_specs.items()}
+        out = _attach(out_spec, blocks)
+        _run_shard(method, manifold, args, kwargs, out, rows)
+        # Views must be released before the blocks can be closed
+        del args, kwargs, out
+    finally:
+        for block in blocks:
+            block.close()
+
+
+class ProcessBackend(Backend):
+    '''
+        Shards run on a pool of processes. The row-aligned inputs and the
+        output of each call are exchanged through shared memory blocks,
+        rather than pickled, and scratch workspace arguments are dropped.
+    '''
+
+    def _make_executor(self):
+        return ProcessPoolExecutor(self.n_workers)
+
+    def map_shards(self, method, manifold, args, kwargs, out, n_shards):
+        n_rows = out.shape[0]
+        blocks = []
+        try:
+            arg_specs = [_share(arg, n_rows, blocks) for arg in args]
+            kwarg_specs = {key: _share(value, n_rows, blocks)
+                           for key, value in kwargs.items()
+                           if key != "workspace"}
+            block = shared_memory.SharedMemory(create=True,
+                                               size=max(out.nbytes, 1))
+            blocks.append(block)
+            out_spec = ("shared", block.name, out.shape, out.dtype.str)
+            method_name = (method.__module__, method.__qualname__)
+            executor = self.executor()
+            futures = [
+                executor.submit(_run_process_shard, method_name, manifold,
+                                arg_specs, kwarg_specs, out_spec, rows)
+                for rows in _shard_slices(n_rows, n_shards)
+            ]
+            for future in futures:
+                future.result()
+            out[...] = ndarray(out.shape, dtype=out.dtype, buffer=block.buf)
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+        return out
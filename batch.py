@@ -0,0 +1,176 @@
+from numpy import empty, result_type
+
+DEFAULT_CHUNK_SIZE = 65536
+
+
+def chunk_slices(n_rows, chunk_size):
+    '''
+    Split n_rows rows into consecutive chunks.
+    :param n_rows: number of rows to split
+    :param chunk_size: maximum number of rows per chunk
+    :return: generator of slices covering range(n_rows)
+    '''
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be positive, got {}".format(chunk_size))
+    for start in range(0, n_rows, chunk_size):
+        yield slice(start, min(start + chunk_size, n_rows))
+
+
+def apply_in_chunks(func, arrays, out, chunk_size=DEFAULT_CHUNK_SIZE,
+                    pass_out=False):
+    '''
+    Evaluate a row-wise function chunk by chunk, writing each chunk of the
+    result into out. Temporaries allocated by func are bounded by chunk_size
+    rows, however many rows the inputs have.
+    :param func: function of len(arrays) (c, ...) np.arrays, returning a
+                 (c, out.shape[1]) np.array
+    :param arrays: sequence of (m, ...) np.arrays, the row-aligned inputs
+    :param out: (m, k) np.array, the output buffer
+    :param chunk_size: maximum number of rows passed to func at once
+    :param pass_out: if True, func accepts an out keyword and writes each
+                     chunk directly into the matching rows of out
+    :return: out
+    '''
+    n_rows = arrays[0].shape[0]
+    for array in arrays:
+        if array.shape[0] != n_rows:
+            raise ValueError(
+                "Inputs must have the same number of rows, got {} and {}".format(
+                    n_rows, array.shape[0]))
+    if out.shape[0] != n_rows:
+        raise ValueError(
+            "out has {} rows but inputs have {}".format(out.shape[0], n_rows))
+    for rows in chunk_slices(n_rows, chunk_size):
+        chunks = (array[rows] for array in arrays)
+        if pass_out:
+            func(*chunks, out=out[rows])
+        else:
+            out[rows] = func(*chunks)
+    return out
+
+
+class BatchExecutor:
+    '''
+        Runs the operations of a manifold over row chunks of their inputs,
+        so that peak memory is bounded by the chunk size rather than by the
+        number of rows m.
+    '''
+
+    def __init__(self, manifold, chunk_size=DEFAULT_CHUNK_SIZE):
+        '''
+
+        :param manifold: Manifold whose operations are executed
+        :param chunk_size: maximum number of rows processed at once
+        '''
+        self.manifold = manifold
+        self.chunk_size = chunk_size
+
+    def _run(self, func, arrays, out, n_cols, pass_out=False):
+        '''
+        Allocate out if needed, check its shape, then fill it chunk by chunk
+        :param func: row-wise manifold operation
+        :param arrays: row-aligned inputs of func
+        :param out: (m, n_cols) np.array or None
+        :param n_cols: number of columns of the result
+        :param pass_out: whether func writes into an out keyword argument
+        :return: out
+        '''
+        shape = (arrays[0].shape[0], n_cols)
+        if out is None:
+            out = empty(shape, dtype=result_type(*arrays))
+        elif out.shape != shape:
+            raise ValueError(
+                "out has shape {}, expected {}".format(out.shape, shape))
+        return apply_in_chunks(func, arrays, out, self.chunk_size, pass_out)
+
+    def _workspace(self, array):
+        '''
+        Scratch buffer reused by every chunk of an operation on array
+        :param array: (m, k) np.array, an input of the operation
+        :return: (min(m, chunk_size), k) np.array
+        '''
+        return empty(
+                        (min(array.shape[0], self.chunk_size), array.shape[1]),
+                        dtype=array.dtype
+        )
+
+    def distance(self, u, v, out=None):
+        '''
+        Chunked Manifold.distance
+        :param u, v:, (m, n_dims+1) np.arrays, each representing m points
+        :param out: optional (m, 1) np.array to write the result into
+        :return: (m, 1) np.array, the distance between u and v
+        '''
+        return self._run(self.manifold.distance, (u, v), out, 1)
+
+    def exponential_map(self, point, v_TpS, out=None):
+        '''
+        Chunked Manifold.exponential_map
+        :param point: (m, n_dims+1) np.array, representing m points
+        :param v_TpS: (m, n_dims+1) np.array, m vectors in tangent spaces of
+                      point
+        :param out: optional (m, n_dims+1) np.array to write the result into
+        :return: (m, n_dims+1) np.array, m points on the manifold
+        '''
+        workspace = self._workspace(point)
+        return self._run(
+            lambda p, v, out: self.manifold.exponential_map(
+                                    p, v, out=out, workspace=workspace[:len(p)]),
+            (point, v_TpS),
+            out,
+            point.shape[1],
+            pass_out=True
+        )
+
+    def logarithmic_map(self, point0, point1, out=None):
+        '''
+        Chunked Manifold.logarithmic_map
+        :param point0: (m, n_dims+1) np.array, representing m "base" points
+        :param point1: (m, n_dims+1) np.array, representing m "target" points
+        :param out: optional (m, n_dims+1) np.array to write the result into
+        :return: (m, n_dims+1) np.array, m vectors in tangent spaces of point0
+        '''
+        return self._run(
+                            self.manifold.logarithmic_map,
+                            (point0, point1),
+                            out,
+                            point0.shape[1],
+                            pass_out=True
+        )
+
+    def project_to_tangent_space(self, point, vector, out=None):
+        '''
+        Chunked Manifold.project_to_tangent_space
+        :param point: (m, n_dims+1) np.array, representing m points
+        :param vector: (m, n_dims+1) np.array, representing m ambient vectors
+        :param out: optional (m, n_dims+1) np.array to write the result into
+        :return: (m, n_dims+1) np.array, vector projected to tangent spaces
+        '''
+        workspace = self._workspace(point)
+        return self._run(
+            lambda p, v, out: self.manifold.project_to_tangent_space(
+                                    p, v, out=out, workspace=workspace[:len(p)]),
+            (point, vector),
+            out,
+            point.shape[1],
+            pass_out=True
+        )
+
+    def parallel_transport(self, vec_Tp0M, point_0, point_1, out=None,
+                           **kwargs):
+        '''
+        Chunked Manifold.parallel_transport
+        :param vec_Tp0M: (m, n_dims+1) np.array, vectors in Tp0M to transport
+        :param point_0: (m, n_dims+1) np.array, initial points
+        :param point_1: (m, n_dims+1) np.array, final points
+        :param out: optional (m, n_dims+1) np.array to write the result into
+        :param kwargs: passed on to the manifold's parallel_transport
+        :return: (m, n_dims+1) np.array, vec_Tp0M transported to point_1
+        '''
+        return self._run(
+            lambda vec, p0, p1: self.manifold.parallel_transport(
+                                                            vec, p0, p1, **kwargs),
+            (vec_Tp0M, point_0, point_1),
+            out,
+            vec_Tp0M.shape[1]
+        )
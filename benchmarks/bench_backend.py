@@ -0,0 +1,67 @@
+'''
+    Scaling of Hyperboloid.exponential_map and parallel_transport with the
+    number of workers of ThreadBackend and ProcessBackend, against the
+    single-threaded call.
+
+    Run from the repository root:
+        python -m benchmarks.bench_backend
+'''
+from backend import ProcessBackend, ThreadBackend
+from hyperboloid import Hyperboloid
+from numpy import hstack, sqrt, sum
+from numpy.random import default_rng
+import os
+from timeit import repeat
+
+
+def hyperboloid_points(m, n_dims, rng):
+    spatial = rng.standard_normal((m, n_dims))
+    return hstack([sqrt(1. + sum(spatial**2, axis=1, keepdims=True)), spatial])
+
+
+def best_time(func, number=3, n_repeats=3):
+    '''
+    Best mean wall time of func over n_repeats runs of number calls.
+    '''
+    return min(repeat(func, number=number, repeat=n_repeats))/number
+
+
+def worker_counts(max_workers):
+    counts = [1]
+    while counts[-1]*2 <= max_workers:
+        counts.append(counts[-1]*2)
+    if counts[-1] != max_workers:
+        counts.append(max_workers)
+    return counts
+
+
+def main(n_rows=2000000, n_dims=32):
+    rng = default_rng(0)
+    manifold = Hyperboloid(n_dims)
+    p0 = hyperboloid_points(n_rows, n_dims, rng)
+    p1 = hyperboloid_points(n_rows, n_dims, rng)
+    v = manifold.logarithmic_map(p0, p1)
+    operations = (
+        ("exp", lambda: manifold.exponential_map(p0, v)),
+        ("transport", lambda: manifold.parallel_transport(v, p0, p1)),
+    )
+    serial = [best_time(func) for _, func in operations]
+    print("speed-up over one thread, {} rows of dimension {}, {} CPUs".format(
+                                            n_rows, n_dims, os.cpu_count()))
+    print("{:>10} {:>8}".format("backend", "workers") +
+          "".join("{:>12}".format(name) for name, _ in operations))
+    for backend_type in (ThreadBackend, ProcessBackend):
+        for n_workers in worker_counts(os.cpu_count() or 1):
+            manifold.backend = backend_type(n_workers=n_workers)
+            try:
+                timings = [best_time(func) for _, func in operations]
+            finally:
+                manifold.backend.close()
+                manifold.backend = None
+            print("{:>10} {:>8}".format(backend_type.__name__[:-7], n_workers) +
+                  "".join("{:>12.2f}".format(s/t)
+                          for s, t in zip(serial, timings)))
+
+
+if __name__ == "__main__":
+    main()
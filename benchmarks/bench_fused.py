@@ -0,0 +1,78 @@
+'''
+    Separate against fused evaluation of the logarithmic map with the
+    distance, and of exp(point0, t log(point0, point1)), on Sphere and
+    Hyperboloid. Reports throughput and the peak of temporaries allocated
+    per call, in multiples of one (m, n_dims+1) input array.
+
+    Run from the repository root:
+        python -m benchmarks.bench_fused
+'''
+from hyperboloid import Hyperboloid
+from numpy import hstack, sqrt, sum
+from numpy.linalg import norm
+from numpy.random import default_rng
+from sphere import Sphere
+from timeit import repeat
+import tracemalloc
+
+
+def sphere_points(m, n_dims, rng):
+    points = rng.standard_normal((m, n_dims+1))
+    return points/norm(points, axis=1, keepdims=True)
+
+
+def hyperboloid_points(m, n_dims, rng):
+    spatial = rng.standard_normal((m, n_dims))
+    return hstack([sqrt(1. + sum(spatial**2, axis=1, keepdims=True)), spatial])
+
+
+def best_time(func, number=3, n_repeats=3):
+    '''
+    Best mean wall time of func over n_repeats runs of number calls.
+    '''
+    return min(repeat(func, number=number, repeat=n_repeats))/number
+
+
+def peak_memory(func):
+    '''
+    Peak memory allocated by one call of func, in bytes
+    '''
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main(n_rows=500000, n_dims=32):
+    rng = default_rng(0)
+    for manifold, sample in ((Sphere(n_dims), sphere_points),
+                             (Hyperboloid(n_dims), hyperboloid_points)):
+        p0 = sample(n_rows, n_dims, rng)
+        p1 = sample(n_rows, n_dims, rng)
+        cases = (
+            ("log + distance", lambda: (manifold.logarithmic_map(p0, p1),
+                                        manifold.distance(p0, p1))),
+            ("log_map_with_distance",
+             lambda: manifold.log_map_with_distance(p0, p1)),
+            ("exp(t log)", lambda: manifold.exponential_map(
+                                    p0, 0.5*manifold.logarithmic_map(p0, p1))),
+            ("exp_log_roundtrip",
+             lambda: manifold.exp_log_roundtrip(p0, p1, 0.5)),
+        )
+        print("{}, {} rows of dimension {}".format(
+                                        type(manifold).__name__, n_rows, n_dims))
+        print("{:>24} {:>14} {:>14}".format("operation", "rows/s",
+                                            "peak arrays"))
+        for name, func in cases:
+            print("{:>24} {:>14.3e} {:>14.2f}".format(
+                name,
+                n_rows/best_time(func),
+                peak_memory(func)/p0.nbytes
+            ))
+        print("")
+
+
+if __name__ == "__main__":
+    main()
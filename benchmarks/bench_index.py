@@ -0,0 +1,47 @@
+'''
+    Compare k-nearest neighbour queries through VantagePointTree with brute
+    force pairwise distances, for growing numbers of indexed hyperboloid
+    points.
+
+    Run from the repository root:
+        python -m benchmarks.bench_index
+'''
+from hyperboloid import Hyperboloid
+from index import VantagePointTree
+from numpy import hstack, sqrt, sum
+from numpy.random import default_rng
+from time import perf_counter
+
+
+def random_points(m, n_dims, rng):
+    spatial = rng.standard_normal((m, n_dims))
+    return hstack([sqrt(1. + sum(spatial**2, axis=1, keepdims=True)), spatial])
+
+
+def main(sizes=(10000, 100000, 1000000), n_dims=3, n_queries=100, k=10):
+    rng = default_rng(0)
+    hyperb = Hyperboloid(n_dims)
+    queries = random_points(n_queries, n_dims, rng)
+    print("{:>9} {:>10} {:>16} {:>16}".format(
+        "points", "build (s)", "tree (ms/query)", "brute (ms/query)"))
+    for n_points in sizes:
+        points = random_points(n_points, n_dims, rng)
+        start = perf_counter()
+        tree = VantagePointTree(hyperb, points, leaf_size=64)
+        t_build = perf_counter() - start
+
+        start = perf_counter()
+        tree.query(queries, k=k)
+        t_tree = (perf_counter() - start)/n_queries
+
+        start = perf_counter()
+        for rows, cols, block in hyperb.iter_pairwise_distance(
+                                            queries, points, block_size=4096):
+            block.argpartition(k, axis=1)
+        t_brute = (perf_counter() - start)/n_queries
+        print("{:>9} {:>10.2f} {:>16.3f} {:>16.3f}".format(
+            n_points, t_build, 1e3*t_tree, 1e3*t_brute))
+
+
+if __name__ == "__main__":
+    main()
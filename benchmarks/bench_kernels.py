@@ -0,0 +1,67 @@
+'''
+    NumPy against compiled kernels for the row-wise operations of Sphere
+    and Hyperboloid. Needs numba to be installed.
+
+    Run from the repository root:
+        python -m benchmarks.bench_kernels
+'''
+from hyperboloid import Hyperboloid
+from kernels import AVAILABLE, use_kernels
+from numpy import hstack, sqrt, sum
+from numpy.linalg import norm
+from numpy.random import default_rng
+from sphere import Sphere
+from timeit import repeat
+
+
+def sphere_points(m, n_dims, rng):
+    points = rng.standard_normal((m, n_dims+1))
+    return points/norm(points, axis=1, keepdims=True)
+
+
+def hyperboloid_points(m, n_dims, rng):
+    spatial = rng.standard_normal((m, n_dims))
+    return hstack([sqrt(1. + sum(spatial**2, axis=1, keepdims=True)), spatial])
+
+
+def best_time(func, number=3, n_repeats=3):
+    '''
+    Best mean wall time of func over n_repeats runs of number calls.
+    '''
+    return min(repeat(func, number=number, repeat=n_repeats))/number
+
+
+def main(n_rows=1000000, n_dims=16):
+    if not AVAILABLE:
+        raise SystemExit("numba is not installed")
+    rng = default_rng(0)
+    for manifold, sample in ((Sphere(n_dims), sphere_points),
+                             (Hyperboloid(n_dims), hyperboloid_points)):
+        p0 = sample(n_rows, n_dims, rng)
+        p1 = sample(n_rows, n_dims, rng)
+        vec = manifold.logarithmic_map(p0, p1[::-1])
+        cases = (
+            ("distance", lambda: manifold.distance(p0, p1)),
+            ("exponential_map", lambda: manifold.exponential_map(p0, vec)),
+            ("logarithmic_map", lambda: manifold.logarithmic_map(p0, p1)),
+            ("parallel_transport",
+             lambda: manifold.parallel_transport(vec, p0, p1)),
+        )
+        print("{}, {} rows of dimension {}".format(
+                                        type(manifold).__name__, n_rows, n_dims))
+        print("{:>20} {:>14} {:>14}".format("operation", "numpy rows/s",
+                                            "kernel rows/s"))
+        for name, func in cases:
+            with use_kernels(False):
+                numpy_time = best_time(func)
+            with use_kernels(True):
+                # The first call compiles the kernel
+                func()
+                kernel_time = best_time(func)
+            print("{:>20} {:>14.3e} {:>14.3e}".format(
+                                name, n_rows/numpy_time, n_rows/kernel_time))
+        print("")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+'''
+    Compare the structured dot product kernels of Metric against the dense
+    einsum over the full metric tensor, for 128 to 1024-dimensional embeddings.
+
+    Run from the repository root:
+        python -m benchmarks.bench_metric
+'''
+from metric import Metric, EuclideanMetric, MinkowskiMetric
+from numpy import einsum
+from numpy.random import default_rng
+from timeit import repeat
+
+
+def dense_dot(metric, u, v):
+    '''
+    Dot product against the dense metric tensor, as computed before metrics
+    carried a structured representation.
+    '''
+    return einsum("ij,ai,aj->a", metric.metric, u, v)
+
+
+def best_time(func, number=3, n_repeats=3):
+    '''
+    Best mean wall time of func over n_repeats runs of number calls.
+    '''
+    return min(repeat(func, number=number, repeat=n_repeats))/number
+
+
+def main(n_rows=2000, dims=(128, 256, 512, 1024)):
+    rng = default_rng(0)
+    print("{:>10} {:>6} {:>12} {:>12} {:>12} {:>9}".format(
+        "metric", "n", "einsum (s)", "dense (s)", "fast (s)", "speedup"))
+    for n_dims in dims:
+        u = rng.standard_normal((n_rows, n_dims))
+        v = rng.standard_normal((n_rows, n_dims))
+        for metric in (EuclideanMetric(n_dims), MinkowskiMetric(n_dims)):
+            general = Metric(n_dims)
+            general.metric = metric.metric
+            t_einsum = best_time(lambda: dense_dot(metric, u, v))
+            t_dense = best_time(lambda: general.dot(u, v))
+            t_fast = best_time(lambda: metric.dot(u, v))
+            print("{:>10} {:>6} {:>12.2e} {:>12.2e} {:>12.2e} {:>8.1f}x".format(
+                type(metric).__name__[:-6], n_dims, t_einsum, t_dense,
+                t_fast, t_einsum/t_fast))
+
+
+if __name__ == "__main__":
+    main()
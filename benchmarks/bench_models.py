@@ -0,0 +1,71 @@
+'''
+    Throughput of distance, exponential map, logarithmic map and parallel
+    transport in the three models of hyperbolic space, on the same points,
+    and of the conversions between them.
+
+    Run from the repository root:
+        python -m benchmarks.bench_models
+'''
+from conversions import hyperboloid_to_klein, hyperboloid_to_poincare, \
+    klein_to_hyperboloid, poincare_to_hyperboloid
+from hyperboloid import Hyperboloid
+from klein import Klein
+from numpy import empty, hstack, sqrt, sum
+from numpy.random import default_rng
+from poincare import PoincareBall
+from timeit import repeat
+
+
+def hyperboloid_points(m, n_dims, rng):
+    spatial = rng.standard_normal((m, n_dims))
+    return hstack([sqrt(1. + sum(spatial**2, axis=1, keepdims=True)), spatial])
+
+
+def best_time(func, number=3, n_repeats=3):
+    '''
+    Best mean wall time of func over n_repeats runs of number calls.
+    '''
+    return min(repeat(func, number=number, repeat=n_repeats))/number
+
+
+def main(n_rows=200000, n_dims=32):
+    rng = default_rng(0)
+    h0 = hyperboloid_points(n_rows, n_dims, rng)
+    h1 = hyperboloid_points(n_rows, n_dims, rng)
+    models = (
+        (Hyperboloid(n_dims), h0, h1),
+        (PoincareBall(n_dims), hyperboloid_to_poincare(h0),
+         hyperboloid_to_poincare(h1)),
+        (Klein(n_dims), hyperboloid_to_klein(h0), hyperboloid_to_klein(h1)),
+    )
+    operations = ("distance", "exp", "log", "transport")
+    print("rows/s, {} rows of dimension {}".format(n_rows, n_dims))
+    print("{:>14}".format("model") +
+          "".join("{:>14}".format(op) for op in operations))
+    for manifold, p0, p1 in models:
+        v = manifold.logarithmic_map(p0, p1)
+        timings = (
+            best_time(lambda: manifold.distance(p0, p1)),
+            best_time(lambda: manifold.exponential_map(p0, v)),
+            best_time(lambda: manifold.logarithmic_map(p0, p1)),
+            best_time(lambda: manifold.parallel_transport(v, p0, p1)),
+        )
+        print("{:>14}".format(type(manifold).__name__) +
+              "".join("{:>14.3e}".format(n_rows/t) for t in timings))
+
+    ball = empty((n_rows, n_dims))
+    hyperboloid = empty((n_rows, n_dims+1))
+    conversions = (
+        ("to poincare", lambda: hyperboloid_to_poincare(h0, out=ball)),
+        ("from poincare", lambda: poincare_to_hyperboloid(ball, out=hyperboloid)),
+        ("to klein", lambda: hyperboloid_to_klein(h0, out=ball)),
+        ("from klein", lambda: klein_to_hyperboloid(ball, out=hyperboloid)),
+    )
+    print("")
+    print("{:>14} {:>14}".format("conversion", "rows/s"))
+    for name, func in conversions:
+        print("{:>14} {:>14.3e}".format(name, n_rows/best_time(func)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+'''
+    Throughput of each kind of Manifold.retraction, and its largest
+    distance from the exponential map for steps of decreasing size, on
+    Sphere and Hyperboloid.
+
+    Run from the repository root:
+        python -m benchmarks.bench_retraction
+'''
+from hyperboloid import Hyperboloid
+from numpy import hstack, sqrt, sum
+from numpy.linalg import norm
+from numpy.random import default_rng
+from sphere import Sphere
+from timeit import repeat
+
+KINDS = ("exp", "projection", "second_order")
+
+
+def sphere_points(m, n_dims, rng):
+    points = rng.standard_normal((m, n_dims+1))
+    return points/norm(points, axis=1, keepdims=True)
+
+
+def hyperboloid_points(m, n_dims, rng):
+    spatial = rng.standard_normal((m, n_dims))
+    return hstack([sqrt(1. + sum(spatial**2, axis=1, keepdims=True)), spatial])
+
+
+def best_time(func, number=3, n_repeats=3):
+    '''
+    Best mean wall time of func over n_repeats runs of number calls.
+    '''
+    return min(repeat(func, number=number, repeat=n_repeats))/number
+
+
+def main(n_rows=200000, n_dims=32, step_sizes=(1e-1, 1e-2, 1e-3)):
+    rng = default_rng(0)
+    for manifold, sample in ((Sphere(n_dims), sphere_points),
+                             (Hyperboloid(n_dims), hyperboloid_points)):
+        point = sample(n_rows, n_dims, rng)
+        direction = manifold.project_to_tangent_space(
+                                    point, rng.standard_normal(point.shape))
+        direction /= manifold.metric.norm(direction)
+        print("{}, {} rows of dimension {}".format(
+                                        type(manifold).__name__, n_rows, n_dims))
+        print("{:>14} {:>14}".format("kind", "rows/s") + "".join(
+            "{:>14}".format("err |v|={:g}".format(h)) for h in step_sizes))
+        for kind in KINDS:
+            v = step_sizes[0]*direction
+            throughput = n_rows/best_time(
+                                    lambda: manifold.retraction(point, v, kind))
+            errors = []
+            for step_size in step_sizes:
+                v = step_size*direction
+                exact = manifold.exponential_map(point, v)
+                retracted = manifold.retraction(point, v, kind)
+                errors.append(norm(retracted - exact, axis=1).max())
+            print("{:>14} {:>14.3e}".format(kind, throughput) + "".join(
+                "{:>14.2e}".format(error) for error in errors))
+        print("")
+
+
+if __name__ == "__main__":
+    main()
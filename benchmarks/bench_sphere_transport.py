@@ -0,0 +1,53 @@
+'''
+    Compare the closed-form parallel transport of Sphere with the generic
+    pole ladder, with fixed and adaptive numbers of steps, in speed and in
+    accuracy, on large batches.
+
+    Run from the repository root:
+        python -m benchmarks.bench_sphere_transport
+'''
+from numpy import abs, max
+from numpy.linalg import norm
+from numpy.random import default_rng
+from sphere import Sphere
+from timeit import repeat
+
+
+def random_points(m, n_dims, rng):
+    points = rng.standard_normal((m, n_dims+1))
+    return points/norm(points, axis=1, keepdims=True)
+
+
+def best_time(func, number=1, n_repeats=3):
+    '''
+    Best mean wall time of func over n_repeats runs of number calls.
+    '''
+    return min(repeat(func, number=number, repeat=n_repeats))/number
+
+
+def main(n_rows=100000, n_dims=16, ladder_steps=(1, 5, 10, 20, "adaptive")):
+    rng = default_rng(0)
+    sphere = Sphere(n_dims)
+    p0 = random_points(n_rows, n_dims, rng)
+    p1 = random_points(n_rows, n_dims, rng)
+    # The pole ladder needs vectors well inside the injectivity radius
+    v = sphere.project_to_tangent_space(p0, 0.05*rng.standard_normal(p0.shape))
+
+    exact = sphere.parallel_transport(v, p0, p1)
+    t_exact = best_time(lambda: sphere.parallel_transport(v, p0, p1))
+    print("{} rows, {}-sphere".format(n_rows, n_dims))
+    print("{:>16} {:>12} {:>9} {:>12}".format(
+        "method", "time (s)", "slowdown", "max error"))
+    print("{:>16} {:>12.3e} {:>8.1f}x {:>12.2e}".format(
+        "closed form", t_exact, 1., 0.))
+    for n_steps in ladder_steps:
+        transport = lambda: sphere.parallel_transport(
+                        v, p0, p1, method="pole_ladder", n_steps=n_steps)
+        t_ladder = best_time(transport)
+        error = max(abs(transport() - exact))
+        print("{:>16} {:>12.3e} {:>8.1f}x {:>12.2e}".format(
+            "ladder, {}".format(n_steps), t_ladder, t_ladder/t_exact, error))
+
+
+if __name__ == "__main__":
+    main()
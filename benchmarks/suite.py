@@ -0,0 +1,323 @@
+'''
+    Benchmark suite sweeping every Manifold and Metric operation over batch
+    size m, dimension n, dtype and manifold. Each case reports throughput
+    and the peak memory allocated by one call, and results are saved as
+    JSON so that later runs can be compared against them.
+
+    Run from the repository root:
+        python -m benchmarks.suite --preset quick --output results.json
+        python -m benchmarks.suite --preset full --baseline results.json
+        python -m benchmarks.suite --compare results.json new_results.json
+
+    Cases whose inputs would exceed --max-bytes per array are skipped, so
+    the full sweep up to m = 10M, n = 1024 only runs what fits in memory.
+    Peak memory is measured with tracemalloc, which NumPy reports its array
+    allocations to, in a separate call from the timed ones.
+'''
+import argparse
+from conversions import hyperboloid_to_klein, hyperboloid_to_poincare
+from hyperboloid import Hyperboloid
+from klein import Klein
+import json
+from metric import EuclideanMetric, Metric, MinkowskiMetric
+from numpy import diag, dtype, hstack, linspace, sqrt, sum
+import numpy
+from numpy.linalg import norm
+from numpy.random import default_rng
+import os
+import platform
+from poincare import PoincareBall
+from sphere import Sphere
+import sys
+import time
+from timeit import Timer
+import tracemalloc
+
+PRESETS = {
+    "quick": {
+        "m": [1, 1000, 100000],
+        "n": [2, 32],
+        "dtype": ["float64"],
+    },
+    "full": {
+        "m": [1, 100, 10000, 1000000, 10000000],
+        "n": [2, 16, 128, 1024],
+        "dtype": ["float32", "float64"],
+    },
+}
+MANIFOLDS = ("sphere", "hyperboloid", "poincare", "klein", "metric")
+# Fraction by which a case must slow down to count as a regression
+DEFAULT_THRESHOLD = 0.1
+
+
+def _hyperboloid_points(m, n_dims, rng, point_dtype):
+    spatial = rng.standard_normal((m, n_dims))
+    return hstack([sqrt(1. + sum(spatial**2, axis=1, keepdims=True)),
+                   spatial]).astype(point_dtype)
+
+
+def _sphere_points(m, n_dims, rng, point_dtype):
+    points = rng.standard_normal((m, n_dims+1))
+    return (points/norm(points, axis=1, keepdims=True)).astype(point_dtype)
+
+
+def manifold_cases(name, m, n_dims, point_dtype, rng):
+    '''
+    Operations to benchmark on one manifold, with their inputs
+    :param name: one of MANIFOLDS other than "metric"
+    :param m: number of rows
+    :param n_dims: dimension of the manifold
+    :param point_dtype: np.dtype of the inputs
+    :param rng: np.random.Generator
+    :return: list of (operation name, function of no arguments)
+    '''
+    if name == "sphere":
+        manifold = Sphere(n_dims)
+        p0 = _sphere_points(m, n_dims, rng, point_dtype)
+        p1 = _sphere_points(m, n_dims, rng, point_dtype)
+    else:
+        h0 = _hyperboloid_points(m, n_dims, rng, point_dtype)
+        h1 = _hyperboloid_points(m, n_dims, rng, point_dtype)
+        if name == "hyperboloid":
+            manifold, p0, p1 = Hyperboloid(n_dims), h0, h1
+        elif name == "poincare":
+            manifold = PoincareBall(n_dims)
+            p0, p1 = hyperboloid_to_poincare(h0), hyperboloid_to_poincare(h1)
+        elif name == "klein":
+            manifold = Klein(n_dims)
+            p0, p1 = hyperboloid_to_klein(h0), hyperboloid_to_klein(h1)
+        else:
+            raise ValueError("Unknown manifold: {}".format(name))
+    v = manifold.logarithmic_map(p0, p1)
+    ambient = rng.standard_normal(p0.shape).astype(point_dtype)
+    times = linspace(0., 1., 8)
+    cases = [
+        ("distance", lambda: manifold.distance(p0, p1)),
+        ("exponential_map", lambda: manifold.exponential_map(p0, v)),
+        ("logarithmic_map", lambda: manifold.logarithmic_map(p0, p1)),
+        ("log_map_with_distance",
+         lambda: manifold.log_map_with_distance(p0, p1)),
+        ("exp_log_roundtrip", lambda: manifold.exp_log_roundtrip(p0, p1, 0.5)),
+        ("geodesic[K=8]", lambda: manifold.geodesic(p0, p1, times)),
+        ("project_to_tangent_space",
+         lambda: manifold.project_to_tangent_space(p0, ambient)),
+        ("parallel_transport", lambda: manifold.parallel_transport(v, p0, p1)),
+    ]
+    if name == "sphere":
+        cases.append(("parallel_transport[pole_ladder]",
+                      lambda: manifold.parallel_transport(
+                                            v, p0, p1, method="pole_ladder")))
+    return cases
+
+
+def metric_cases(m, n_dims, point_dtype, rng):
+    '''
+    Metric.dot and Metric.norm with each kernel: identity, diagonal and
+    dense metric tensors
+    :return: list of (operation name, function of no arguments)
+    '''
+    u = rng.standard_normal((m, n_dims+1)).astype(point_dtype)
+    v = rng.standard_normal((m, n_dims+1)).astype(point_dtype)
+    # Norms are taken of spacelike vectors, whose Minkowski norms are real
+    w = u.copy()
+    w[:, 0] = 0.
+    dense = rng.standard_normal((n_dims+1, n_dims+1))
+    metrics = (
+        ("euclidean", EuclideanMetric(n_dims+1)),
+        ("minkowski", MinkowskiMetric(n_dims+1)),
+        ("diagonal", Metric(n_dims+1, diag(rng.uniform(1., 2., n_dims+1)))),
+        ("dense", Metric(n_dims+1, dense @ dense.T)),
+    )
+    cases = []
+    for metric_name, metric in metrics:
+        cases.append(("dot[{}]".format(metric_name),
+                      lambda metric=metric: metric.dot(u, v)))
+        cases.append(("norm[{}]".format(metric_name),
+                      lambda metric=metric: metric.norm(w)))
+    return cases
+
+
+def time_call(func, min_time=0.2, n_repeats=3):
+    '''
+    Best time per call, over n_repeats runs of enough calls to last
+    min_time
+    :return: seconds per call
+    '''
+    timer = Timer(func)
+    number = 1
+    elapsed = timer.timeit(number)
+    while elapsed < min_time:
+        # Grow towards min_time, at most tenfold at a time
+        number = int(number*min(10., 1.2*min_time/max(elapsed, 1e-9))) + 1
+        elapsed = timer.timeit(number)
+    return min([elapsed] + timer.repeat(repeat=n_repeats - 1, number=number))/number
+
+
+def peak_memory(func):
+    '''
+    Peak memory allocated during one call of func, in bytes
+    '''
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(manifolds, sizes, dims, dtypes, max_bytes=2**30, min_time=0.2,
+        seed=0, log=sys.stderr):
+    '''
+    Run every case of the sweep
+    :param manifolds: names from MANIFOLDS
+    :param sizes: batch sizes m
+    :param dims: manifold dimensions n
+    :param dtypes: names of floating point types
+    :param max_bytes: cases whose (m, n+1) inputs exceed max_bytes are
+                      skipped
+    :param min_time: minimum duration of each timed run, in seconds
+    :param seed: seed of the random inputs
+    :param log: file progress is written to, or None
+    :return: list of result dicts
+    '''
+    rng = default_rng(seed)
+    results = []
+    for name in manifolds:
+        for point_dtype in dtypes:
+            for n_dims in dims:
+                for m in sizes:
+                    n_bytes = m*(n_dims+1)*dtype(point_dtype).itemsize
+                    if n_bytes > max_bytes:
+                        continue
+                    if name == "metric":
+                        cases = metric_cases(m, n_dims, point_dtype, rng)
+                    else:
+                        cases = manifold_cases(name, m, n_dims, point_dtype, rng)
+                    for operation, func in cases:
+                        seconds = time_call(func, min_time)
+                        result = {
+                            "manifold": name,
+                            "operation": operation,
+                            "m": m,
+                            "n": n_dims,
+                            "dtype": point_dtype,
+                            "seconds": seconds,
+                            "rows_per_second": m/seconds,
+                            "peak_bytes": peak_memory(func),
+                            "input_bytes": n_bytes,
+                        }
+                        results.append(result)
+                        if log is not None:
+                            print("{manifold:>12} {operation:>32} m={m:<9} "
+                                  "n={n:<5} {dtype:>8} {rows_per_second:12.3e} "
+                                  "rows/s {peak_bytes:>12} B".format(**result),
+                                  file=log)
+    return results
+
+
+def environment():
+    '''
+    Description of the machine and library versions the results come from
+    '''
+    return {
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def _key(result):
+    return (result["manifold"], result["operation"], result["m"], result["n"],
+            result["dtype"])
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    '''
+    Match the cases of two runs and flag slowdowns
+    :param baseline, current: lists of result dicts
+    :param threshold: cases slower than the baseline by more than this
+                      fraction are regressions
+    :return: list of (key, baseline seconds, current seconds, ratio,
+             is_regression), for the cases present in both runs
+    '''
+    baseline_seconds = {_key(result): result["seconds"] for result in baseline}
+    rows = []
+    for result in current:
+        key = _key(result)
+        if key not in baseline_seconds:
+            continue
+        ratio = result["seconds"]/baseline_seconds[key]
+        rows.append((key, baseline_seconds[key], result["seconds"], ratio,
+                     ratio > 1. + threshold))
+    return rows
+
+
+def print_comparison(rows, file=sys.stdout):
+    print("{:>12} {:>32} {:>9} {:>5} {:>8} {:>12} {:>12} {:>7}".format(
+            "manifold", "operation", "m", "n", "dtype", "baseline s",
+            "current s", "ratio"), file=file)
+    for key, base, current, ratio, is_regression in rows:
+        print("{:>12} {:>32} {:>9} {:>5} {:>8} {:>12.3e} {:>12.3e} {:>7.2f}{}"
+              .format(*key, base, current, ratio,
+                      "  REGRESSION" if is_regression else ""), file=file)
+
+
+def load_results(path):
+    with open(path) as file:
+        return json.load(file)["results"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="quick")
+    parser.add_argument("--manifolds", nargs="+", choices=MANIFOLDS,
+                        default=list(MANIFOLDS))
+    parser.add_argument("--m", nargs="+", type=int,
+                        help="batch sizes, overriding the preset")
+    parser.add_argument("--n", nargs="+", type=int,
+                        help="manifold dimensions, overriding the preset")
+    parser.add_argument("--dtype", nargs="+", choices=["float32", "float64"],
+                        help="dtypes, overriding the preset")
+    parser.add_argument("--max-bytes", type=float, default=2**30,
+                        help="skip cases whose inputs exceed this size")
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="minimum seconds per timed run")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline",
+                        help="compare the results with this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="only compare two existing JSON files")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="slowdown fraction reported as a regression")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        baseline, current = (load_results(path) for path in args.compare)
+    else:
+        preset = PRESETS[args.preset]
+        current = run(
+                    args.manifolds,
+                    args.m or preset["m"],
+                    args.n or preset["n"],
+                    args.dtype or preset["dtype"],
+                    max_bytes=args.max_bytes,
+                    min_time=args.min_time
+        )
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump({"environment": environment(), "results": current},
+                          file, indent=1)
+        if not args.baseline:
+            return 0
+        baseline = load_results(args.baseline)
+
+    rows = compare(baseline, current, args.threshold)
+    print_comparison(rows)
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
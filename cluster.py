@@ -0,0 +1,170 @@
+from numpy import argmin, asarray, bincount, empty, full, inf, intp, isnan, \
+    load, minimum, zeros
+from numpy.random import default_rng
+
+
+class ManifoldKMeans:
+    '''
+        k-means clustering by geodesic distance on any Manifold. Points are
+        assigned to their nearest centre through the blocked pairwise
+        distance kernel of the manifold, and centres are updated with the
+        batched Frechet mean of their points.
+
+        fit clusters an in-memory array. fit_minibatch streams batches from an
+        array, a memory-mapped array or an .npy file, moving each centre
+        towards the mean of its points in the batch, so that data larger than
+        memory can be clustered.
+    '''
+
+    def __init__(self, manifold, n_clusters, max_iter=100, tol=1e-8,
+                 mean_iter=10, block_size=4096, seed=0):
+        '''
+
+        :param manifold: Manifold on which the points lie
+        :param n_clusters: number of clusters
+        :param max_iter: maximum number of assignment / update iterations of fit
+        :param tol: fit stops when no centre moves further than tol
+        :param mean_iter: maximum Frechet mean iterations per centre update
+        :param block_size: rows and columns per block of pairwise distances
+        :param seed: seed of the random initialisation and batch order
+        '''
+        self.manifold = manifold
+        self.n_clusters = n_clusters
+        self.max_iter = max_iter
+        self.tol = tol
+        self.mean_iter = mean_iter
+        self.block_size = block_size
+        self.rng = default_rng(seed)
+        self.centers = None
+        self.counts = None
+
+    def _nearest_center(self, points):
+        '''
+        Nearest centre of each point
+        :param points: (N, n_dims+1) np.array
+        :return: ((N,) np.array of labels, (N,) np.array of distances to the
+                 nearest centre)
+        '''
+        labels = zeros(points.shape[0], dtype=intp)
+        distances = full(points.shape[0], inf)
+        for rows, cols, block in self.manifold.iter_pairwise_distance(
+                                points, self.centers, block_size=self.block_size):
+            block_labels = argmin(block, axis=1)
+            block_distances = block[range(block.shape[0]), block_labels]
+            is_closer = block_distances < distances[rows]
+            labels[rows][is_closer] = block_labels[is_closer] + cols.start
+            distances[rows][is_closer] = block_distances[is_closer]
+        return labels, distances
+
+    def _init_centers(self, points):
+        '''
+        k-means++ initialisation: each new centre is drawn with probability
+        proportional to the squared distance to the nearest chosen centre.
+        :param points: (N, n_dims+1) np.array, N >= n_clusters
+        :return: (n_clusters, n_dims+1) np.array of initial centres
+        '''
+        if points.shape[0] < self.n_clusters:
+            raise ValueError("Need at least {} points, got {}".format(
+                                            self.n_clusters, points.shape[0]))
+        centers = empty((self.n_clusters, points.shape[1]), dtype=points.dtype)
+        centers[0] = points[self.rng.integers(points.shape[0])]
+        sq_distances = full(points.shape[0], inf)
+        for i in range(1, self.n_clusters):
+            new_distances = self.manifold.pairwise_distance(
+                                                points, centers[i-1:i])[:, 0]
+            minimum(sq_distances, new_distances**2, out=sq_distances)
+            total = sq_distances.sum()
+            if total > 0.:
+                chosen = self.rng.choice(points.shape[0], p=sq_distances/total)
+            else:
+                chosen = self.rng.integers(points.shape[0])
+            centers[i] = points[chosen]
+        return centers
+
+    def _update_centers(self, points, labels):
+        '''
+        Frechet mean of the points of each cluster. Clusters without points
+        keep their centre.
+        :param points: (N, n_dims+1) np.array
+        :param labels: (N,) np.array, the cluster of each point
+        :return: (n_clusters, n_dims+1) np.array of cluster means
+        '''
+        means = self.manifold.frechet_mean(
+                                            points,
+                                            groups=labels,
+                                            n_groups=self.n_clusters,
+                                            max_iter=self.mean_iter
+        )
+        is_empty = isnan(means).any(axis=1)
+        means[is_empty] = self.centers[is_empty]
+        return means
+
+    def fit(self, points):
+        '''
+        Cluster points with batch (Lloyd) iterations
+        :param points: (N, n_dims+1) np.array
+        :return: self, with centers, labels_ and inertia_ set
+        '''
+        points = asarray(points)
+        self.centers = self._init_centers(points)
+        for _ in range(self.max_iter):
+            labels, _ = self._nearest_center(points)
+            new_centers = self._update_centers(points, labels)
+            shift = self.manifold.distance(self.centers, new_centers)
+            self.centers = new_centers
+            if shift.max() <= self.tol:
+                break
+        self.labels_, distances = self._nearest_center(points)
+        self.inertia_ = float((distances**2).sum())
+        self.counts = bincount(self.labels_, minlength=self.n_clusters)
+        return self
+
+    def predict(self, points):
+        '''
+        Label each point with its nearest centre
+        :param points: (N, n_dims+1) np.array
+        :return: (N,) np.array of cluster labels
+        '''
+        return self._nearest_center(asarray(points))[0]
+
+    def partial_fit(self, batch):
+        '''
+        Mini-batch update: move each centre along the geodesic towards the
+        Frechet mean of its points in batch, by the fraction of all points
+        seen by that centre that are in the batch.
+        :param batch: (b, n_dims+1) np.array
+        :return: self
+        '''
+        batch = asarray(batch)
+        if self.centers is None:
+            self.centers = self._init_centers(batch)
+            self.counts = zeros(self.n_clusters, dtype=intp)
+        labels, _ = self._nearest_center(batch)
+        batch_counts = bincount(labels, minlength=self.n_clusters)
+        has_points = batch_counts > 0
+        self.counts += batch_counts
+
+        batch_means = self._update_centers(batch, labels)[has_points]
+        step_size = batch_counts[has_points]/self.counts[has_points]
+        centers = self.centers[has_points]
+        self.centers[has_points] = self.manifold.exp_log_roundtrip(
+                                centers, batch_means, step_size.reshape(-1, 1))
+        return self
+
+    def fit_minibatch(self, source, batch_size=65536, n_epochs=1):
+        '''
+        Cluster points streamed in batches, holding only one batch in memory
+        :param source: (N, n_dims+1) np.array or np.memmap, or the path of an
+                       .npy file, which is memory-mapped rather than loaded
+        :param batch_size: number of points per batch
+        :param n_epochs: number of passes over the data
+        :return: self
+        '''
+        if isinstance(source, str) or hasattr(source, "__fspath__"):
+            source = load(source, mmap_mode="r")
+        n_points = source.shape[0]
+        batch_starts = list(range(0, n_points, batch_size))
+        for _ in range(n_epochs):
+            for start in self.rng.permutation(batch_starts):
+                self.partial_fit(asarray(source[start:start + batch_size]))
+        return self
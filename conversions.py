@@ -0,0 +1,111 @@
+'''
+    Vectorised conversions of points between the models of hyperbolic space:
+    the Hyperboloid (Lorentz) model in n+1 coordinates, and the PoincareBall
+    and Klein models in n coordinates. Every converter can write into a
+    preallocated out buffer, so that tables of embeddings can be converted
+    without intermediate copies of the output.
+'''
+from numpy import add, divide, einsum, empty, multiply, reshape, sqrt, subtract
+
+
+def _squared_norm(points):
+    '''
+    :param points: (m, n) np.array
+    :return: (m, 1) np.array, the squared Euclidean norm of each row
+    '''
+    return reshape(einsum("ai,ai->a", points, points), (-1, 1))
+
+
+def _output(points, out, n_cols):
+    '''
+    Check or allocate the output buffer of a conversion
+    :param points: (m, k) np.array, the input points
+    :param out: (m, n_cols) np.array or None
+    :param n_cols: number of coordinates of the output model
+    :return: (m, n_cols) np.array
+    '''
+    shape = (points.shape[0], n_cols)
+    if out is None:
+        return empty(shape, dtype=points.dtype)
+    if out.shape != shape:
+        raise ValueError("out has shape {}, expected {}".format(out.shape, shape))
+    return out
+
+
+def hyperboloid_to_poincare(points, out=None):
+    '''
+    Stereographic projection of hyperboloid points onto the Poincare ball:
+    p = x^i/(1 + x^0)
+    :param points: (m, n+1) np.array, m points on the hyperboloid
+    :param out: optional (m, n) np.array to write the result into
+    :return: (m, n) np.array, m points in the Poincare ball
+    '''
+    out = _output(points, out, points.shape[1] - 1)
+    return divide(points[:, 1:], 1. + points[:, :1], out=out)
+
+
+def poincare_to_hyperboloid(points, out=None):
+    '''
+    Inverse of hyperboloid_to_poincare:
+    x = (1 + |p|^2, 2p)/(1 - |p|^2)
+    :param points: (m, n) np.array, m points in the Poincare ball
+    :param out: optional (m, n+1) np.array to write the result into
+    :return: (m, n+1) np.array, m points on the hyperboloid
+    '''
+    out = _output(points, out, points.shape[1] + 1)
+    sq_norm = _squared_norm(points)
+    inv_denominator = 1./(1. - sq_norm)
+    multiply(points, 2.*inv_denominator, out=out[:, 1:])
+    multiply(add(1., sq_norm, out=sq_norm), inv_denominator, out=out[:, :1])
+    return out
+
+
+def hyperboloid_to_klein(points, out=None):
+    '''
+    Gnomonic projection of hyperboloid points onto the Klein ball:
+    k = x^i/x^0
+    :param points: (m, n+1) np.array, m points on the hyperboloid
+    :param out: optional (m, n) np.array to write the result into
+    :return: (m, n) np.array, m points in the Klein ball
+    '''
+    out = _output(points, out, points.shape[1] - 1)
+    return divide(points[:, 1:], points[:, :1], out=out)
+
+
+def klein_to_hyperboloid(points, out=None):
+    '''
+    Inverse of hyperboloid_to_klein:
+    x = (1, k)/sqrt(1 - |k|^2)
+    :param points: (m, n) np.array, m points in the Klein ball
+    :param out: optional (m, n+1) np.array to write the result into
+    :return: (m, n+1) np.array, m points on the hyperboloid
+    '''
+    out = _output(points, out, points.shape[1] + 1)
+    gamma = 1./sqrt(subtract(1., _squared_norm(points)))
+    out[:, :1] = gamma
+    multiply(points, gamma, out=out[:, 1:])
+    return out
+
+
+def poincare_to_klein(points, out=None):
+    '''
+    k = 2p/(1 + |p|^2)
+    :param points: (m, n) np.array, m points in the Poincare ball
+    :param out: optional (m, n) np.array to write the result into.
+                May be points itself.
+    :return: (m, n) np.array, m points in the Klein ball
+    '''
+    out = _output(points, out, points.shape[1])
+    return multiply(points, 2./(1. + _squared_norm(points)), out=out)
+
+
+def klein_to_poincare(points, out=None):
+    '''
+    p = k/(1 + sqrt(1 - |k|^2))
+    :param points: (m, n) np.array, m points in the Klein ball
+    :param out: optional (m, n) np.array to write the result into.
+                May be points itself.
+    :return: (m, n) np.array, m points in the Poincare ball
+    '''
+    out = _output(points, out, points.shape[1])
+    return divide(points, 1. + sqrt(1. - _squared_norm(points)), out=out)
@@ -0,0 +1,180 @@
+from backend import sharded
+from manifold import Manifold
+from metric import EuclideanMetric
+from numpy import add, einsum, maximum, multiply, ones, sqrt, subtract, \
+    zeros, zeros_like
+
+
+class Euclidean(Manifold):
+    '''
+        Flat Euclidean space R^n, mainly as a factor of ProductManifold.
+        Points and tangent vectors have n coordinates, geodesics are straight
+        lines and parallel transport is the identity.
+    '''
+    curvature = 0.
+
+    def __init__(self, n_dims):
+        '''
+
+        :param n_dims: dimensions of the space
+        '''
+        self.n_dims = n_dims
+        self.metric = EuclideanMetric(n_dims)
+
+    def is_on_manifold(self, point):
+        '''
+        Every point of R^n is on the manifold
+        :param point: (m, n_dims) np.array, representing m points
+        :return: (m, 1) np.array of True
+        '''
+        return ones((point.shape[0], 1), dtype=bool)
+
+    def is_in_tangent_space(self, point, vector):
+        '''
+        Every vector of R^n is in the tangent space of every point
+        :param point: (m, n_dims) np.array, representing m points
+        :param vector: (m, n_dims) np.array, representing m vectors
+        :return: (m, 1) np.array of True
+        '''
+        return ones((vector.shape[0], 1), dtype=bool)
+
+    def _tangent_residual(self, point, vector):
+        '''
+        Every vector is in the tangent space, for validation
+        :return: (m, 1) np.array of zeros
+        '''
+        return zeros(vector.shape[:-1] + (1,))
+
+    @sharded(n_cols=1)
+    def distance(self, u, v):
+        '''
+        Calculate the distance between two points, |u - v|
+        :param u, v:, (m, n_dims) np.arrays, each representing m vectors:
+        :return: (m, 1) dimensional np.array, the distance between u and v
+        '''
+        return self.metric.norm(u - v)
+
+    def _distance_from_gram(self, gram, X, Y):
+        '''
+        Convert, in place, a matrix of dot products between points into the
+        matrix of distances between them, |x - y|^2 = |x|^2 + |y|^2 - 2 x.y
+        :param gram: (m, k) np.array, dot products between m and k points.
+                     Overwritten with the distances.
+        :param X, Y: (m, n_dims) and (k, n_dims) np.arrays, the points
+        :return: gram
+        '''
+        gram *= -2.
+        gram += einsum("ai,ai->a", X, X)[:, None]
+        gram += einsum("bi,bi->b", Y, Y)[None, :]
+        # Rounding can make squared distances of nearby points negative
+        maximum(gram, 0., out=gram)
+        return sqrt(gram, out=gram)
+
+    @sharded(skipped="vector")
+    def project_to_tangent_space(self, point, vector, out=None,
+                                 workspace=None):
+        '''
+        Tangent spaces are R^n itself, so vector is unchanged
+        :param point: (m, n_dims) np.array, representing m points
+        :param vector: (m, n_dims) np.array, representing m vectors
+        :param out: optional (m, n_dims) np.array to write the result into
+        :param workspace: unused
+        :return: (m, n_dims) np.array, a copy of vector
+        '''
+        if out is None:
+            return vector.copy()
+        out[...] = vector
+        return out
+
+    @sharded(skipped="point")
+    def exponential_map(self, point, v_TpS, out=None, workspace=None):
+        '''
+        Follow the straight line in direction v_TpS from point
+        :param point: (m, n_dims) np.array, representing m points
+        :param v_TpS: (m, n_dims) np.array, representing m vectors
+        :param out: optional (m, n_dims) np.array to write the result into.
+                    May be point itself.
+        :param workspace: unused
+        :return: (m, n_dims) np.array, point + v_TpS
+        '''
+        return add(point, v_TpS, out=out)
+
+    @sharded()
+    def logarithmic_map(self, point0, point1, out=None):
+        '''
+        Inverse of exponential map
+        :param point0: (m, n_dims) np.array, representing m "base" points
+        :param point1: (m, n_dims) np.array, representing m "target" points
+        :param out: optional (m, n_dims) np.array to write the result into
+        :return: (m, n_dims) np.array, point1 - point0
+        '''
+        return subtract(point1, point0, out=out)
+
+    def log_map_with_distance(self, point0, point1, out=None):
+        '''
+        Logarithmic map and its norm, the distance
+        :param point0: (m, n_dims) np.array, representing m "base" points
+        :param point1: (m, n_dims) np.array, representing m "target" points
+        :param out: optional (m, n_dims) np.array to write the logarithmic
+                    map into
+        :return: ((m, n_dims) np.array, point1 - point0,
+                 (m, 1) np.array, the distances between the points)
+        '''
+        v_Tp0M = subtract(point1, point0, out=out)
+        return v_Tp0M, self.metric.norm(v_Tp0M)
+
+    @sharded(skipped="point0")
+    def exp_log_roundtrip(self, point0, point1, t=1., out=None):
+        '''
+        Linear interpolation, point0 + t (point1 - point0)
+        :param point0: (m, n_dims) np.array, representing m "base" points
+        :param point1: (m, n_dims) np.array, representing m "target" points
+        :param t: float or (m, 1) np.array of fractions of the segments
+        :param out: optional (m, n_dims) np.array to write the result into.
+                    May be point0 itself.
+        :return: (m, n_dims) np.array, m points
+        '''
+        step = t*(point1 - point0)
+        return add(point0, step, out=out)
+
+    def _geodesic_interpolator(self, point0, point1):
+        '''
+        Linear interpolation at any number of times, see Manifold.geodesic
+        '''
+        diff = point1 - point0
+
+        def interpolate(t, out):
+            multiply(t[None, :, None], diff[:, None, :], out=out)
+            out += point0[:, None, :]
+            return out
+        return interpolate
+
+    def project_to_manifold(self, point):
+        '''
+        Every point of R^n is on the manifold
+        :param point: (m, n_dims) np.array, representing m points
+        :return: (m, n_dims) np.array, a copy of point
+        '''
+        return point.copy()
+
+    @sharded(skipped="vec_Tp0M")
+    def parallel_transport(self, vec_Tp0M, point_0, point_1):
+        '''
+        Parallel transport in flat space leaves vectors unchanged
+        :param vec_Tp0M: (m, n_dims) np.array, vector in Tp0M to transport
+        :param point_0: initial point where vec_Tp0M
+        :param point_1: final point to which vec_Tp0M will be transported
+        :return: (m, n_dims) np.array, a copy of vec_Tp0M
+        '''
+        return vec_Tp0M.copy()
+
+    def transport_factors(self, point_0, point_1):
+        '''
+        Parallel transport leaves vectors unchanged: both factors are zero,
+        see Manifold.transport_factors
+        :param point_0: (m, n_dims) np.array, representing m initial points
+        :param point_1: (m, n_dims) np.array, representing m final points
+        :return: image, covector: (m, n_dims) np.arrays of zeros
+        '''
+        image = zeros_like(point_0)
+        return image, image
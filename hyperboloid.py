@@ -1,13 +1,52 @@
-from manifold import Manifold
+from backend import sharded
+import kernels
+from manifold import Manifold, _eps, _group_arguments, _group_sum
 from metric import MinkowskiMetric
-from numpy import arccosh, cosh, finfo, float64, isclose, logical_and, \
-    ones_like, reshape, sinh, where, zeros_like
+from numpy import absolute, add, arccosh, cosh, einsum, inf, isclose, \
+    log1p, logical_and, maximum, multiply, nan, negative, ones_like, sinh, \
+    sqrt, subtract, where
+from validation import validated
+
+
+def _arccosh1p(x):
+    '''
+    arccosh(1 + x) = log1p(x + sqrt(x (x + 2))), accurate for small x where
+    forming 1 + x first would lose its low digits
+    :param x: np.array of non-negative values
+    :return: np.array, arccosh(1 + x)
+    '''
+    return log1p(x + sqrt(x*(x + 2.)))
+
+
+# Largest cosh(d) - 1 computed from the chord of the points by the
+# logarithmic map, beyond which the exact form -point0.point1 - 1 is used
+CHORD_LOG_MAX = 0.5
+
+
+def _sinh_coefficients(dist, sinh_dist, t, eps):
+    '''
+    Coefficients of the end points in the interpolation
+    (sinh((1 - t) d) point0 + sinh(t d) point1)/sinh(d). Equal points
+    interpolate linearly.
+    :param dist, sinh_dist: np.arrays of the lengths of the geodesics and
+                            their sinh
+    :param t: np.array of times, broadcasting against dist
+    :param eps: machine epsilon of the points
+    :return: (coefficients of point0, coefficients of point1)
+    '''
+    is_good = sinh_dist > eps
+    safe_sinh = where(is_good, sinh_dist, 1.)
+    coeff_0 = where(is_good, sinh((1. - t)*dist)/safe_sinh, 1. - t)
+    coeff_1 = where(is_good, sinh(t*dist)/safe_sinh, t)
+    return coeff_0, coeff_1
+
 
 class Hyperboloid(Manifold):
     '''
         Hyperboloid manifolds. Assumes n-dimensional
         manifold is embedded in an (n+1)-dimensional ambient space.
     '''
+    curvature = -1.
 
     def __init__(self, n_dims):
         '''
@@ -26,27 +65,74 @@ class Hyperboloid(Manifold):
         :return: (m, 1) np.array of booleans
         '''
         dot_pp = self.metric.dot(point, point)
+        # Rounding of the dot product grows with the squares of the
+        # coordinates, which matters far from the origin in float32
+        rounding = 16.*_eps(point)*point[..., :1]**2
         return logical_and(
-                            reshape(point[:, 0] > 0, (-1, 1)),
-                            isclose(dot_pp, -ones_like(dot_pp))
+                            point[..., :1] > 0,
+                            isclose(dot_pp, -ones_like(dot_pp), atol=1e-8 + rounding)
         )
 
+    def _manifold_residual(self, point):
+        '''
+        |point.point + 1|, relative to the rounding of the dot product, which
+        grows with the square of the timelike coordinate, for validation.
+        Points of the lower sheet have infinite residuals.
+        :param point: (m, n_dims+1) np.array, representing m points
+        :return: (m, 1) np.array, 0 for points on the hyperboloid
+        '''
+        time = point[..., :1]
+        return where(time > 0,
+                     absolute(self.metric.dot(point, point) + 1.)/time**2, inf)
+
+    @validated(points=("u", "v"))
+    @sharded(n_cols=1)
     def distance(self, u, v):
         '''
         Calculate the distance on the manifold between two points.
-        Check if point on manifold, then insist on mini
+        Since -u.v = 1 + (u - v).(u - v)/2, d = arccosh(1 + (u - v).(u - v)/2)
+        is computed from the difference of the points. Unlike arccosh(-u.v),
+        this resolves small distances in the type of u and v, so float32
+        points can be used.
         :param u, v:, (m, n_dims) np.arrays, each representing m vectors:
         :return: (m, 1) dimensional np.array, the distance between u and v
         '''
-        # todo: implement check whether points on manifold or not
-        neg_dot_uv = -self.metric.dot(u, v)
-        return where(
-                        neg_dot_uv > 1.,
-                        arccosh(neg_dot_uv),
-                        zeros_like(neg_dot_uv)
-                    )
+        if kernels.applies(u, v):
+            return kernels.hyperboloid_distance(u, v)
+        diff = u - v
+        # The chord is spacelike, up to rounding
+        return _arccosh1p(0.5*maximum(self.metric.dot(diff, diff), 0.))
 
-    def project_to_tangent_space(self, point, vector):
+    def _distance_from_gram(self, gram, X, Y):
+        '''
+        Convert, in place, a matrix of Minkowski dot products between points
+        into the matrix of distances between them.
+        :param gram: (m, k) np.array, dot products between m and k points.
+                     Overwritten with the distances.
+        :param X, Y: (m, n_dims+1) and (k, n_dims+1) np.arrays, the points.
+                     Unused, as the dot products determine the distances.
+        :return: gram
+        '''
+        # Distances below about sqrt(eps) are not resolved by dot products:
+        # distance() is exact for them.
+        negative(gram, out=gram)
+        # Rounding can push -u.v of nearby points below 1
+        maximum(gram, 1., out=gram)
+        return arccosh(gram, out=gram)
+
+    def _tangent_norm(self, vector):
+        '''
+        Norm of tangent vectors. Tangent vectors of the hyperboloid are
+        spacelike, so their squared norm is only negative through rounding
+        and is clamped at zero rather than producing nan.
+        :param vector: (m, n_dims+1) np.array, m vectors in tangent spaces
+        :return: (m, 1) np.array, the norm of each vector
+        '''
+        return sqrt(maximum(self.metric.dot(vector, vector), 0.))
+
+    @sharded(skipped="vector")
+    def project_to_tangent_space(self, point, vector, out=None,
+                                 workspace=None):
         '''
         Project vector into tangent space of point.
         Since point is on hyperboloid, point.point = -1
@@ -54,13 +140,27 @@ class Hyperboloid(Manifold):
                         hyperboloid:
         :param vector: (m, n_dims) np.array, representing m vectors in ]
                         (n+1)-dimensional ambient space
+        :param out: optional (m, n_dims) np.array to write the result into.
+                    May be vector itself.
+        :param workspace: optional (m, n_dims) np.array used as scratch
+                          space, to avoid allocating a temporary
         :return: (m, n_dims) np.array, representing m vectors projected to
                 tangent spaces of point
         '''
-        return vector + self.metric.dot(point, vector)*point
+        return add(
+                    vector,
+                    multiply(
+                                self.metric.dot(point, vector),
+                                point,
+                                out=workspace
+                    ),
+                    out=out
+        )
 
 
-    def exponential_map(self, point, v_TpS):
+    @validated(points=("point",), vectors=(("v_TpS", "point"),))
+    @sharded(skipped="point")
+    def exponential_map(self, point, v_TpS, out=None, workspace=None):
         '''
         Follow geodesic in direction v_TpS from point and
         return the resulting point.
@@ -68,44 +168,149 @@ class Hyperboloid(Manifold):
         :param point: (m, n_dims+1) np.array,  m points on the hyperboloid:
         :param v_TpS: (m, n_dims+1) np.array, m vectors projected to tangent
                        spaces of point:
+        :param out: optional (m, n_dims+1) np.array to write the result into.
+                    May be point itself.
+        :param workspace: optional (m, n_dims+1) np.array used as scratch
+                          space, to avoid allocating a temporary
         :return: (m, n_dims+1) np.array, m points on the hyperboloid along the
                 geodesic chosen by v_TpS
         '''
-        # todo: check whether vector is in tangent space
+        if kernels.applies(point, v_TpS):
+            return kernels.hyperboloid_exponential_map(point, v_TpS,
+                                                       _eps(v_TpS), out=out)
 
-        norm_v_TpS = self.metric.norm(v_TpS)
-        # If v_TpS has zero norm, return the original point.
-        # Correct behaviour and avoids division by zero in following calculation
-        return where(
-                        norm_v_TpS < finfo(float64).eps,
-                        point,
-                        cosh(norm_v_TpS) * point +
-                                           sinh(norm_v_TpS) * (v_TpS/norm_v_TpS)
-                     )
+        norm_v_TpS = self._tangent_norm(v_TpS)
+        # If v_TpS has zero norm, return the original point: the coefficients
+        # become (1, 0), which also avoids division by zero. Only the (m, 1)
+        # coefficients go through where, not the (m, n_dims+1) branches.
+        is_zero = norm_v_TpS < _eps(v_TpS)
+        coeff_point = where(is_zero, 1., cosh(norm_v_TpS))
+        coeff_v = where(
+                            is_zero,
+                            0.,
+                            sinh(norm_v_TpS)/where(is_zero, 1., norm_v_TpS)
+        )
+        step = multiply(coeff_v, v_TpS, out=workspace)
+        out = multiply(coeff_point, point, out=out)
+        return add(out, step, out=out)
 
-    def logarithmic_map(self, point0, point1):
+    @validated(points=("point0", "point1"))
+    @sharded()
+    def logarithmic_map(self, point0, point1, out=None):
         '''
-        Inverse of exponential map
+        Inverse of exponential map, see log_map_with_distance
 
         :param point0: (m, n_dims) np.array, representing m "base" points:
         :param point1: (m, n_dims) np.array, representing m "target" points
+        :param out: optional (m, n_dims) np.array to write the result into.
+                    Must not overlap point0 or point1.
         :return: (m, n_dims) np.array, m vectors in tangent spaces of point0,
                 that would yield point1 if inserted in exponential map
         '''
-        dot01 = self.metric.dot(point0, point1)
-        v_Tp0M = point1 + dot01 * point0
-        dist = self.distance(point0, point1)
-        norm_v_Tp0M = self.metric.norm(v_Tp0M)
+        return self.log_map_with_distance(point0, point1, out=out)[0]
 
-        # If v_Tp0M has zero norm, return the original point.
-        v_Tp0M_is_good = norm_v_Tp0M > finfo(float64).eps
+    @validated(points=("point0", "point1"))
+    def log_map_with_distance(self, point0, point1, out=None):
+        '''
+        Logarithmic map and distance, sharing the Minkowski dot products.
+        The tangent vector is v = (point1 - point0) - x point0, with
+        x = cosh(d) - 1, whose norm is sinh(d) = sqrt(x (x + 2)). For nearby
+        points x = (point1 - point0).(point1 - point0)/2 is computed from
+        the chord, avoiding the cancellation of -point0.point1 - 1. Beyond
+        CHORD_LOG_MAX the exact form x = -point0.point1 - 1 is used instead,
+        as only it keeps v tangent to rounding for distant points, which
+        the pole ladder relies on.
+
+        :param point0: (m, n_dims) np.array, representing m "base" points:
+        :param point1: (m, n_dims) np.array, representing m "target" points
+        :param out: optional (m, n_dims) np.array to write the logarithmic
+                    map into. Must not overlap point0 or point1.
+        :return: ((m, n_dims) np.array, m vectors in tangent spaces of point0,
+                 (m, 1) np.array, the distances between the points)
+        '''
+        if kernels.applies(point0, point1):
+            return kernels.hyperboloid_log_map_with_distance(
+                                            point0, point1, _eps(point0), out=out)
+        v_Tp0M = subtract(point1, point0, out=out)
+        cosh_dist_m1 = 0.5*maximum(self.metric.dot(v_Tp0M, v_Tp0M), 0.)
+        cosh_dist_m1 = where(cosh_dist_m1 < CHORD_LOG_MAX, cosh_dist_m1,
+                             -self.metric.dot(point0, point1) - 1.)
+        v_Tp0M -= cosh_dist_m1*point0
+        dist = _arccosh1p(cosh_dist_m1)
+        norm_v_Tp0M = sqrt(cosh_dist_m1*(cosh_dist_m1 + 2.))
+
+        # If v_Tp0M has zero norm, return it unscaled.
+        v_Tp0M_is_good = norm_v_Tp0M > _eps(v_Tp0M)
         # self.is_in_tangent_space(point0, v_Tp0M)
-        return where(
-            v_Tp0M_is_good,
-            v_Tp0M * (dist / norm_v_Tp0M),
-            v_Tp0M,
-        )
+        safe_norm = where(v_Tp0M_is_good, norm_v_Tp0M, 1.)
+        scale = where(v_Tp0M_is_good, dist/safe_norm, 1.)
+        return multiply(v_Tp0M, scale, out=v_Tp0M), dist
 
+    @validated(points=("point0", "point1"))
+    @sharded(skipped="point0")
+    def exp_log_roundtrip(self, point0, point1, t=1., out=None):
+        '''
+        exp(point0, t log(point0, point1)) in closed form:
+        (sinh((1 - t) d) point0 + sinh(t d) point1)/sinh(d)
+
+        :param point0: (m, n_dims+1) np.array, representing m "base" points
+        :param point1: (m, n_dims+1) np.array, representing m "target" points
+        :param t: float or (m, 1) np.array of fractions of the geodesics
+        :param out: optional (m, n_dims+1) np.array to write the result into.
+                    May be point0 itself.
+        :return: (m, n_dims+1) np.array, m points on the hyperboloid
+        '''
+        dist, sinh_dist = self._arc(point0, point1)
+        coeff_0, coeff_1 = _sinh_coefficients(dist, sinh_dist, t, _eps(point0))
+        step = coeff_1*point1
+        out = multiply(coeff_0, point0, out=out)
+        return add(out, step, out=out)
+
+    def _arc(self, point0, point1):
+        '''
+        Length of the geodesics between point0 and point1, and its sinh,
+        from the chord point1 - point0
+        :return: ((m, 1) np.array, (m, 1) np.array), the distances and their
+                 sinh
+        '''
+        diff = point1 - point0
+        cosh_dist_m1 = 0.5*maximum(self.metric.dot(diff, diff), 0.)
+        return (_arccosh1p(cosh_dist_m1),
+                sqrt(cosh_dist_m1*(cosh_dist_m1 + 2.)))
+
+    def _geodesic_interpolator(self, point0, point1):
+        '''
+        Interpolation at any number of times, from the lengths of the
+        geodesics computed once, see Manifold.geodesic
+        '''
+        dist, sinh_dist = self._arc(point0, point1)
+        eps = _eps(point0)
+
+        def interpolate(t, out):
+            coeff_0, coeff_1 = _sinh_coefficients(
+                                    dist[..., None, :], sinh_dist[..., None, :],
+                                    t[:, None], eps)
+            multiply(coeff_0, point0[..., None, :], out=out)
+            out += coeff_1*point1[..., None, :]
+            return out
+        return interpolate
+
+    def project_to_manifold(self, point):
+        '''
+        Map ambient points onto the hyperboloid by recomputing the timelike
+        component from the spacelike ones, x^0 = sqrt(1 + (x^i)^2). This is
+        defined for every ambient point.
+        :param point: (m, n_dims+1) np.array, representing m ambient points
+        :return: (m, n_dims+1) np.array, m points on the hyperboloid
+        '''
+        projected = point.copy()
+        projected[..., 0] = sqrt(
+                    1. + einsum("...i,...i->...", point[..., 1:], point[..., 1:]))
+        return projected
+
+    @validated(points=("point_0", "point_1"),
+               vectors=(("vec_Tp0M", "point_0"),))
+    @sharded(skipped="vec_Tp0M")
     def parallel_transport(self, vec_Tp0M, point_0, point_1):
         '''
         Parallel transport vector in tangent space of point 0 (Tp0M) to the
@@ -116,15 +321,89 @@ class Hyperboloid(Manifold):
         :param n_steps: number of steps to break pole transport into
         :return: vec_Tp0M after parallel transport to point 1
         '''
-        dirn = self.logarithmic_map(point_0, point_1)
-        norm_dirn = self.metric.norm(dirn)
-        unit_dirn = where(
-                norm_dirn > finfo(float64).eps,
-                dirn / norm_dirn,
-                dirn
-        )
+        if kernels.applies(vec_Tp0M, point_0, point_1):
+            return kernels.hyperboloid_parallel_transport(vec_Tp0M, point_0,
+                                                          point_1, _eps(vec_Tp0M))
+        dirn, norm_dirn = self.log_map_with_distance(point_0, point_1)
+        unit_dirn = dirn/where(norm_dirn > _eps(dirn), norm_dirn, 1.)
         parallel_comp = self.metric.dot(vec_Tp0M, unit_dirn)
         vec_Tp1M = vec_Tp0M + parallel_comp * (
                  sinh(norm_dirn) * point_0 + (cosh(norm_dirn) - 1.) * unit_dirn)
 
-        return vec_Tp1M
\ No newline at end of file
+        return vec_Tp1M
+
+    def transport_factors(self, point_0, point_1):
+        '''
+        Closed form parallel transport as the rank one boost of the
+        component along the geodesic, see parallel_transport and
+        Manifold.transport_factors
+        :param point_0: (m, n_dims+1) np.array, representing m initial points
+        :param point_1: (m, n_dims+1) np.array, representing m final points
+        :return: image, covector: (m, n_dims+1) np.arrays
+        '''
+        dirn, norm_dirn = self.log_map_with_distance(point_0, point_1)
+        unit_dirn = dirn/where(norm_dirn > _eps(dirn), norm_dirn, 1.)
+        image = sinh(norm_dirn)*point_0 + (cosh(norm_dirn) - 1.)*unit_dirn
+        return image, self.metric.lower_index(unit_dirn)
+
+    def lorentzian_centroid(self, points, weights=None, groups=None,
+                            n_groups=None):
+        '''
+        Closed-form centroid of points in the Lorentz model: the weighted sum
+        of the points, rescaled back onto the hyperboloid. It minimises the
+        weighted sum of squared Lorentzian distances, and is a cheap
+        approximation of the Frechet mean.
+        :param points: (N, n_dims+1) np.array, the points to average
+        :param weights: optional (N,) or (N, 1) np.array of non-negative
+                        weights. Defaults to equal weights.
+        :param groups: optional (N,) np.array of ints in [0, n_groups), the
+                       group of each point. Defaults to a single group.
+        :param n_groups: number of groups. Defaults to max(groups) + 1.
+        :return: (n_groups, n_dims+1) np.array, the centroid of each group.
+                 Groups without points have nan centroids.
+        '''
+        weights, groups, n_groups = _group_arguments(
+                                            points, weights, groups, n_groups)
+        centroid = _group_sum(weights*points, groups, n_groups)
+        sq_norm = -self.metric.dot(centroid, centroid)
+        # Groups without points, or without weight, sum to zero
+        is_empty = sq_norm <= 0.
+        centroid /= sqrt(where(is_empty, 1., sq_norm))
+        centroid[is_empty[:, 0]] = nan
+        return centroid
+
+    def _initial_mean(self, points, weights, groups, n_groups):
+        '''
+        Start the Frechet mean iteration from the Lorentzian centroid
+        '''
+        return self.lorentzian_centroid(points, weights, groups, n_groups)
+
+    def frechet_mean(self, points, weights=None, groups=None, n_groups=None,
+                     max_iter=100, tol=1e-10, method="karcher"):
+        '''
+        Frechet mean of points, or of many groups of points at once.
+        :param points: (N, n_dims+1) np.array, the points to average
+        :param weights: optional (N,) or (N, 1) np.array of non-negative
+                        weights. Defaults to equal weights.
+        :param groups: optional (N,) np.array of ints in [0, n_groups), the
+                       group of each point. Defaults to a single group.
+        :param n_groups: number of groups. Defaults to max(groups) + 1.
+        :param max_iter: maximum number of fixed-point iterations
+        :param tol: a group has converged when the norm of its update is
+                    below tol
+        :param method: "karcher" for the exact fixed-point iteration, or
+                       "centroid" for the closed-form Lorentzian centroid
+        :return: (n_groups, n_dims+1) np.array, the mean of each group
+        '''
+        if method == "centroid":
+            return self.lorentzian_centroid(points, weights, groups, n_groups)
+        elif method != "karcher":
+            raise ValueError("Unknown mean method: {}".format(method))
+        return super().frechet_mean(
+                                    points,
+                                    weights=weights,
+                                    groups=groups,
+                                    n_groups=n_groups,
+                                    max_iter=max_iter,
+                                    tol=tol
+        )
@@ -0,0 +1,270 @@
+from numpy import arange, argsort, asarray, bincount, broadcast_to, \
+    concatenate, cumsum, empty, flatnonzero, float64, full, inf, int64, intp, \
+    lexsort, load, maximum, median, repeat, savez, split, take_along_axis, \
+    unique, where
+from numpy.random import default_rng
+
+# Marks a child pointer of a leaf node
+NO_CHILD = -1
+
+
+class VantagePointTree:
+    '''
+        Vantage-point tree over points on a manifold, using the geodesic
+        distance of the manifold. Since the geodesic distance is a metric,
+        the triangle inequality prunes whole subtrees during k-nearest
+        neighbour and radius queries.
+
+        Each internal node holds a vantage point and the median distance
+        (threshold) from it to the points below the node. Points within the
+        threshold go to the inside child, the rest to the outside child.
+        Leaves hold up to leaf_size points. Blocks of queries descend the
+        tree together: each step compares every query to the vantage point
+        or leaf points of its next node in a single vectorised distance
+        call.
+    '''
+
+    def __init__(self, manifold, points, leaf_size=32, seed=0):
+        '''
+
+        :param manifold: Manifold whose distance is used
+        :param points: (N, n_dims+1) np.array, the points to index
+        :param leaf_size: maximum number of points in a leaf
+        :param seed: seed for the random choice of vantage points
+        '''
+        if leaf_size < 1:
+            raise ValueError("leaf_size must be positive, got {}".format(leaf_size))
+        self.manifold = manifold
+        self.points = asarray(points)
+        self.leaf_size = leaf_size
+        self._build(default_rng(seed))
+
+    def _distances(self, point, indices):
+        '''
+        Geodesic distances from one point to a set of indexed points
+        :param point: (n_dims+1,) np.array
+        :param indices: (k,) np.array of ints, rows of self.points
+        :return: (k,) np.array of distances
+        '''
+        others = self.points[indices]
+        return self.manifold.distance(
+                                        broadcast_to(point, others.shape),
+                                        others
+        )[:, 0]
+
+    def _build(self, rng):
+        '''
+        Build the tree top-down, reordering self.order so that the points
+        below every node are contiguous.
+        :param rng: numpy random Generator used to choose vantage points
+        '''
+        n_points = self.points.shape[0]
+        self.order = rng.permutation(n_points).astype(intp)
+        vantage, threshold, inside, outside, start, stop = [], [], [], [], [], []
+
+        def new_node(node_start, node_stop):
+            vantage.append(NO_CHILD)
+            threshold.append(0.)
+            inside.append(NO_CHILD)
+            outside.append(NO_CHILD)
+            start.append(node_start)
+            stop.append(node_stop)
+            return len(start) - 1
+
+        pending = [new_node(0, n_points)] if n_points else []
+        while pending:
+            node = pending.pop()
+            node_start, node_stop = start[node], stop[node]
+            if node_stop - node_start <= self.leaf_size:
+                continue
+            # The order was shuffled, so the first point is a random choice
+            members = self.order[node_start + 1:node_stop]
+            vantage[node] = self.order[node_start]
+            distances = self._distances(self.points[vantage[node]], members)
+            threshold[node] = median(distances)
+            is_inside = distances <= threshold[node]
+            self.order[node_start + 1:node_stop] = concatenate(
+                                    [members[is_inside], members[~is_inside]])
+            split = node_start + 1 + int(is_inside.sum())
+            inside[node] = new_node(node_start + 1, split)
+            outside[node] = new_node(split, node_stop)
+            pending.extend([inside[node], outside[node]])
+
+        self.vantage = asarray(vantage, dtype=intp)
+        self.threshold = asarray(threshold, dtype=float64)
+        self.inside = asarray(inside, dtype=intp)
+        self.outside = asarray(outside, dtype=intp)
+        self.start = asarray(start, dtype=intp)
+        self.stop = asarray(stop, dtype=intp)
+
+    def _depth(self):
+        '''
+        :return: number of levels of the tree
+        '''
+        depth = 0
+        nodes = asarray([0] if self.start.size else [], dtype=intp)
+        while nodes.size:
+            depth += 1
+            nodes = nodes[self.inside[nodes] != NO_CHILD]
+            nodes = concatenate([self.inside[nodes], self.outside[nodes]])
+        return depth
+
+    def _search(self, queries, radius):
+        '''
+        Depth-first search for the points of the tree within radius of every
+        query at once, nearest subtree first, skipping subtrees that the
+        triangle inequality proves to be out of range. Each query keeps its
+        own stack of nodes, and every round pops one node per query and
+        computes the distances to their vantage points and leaf points in a
+        single distance call.
+        :param queries: (q, n_dims+1) np.array, the query points
+        :param radius: (q,) np.array, the search radius of each query. For
+                       k-nearest neighbour searches the caller shrinks it to
+                       the k-th best distance found so far between rounds.
+        :return: generator of (rows, distances, indices): the query rows,
+                 distances and indexed points found in each round, in the
+                 order of the search of each query
+        '''
+        n_queries = queries.shape[0]
+        if self.start.size == 0 or n_queries == 0:
+            return
+        # A node is popped before its two children are pushed
+        capacity = self._depth() + 1
+        stack_nodes = empty((n_queries, capacity), dtype=intp)
+        stack_bounds = empty((n_queries, capacity), dtype=float64)
+        stack_nodes[:, 0] = 0
+        stack_bounds[:, 0] = 0.
+        stack_size = full(n_queries, 1, dtype=intp)
+        while True:
+            rows = flatnonzero(stack_size)
+            if rows.size == 0:
+                return
+            stack_size[rows] -= 1
+            nodes = stack_nodes[rows, stack_size[rows]]
+            is_open = stack_bounds[rows, stack_size[rows]] <= radius[rows]
+            rows, nodes = rows[is_open], nodes[is_open]
+
+            is_leaf = self.inside[nodes] == NO_CHILD
+            leaf_rows, leaves = rows[is_leaf], nodes[is_leaf]
+            node_rows, nodes = rows[~is_leaf], nodes[~is_leaf]
+            # Vantage points of internal nodes first, then every point of
+            # each leaf
+            sizes = self.stop[leaves] - self.start[leaves]
+            ends = cumsum(sizes)
+            positions = arange(ends[-1] if ends.size else 0) + repeat(
+                                            self.start[leaves] - ends + sizes,
+                                            sizes)
+            candidate_rows = concatenate([node_rows, repeat(leaf_rows, sizes)])
+            candidates = concatenate([self.vantage[nodes],
+                                      self.order[positions]])
+            distances = self.manifold.distance(queries[candidate_rows],
+                                               self.points[candidates])[:, 0]
+
+            to_threshold = distances[:node_rows.size] - self.threshold[nodes]
+            is_near_inside = to_threshold <= 0.
+            # Push the farther child first, so the nearer is searched first
+            for is_inside in (~is_near_inside, is_near_inside):
+                size = stack_size[node_rows]
+                stack_nodes[node_rows, size] = where(
+                            is_inside, self.inside[nodes], self.outside[nodes])
+                stack_bounds[node_rows, size] = maximum(
+                            where(is_inside, to_threshold, -to_threshold), 0.)
+                stack_size[node_rows] += 1
+
+            is_close = distances <= radius[candidate_rows]
+            if is_close.any():
+                yield (candidate_rows[is_close], distances[is_close],
+                       candidates[is_close])
+
+    def query(self, queries, k=1):
+        '''
+        Find the k nearest indexed points of each query point
+        :param queries: (q, n_dims+1) np.array, the query points
+        :param k: number of neighbours
+        :return: ((q, k) np.array of distances, (q, k) np.array of indices
+                 into the indexed points), sorted by increasing distance.
+                 If fewer than k points are indexed, missing entries have
+                 distance inf and index -1.
+        '''
+        queries = asarray(queries)
+        distances = full((queries.shape[0], k), inf)
+        indices = full((queries.shape[0], k), -1, dtype=int64)
+        radius = full(queries.shape[0], inf)
+        for rows, found_distances, found_indices in self._search(queries,
+                                                                 radius):
+            # Lay the points found for each query out in a padded row,
+            # after its k best so far, and keep the k nearest
+            by_row = argsort(rows, kind="stable")
+            rows = rows[by_row]
+            updated, first, counts = unique(rows, return_index=True,
+                                            return_counts=True)
+            columns = k + arange(rows.size) - repeat(first, counts)
+            merged_distances = full((updated.size, k + counts.max()), inf)
+            merged_indices = full(merged_distances.shape, -1, dtype=int64)
+            merged_distances[:, :k] = distances[updated]
+            merged_indices[:, :k] = indices[updated]
+            slots = (repeat(arange(updated.size), counts), columns)
+            merged_distances[slots] = found_distances[by_row]
+            merged_indices[slots] = found_indices[by_row]
+            nearest = argsort(merged_distances, axis=1, kind="stable")[:, :k]
+            distances[updated] = take_along_axis(merged_distances, nearest, 1)
+            indices[updated] = take_along_axis(merged_indices, nearest, 1)
+            radius[updated] = distances[updated, k - 1]
+        return distances, indices
+
+    def query_radius(self, queries, radius):
+        '''
+        Find the indexed points within radius of each query point
+        :param queries: (q, n_dims+1) np.array, the query points
+        :param radius: search radius
+        :return: (list of q np.arrays of distances, list of q np.arrays of
+                 indices into the indexed points), each sorted by increasing
+                 distance
+        '''
+        queries = asarray(queries)
+        found = list(zip(*self._search(queries, full(queries.shape[0], radius))))
+        if not found:
+            return ([empty(0, dtype=float64) for _ in queries],
+                    [empty(0, dtype=intp) for _ in queries])
+        rows, distances, indices = (concatenate(parts) for parts in found)
+        # Sorted by query, then by distance, ties in the order of the search
+        by_distance = lexsort((distances, rows))
+        splits = cumsum(bincount(rows, minlength=queries.shape[0]))[:-1]
+        return (split(distances[by_distance], splits),
+                split(indices[by_distance], splits))
+
+    def save(self, path):
+        '''
+        Save the tree, including the indexed points, to an .npz file
+        :param path: file name or file object
+        '''
+        savez(
+                path,
+                points=self.points,
+                leaf_size=self.leaf_size,
+                order=self.order,
+                vantage=self.vantage,
+                threshold=self.threshold,
+                inside=self.inside,
+                outside=self.outside,
+                start=self.start,
+                stop=self.stop,
+        )
+
+    @classmethod
+    def load(cls, path, manifold):
+        '''
+        Load a tree saved by save
+        :param path: file name or file object
+        :param manifold: Manifold the tree was built with
+        :return: VantagePointTree
+        '''
+        tree = cls.__new__(cls)
+        tree.manifold = manifold
+        with load(path) as data:
+            tree.points = data["points"]
+            tree.leaf_size = int(data["leaf_size"])
+            for name in ("order", "vantage", "threshold", "inside", "outside",
+                         "start", "stop"):
+                setattr(tree, name, data[name])
+        return tree
@@ -0,0 +1,273 @@
+'''
+    Opt-in instrumentation of the hot paths of Manifold and Metric. While
+    enabled, the methods of Manifold, Metric and all their imported
+    subclasses are wrapped to record each call: its wall time, the number of
+    rows it processed and, optionally, the memory it allocated. Disabling
+    restores the original methods, so instrumentation costs nothing when it
+    is off.
+
+        with instrument(track_memory=True) as recorder:
+            sphere.parallel_transport(v, p0, p1, method="pole_ladder")
+        print(recorder.format_summary())
+        recorder.to_chrome_trace("trace.json")
+
+    The trace opens in chrome://tracing or Perfetto, with calls nested under
+    their callers. Times include the time of nested calls. Memory is
+    measured with tracemalloc, which slows calls down, and is only exact for
+    single-threaded code. Subclasses defined after enable are not wrapped,
+    and calls sharded by a ProcessBackend cannot be recorded, as the
+    wrapped methods cannot be sent to the worker processes.
+'''
+from contextlib import contextmanager
+from functools import wraps
+import json
+from manifold import Manifold
+from metric import Metric
+import threading
+import time
+import tracemalloc
+
+# Private methods that are worth recording alongside the public ones
+PRIVATE_METHODS = ("_distance_from_gram", "_pole_ladder_transport",
+                   "_tangent_norm")
+
+# Originals of the wrapped methods, as (class, name, function), while enabled
+_patched = []
+_recorder = None
+
+
+class Recorder:
+    '''
+        Collects one record per instrumented call
+    '''
+
+    def __init__(self, track_memory=False):
+        '''
+
+        :param track_memory: if True, record the peak memory allocated by
+                             each call, using tracemalloc
+        '''
+        self.track_memory = track_memory
+        self.records = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+
+    def reset(self):
+        '''
+        Forget all records
+        '''
+        with self._lock:
+            self.records = []
+
+    def _enter(self):
+        '''
+        Start a memory frame for a call, see _exit
+        '''
+        if not self.track_memory:
+            return None
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            # The caller's peak so far is kept before the peak is reset
+            stack[-1][1] = max(stack[-1][1], peak)
+        tracemalloc.reset_peak()
+        frame = [current, current]
+        stack.append(frame)
+        return frame
+
+    def _exit(self, frame):
+        '''
+        :return: peak bytes allocated above the level at the start of the call
+        '''
+        if frame is None:
+            return None
+        stack = self._local.stack
+        stack.pop()
+        frame[1] = max(frame[1], tracemalloc.get_traced_memory()[1])
+        if stack:
+            stack[-1][1] = max(stack[-1][1], frame[1])
+        return frame[1] - frame[0]
+
+    def record(self, name, start, duration, rows, n_bytes):
+        with self._lock:
+            self.records.append({
+                "name": name,
+                "thread": threading.get_ident(),
+                "start": start - self._origin,
+                "duration": duration,
+                "rows": rows,
+                "bytes": n_bytes,
+            })
+
+    def summary(self):
+        '''
+        Totals per method, sorted by decreasing total time
+        :return: list of dicts with keys name, calls, rows, seconds,
+                 mean_seconds and bytes (None without track_memory)
+        '''
+        totals = {}
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            total = totals.setdefault(record["name"], {
+                "name": record["name"],
+                "calls": 0,
+                "rows": 0,
+                "seconds": 0.,
+                "bytes": None if record["bytes"] is None else 0,
+            })
+            total["calls"] += 1
+            total["rows"] += record["rows"]
+            total["seconds"] += record["duration"]
+            if record["bytes"] is not None:
+                total["bytes"] += record["bytes"]
+        rows = sorted(totals.values(), key=lambda total: -total["seconds"])
+        for total in rows:
+            total["mean_seconds"] = total["seconds"]/total["calls"]
+        return rows
+
+    def format_summary(self):
+        '''
+        :return: str, the summary as a table
+        '''
+        lines = ["{:>44} {:>8} {:>12} {:>12} {:>12} {:>14}".format(
+                    "method", "calls", "rows", "total s", "mean s", "bytes")]
+        for total in self.summary():
+            lines.append("{:>44} {:>8} {:>12} {:>12.4e} {:>12.4e} {:>14}".format(
+                total["name"], total["calls"], total["rows"], total["seconds"],
+                total["mean_seconds"],
+                "-" if total["bytes"] is None else total["bytes"]))
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        '''
+        :return: dict in the Chrome trace event format, one complete event
+                 per call, with times in microseconds
+        '''
+        with self._lock:
+            records = list(self.records)
+        events = []
+        for record in records:
+            args = {"rows": record["rows"]}
+            if record["bytes"] is not None:
+                args["bytes"] = record["bytes"]
+            events.append({
+                "name": record["name"],
+                "cat": record["name"].split(".")[0],
+                "ph": "X",
+                "ts": record["start"]*1e6,
+                "dur": record["duration"]*1e6,
+                "pid": 0,
+                "tid": record["thread"],
+                "args": args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def to_chrome_trace(self, path):
+        '''
+        Write the calls to a Chrome trace JSON file
+        :param path: path of the file
+        '''
+        with open(path, "w") as file:
+            json.dump(self.chrome_trace(), file)
+
+
+def _rows(args):
+    '''
+    Number of rows of the first array argument of a call
+    '''
+    for arg in args:
+        shape = getattr(arg, "shape", None)
+        if shape:
+            return shape[0]
+    return 0
+
+
+def _wrap(name, function, recorder):
+    '''
+    :return: function recording its calls in recorder under name
+    '''
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        frame = recorder._enter()
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            recorder.record(name, start, duration, _rows(args[1:]),
+                            recorder._exit(frame))
+    return wrapper
+
+
+def _classes(base):
+    '''
+    :return: base and all its currently imported subclasses
+    '''
+    classes = [base]
+    for cls in classes:
+        classes.extend(sub for sub in cls.__subclasses__() if sub not in classes)
+    return classes
+
+
+def enable(recorder=None, track_memory=False):
+    '''
+    Start recording the calls of Manifold and Metric methods
+    :param recorder: Recorder to add records to, or None for a new one
+    :param track_memory: if a new Recorder is made, whether it records memory
+    :return: the Recorder
+    '''
+    global _recorder
+    if _recorder is not None:
+        raise RuntimeError("Instrumentation is already enabled")
+    if recorder is None:
+        recorder = Recorder(track_memory=track_memory)
+    if recorder.track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        recorder._started_tracemalloc = True
+    for cls in _classes(Manifold) + _classes(Metric):
+        for name, function in list(vars(cls).items()):
+            if not callable(function) or isinstance(function, type):
+                continue
+            if name.startswith("_") and name not in PRIVATE_METHODS:
+                continue
+            _patched.append((cls, name, function))
+            setattr(cls, name, _wrap(cls.__name__ + "." + name, function,
+                                     recorder))
+    _recorder = recorder
+    return recorder
+
+
+def disable():
+    '''
+    Stop recording and restore the original methods
+    :return: the Recorder that was in use, or None
+    '''
+    global _recorder
+    recorder = _recorder
+    while _patched:
+        cls, name, function = _patched.pop()
+        setattr(cls, name, function)
+    _recorder = None
+    if getattr(recorder, "_started_tracemalloc", False):
+        tracemalloc.stop()
+        recorder._started_tracemalloc = False
+    return recorder
+
+
+@contextmanager
+def instrument(recorder=None, track_memory=False):
+    '''
+    Record the calls of Manifold and Metric methods in the with block
+    :param recorder: Recorder to add records to, or None for a new one
+    :param track_memory: if a new Recorder is made, whether it records memory
+    :return: the Recorder
+    '''
+    recorder = enable(recorder, track_memory)
+    try:
+        yield recorder
+    finally:
+        disable()
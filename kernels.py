@@ -0,0 +1,324 @@
+'''
+    Optional compiled kernels for the row-wise operations of Sphere and
+    Hyperboloid. The NumPy implementations chain 6-10 ufunc passes over the
+    (m, n_dims+1) arrays, which makes them memory-bound for large m. The
+    kernels here make a single pass over each row, accumulating the dot
+    products in float64 and writing the result directly, without
+    temporaries.
+
+    They are compiled with Numba when it is installed, and then used by
+    default for C-contiguous or strided 2-D float32 and float64 arrays of
+    equal shapes. Other calls, such as broadcast batches, run the NumPy
+    implementations unchanged. Kernels can be switched off, or on, for a
+    block of code:
+
+        with use_kernels(False):
+            sphere.distance(u, v)
+
+    The kernels release the GIL, so a ThreadBackend runs their shards in
+    parallel.
+'''
+from contextlib import contextmanager
+from math import atan2, cos, cosh, log1p, sin, sinh, sqrt
+from numpy import empty, float32, float64, ndarray
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Whether compiled kernels can be used
+AVAILABLE = numba is not None
+
+# Settings installed by use_kernels, innermost last
+_settings = [AVAILABLE]
+
+# Largest cosh(d) - 1 computed from the chord, as hyperboloid.CHORD_LOG_MAX
+_CHORD_LOG_MAX = 0.5
+
+
+def _jit(kernel):
+    '''
+    Compile kernel with Numba if it is installed. Otherwise the kernel is
+    left as plain Python, which is only useful for testing.
+    '''
+    if numba is None:
+        return kernel
+    return numba.njit(nogil=True, cache=True)(kernel)
+
+
+@contextmanager
+def use_kernels(enabled=True):
+    '''
+    Use the compiled kernels, or not, for the duration of the with block
+    :param enabled: whether to use the kernels
+    '''
+    if enabled and not AVAILABLE:
+        raise ImportError("Compiled kernels require numba to be installed")
+    _settings.append(enabled)
+    try:
+        yield enabled
+    finally:
+        _settings.pop()
+
+
+def applies(*arrays):
+    '''
+    :param arrays: array arguments of a call
+    :return: True if kernels are enabled and can evaluate the call: arrays
+             are 2-D float32 or float64 np.arrays, all of the same shape and
+             type
+    '''
+    if not _settings[-1]:
+        return False
+    first = arrays[0]
+    if not (isinstance(first, ndarray) and first.ndim == 2 and
+            first.dtype in (float32, float64)):
+        return False
+    return all(isinstance(array, ndarray) and array.shape == first.shape and
+               array.dtype == first.dtype for array in arrays[1:])
+
+
+def _output(out, like, n_cols=None):
+    '''
+    :return: out, or a new array of the shape and type of like, with n_cols
+             columns if given
+    '''
+    if out is not None:
+        return out
+    shape = like.shape if n_cols is None else (like.shape[0], n_cols)
+    return empty(shape, dtype=like.dtype)
+
+
+@_jit
+def _sphere_distance(u, v, out):
+    for i in range(u.shape[0]):
+        sq_diff = 0.
+        sq_sum = 0.
+        for j in range(u.shape[1]):
+            sq_diff += (u[i, j] - v[i, j])**2
+            sq_sum += (u[i, j] + v[i, j])**2
+        out[i, 0] = 2.*atan2(sqrt(sq_diff), sqrt(sq_sum))
+    return out
+
+
+@_jit
+def _sphere_exponential_map(point, v_TpS, eps, out):
+    for i in range(point.shape[0]):
+        sq_norm = 0.
+        for j in range(point.shape[1]):
+            sq_norm += v_TpS[i, j]**2
+        norm_v = sqrt(sq_norm)
+        if norm_v < eps:
+            coeff_point, coeff_v = 1., 0.
+        else:
+            coeff_point, coeff_v = cos(norm_v), sin(norm_v)/norm_v
+        for j in range(point.shape[1]):
+            out[i, j] = coeff_point*point[i, j] + coeff_v*v_TpS[i, j]
+    return out
+
+
+@_jit
+def _sphere_arc(point0, point1, i):
+    '''
+    Norm of the chord of row i, and the length of the arc and its sine
+    '''
+    sq_diff = 0.
+    sq_sum = 0.
+    for j in range(point0.shape[1]):
+        sq_diff += (point1[i, j] - point0[i, j])**2
+        sq_sum += (point1[i, j] + point0[i, j])**2
+    norm_diff = sqrt(sq_diff)
+    norm_sum = sqrt(sq_sum)
+    return norm_diff, 2.*atan2(norm_diff, norm_sum), 0.5*norm_diff*norm_sum
+
+
+@_jit
+def _sphere_log_map(point0, point1, eps, out, dist):
+    for i in range(point0.shape[0]):
+        norm_diff, dist_i, sin_dist = _sphere_arc(point0, point1, i)
+        scale = dist_i/sin_dist if sin_dist > eps else 1.
+        shift = 0.5*norm_diff**2
+        for j in range(point0.shape[1]):
+            out[i, j] = (point1[i, j] - point0[i, j] + shift*point0[i, j])*scale
+        dist[i, 0] = dist_i
+    return out, dist
+
+
+@_jit
+def _sphere_parallel_transport(vec_Tp0M, point_0, point_1, eps, out):
+    for i in range(point_0.shape[0]):
+        norm_diff, dist, sin_dist = _sphere_arc(point_0, point_1, i)
+        # Scales the unnormalised logarithmic map, point_1 - point_0 +
+        # shift point_0, to the unit direction of the geodesic
+        scale = ((dist/sin_dist if sin_dist > eps else 1.)/
+                 (dist if dist > eps else 1.))
+        shift = 0.5*norm_diff**2
+        parallel_comp = 0.
+        for j in range(point_0.shape[1]):
+            dirn = point_1[i, j] - point_0[i, j] + shift*point_0[i, j]
+            parallel_comp += vec_Tp0M[i, j]*dirn
+        parallel_comp *= scale
+        coeff_point = -sin(dist)*parallel_comp
+        coeff_dirn = (cos(dist) - 1.)*parallel_comp*scale
+        for j in range(point_0.shape[1]):
+            dirn = point_1[i, j] - point_0[i, j] + shift*point_0[i, j]
+            out[i, j] = (vec_Tp0M[i, j] + coeff_point*point_0[i, j] +
+                         coeff_dirn*dirn)
+    return out
+
+
+@_jit
+def _minkowski_sq_diff(point0, point1, i):
+    '''
+    Half the squared Minkowski norm of the chord of row i, cosh(d) - 1,
+    clamped at zero as the chord is spacelike up to rounding
+    '''
+    sq_diff = -(point1[i, 0] - point0[i, 0])**2
+    for j in range(1, point0.shape[1]):
+        sq_diff += (point1[i, j] - point0[i, j])**2
+    return 0.5*max(sq_diff, 0.)
+
+
+@_jit
+def _hyperboloid_distance(u, v, out):
+    for i in range(u.shape[0]):
+        cosh_dist_m1 = _minkowski_sq_diff(u, v, i)
+        out[i, 0] = log1p(cosh_dist_m1 +
+                          sqrt(cosh_dist_m1*(cosh_dist_m1 + 2.)))
+    return out
+
+
+@_jit
+def _hyperboloid_exponential_map(point, v_TpS, eps, out):
+    for i in range(point.shape[0]):
+        sq_norm = -v_TpS[i, 0]**2
+        for j in range(1, point.shape[1]):
+            sq_norm += v_TpS[i, j]**2
+        norm_v = sqrt(max(sq_norm, 0.))
+        if norm_v < eps:
+            coeff_point, coeff_v = 1., 0.
+        else:
+            coeff_point, coeff_v = cosh(norm_v), sinh(norm_v)/norm_v
+        for j in range(point.shape[1]):
+            out[i, j] = coeff_point*point[i, j] + coeff_v*v_TpS[i, j]
+    return out
+
+
+@_jit
+def _hyperboloid_arc(point0, point1, i):
+    '''
+    cosh(d) - 1 of row i, and the length of the geodesic and its sinh, from
+    the chord for nearby points and -point0.point1 - 1 otherwise, as in
+    Hyperboloid.log_map_with_distance
+    '''
+    cosh_dist_m1 = _minkowski_sq_diff(point0, point1, i)
+    if cosh_dist_m1 >= _CHORD_LOG_MAX:
+        cosh_dist_m1 = point0[i, 0]*point1[i, 0]
+        for j in range(1, point0.shape[1]):
+            cosh_dist_m1 -= point0[i, j]*point1[i, j]
+        cosh_dist_m1 -= 1.
+    sinh_dist = sqrt(cosh_dist_m1*(cosh_dist_m1 + 2.))
+    return cosh_dist_m1, log1p(cosh_dist_m1 + sinh_dist), sinh_dist
+
+
+@_jit
+def _hyperboloid_log_map(point0, point1, eps, out, dist):
+    for i in range(point0.shape[0]):
+        cosh_dist_m1, dist_i, sinh_dist = _hyperboloid_arc(point0, point1, i)
+        scale = dist_i/sinh_dist if sinh_dist > eps else 1.
+        for j in range(point0.shape[1]):
+            out[i, j] = (point1[i, j] - point0[i, j] -
+                         cosh_dist_m1*point0[i, j])*scale
+        dist[i, 0] = dist_i
+    return out, dist
+
+
+@_jit
+def _hyperboloid_parallel_transport(vec_Tp0M, point_0, point_1, eps, out):
+    for i in range(point_0.shape[0]):
+        cosh_dist_m1, dist, sinh_dist = _hyperboloid_arc(point_0, point_1, i)
+        # Scales the unnormalised logarithmic map,
+        # point_1 - point_0 - (cosh(d) - 1) point_0, to the unit direction
+        scale = ((dist/sinh_dist if sinh_dist > eps else 1.)/
+                 (dist if dist > eps else 1.))
+        parallel_comp = 0.
+        for j in range(point_0.shape[1]):
+            dirn = point_1[i, j] - point_0[i, j] - cosh_dist_m1*point_0[i, j]
+            if j == 0:
+                parallel_comp -= vec_Tp0M[i, j]*dirn
+            else:
+                parallel_comp += vec_Tp0M[i, j]*dirn
+        parallel_comp *= scale
+        coeff_point = sinh(dist)*parallel_comp
+        coeff_dirn = (cosh(dist) - 1.)*parallel_comp*scale
+        for j in range(point_0.shape[1]):
+            dirn = point_1[i, j] - point_0[i, j] - cosh_dist_m1*point_0[i, j]
+            out[i, j] = (vec_Tp0M[i, j] + coeff_point*point_0[i, j] +
+                         coeff_dirn*dirn)
+    return out
+
+
+def sphere_distance(u, v):
+    '''
+    Fused Sphere.distance
+    :param u, v: (m, n_dims+1) np.arrays, each representing m points
+    :return: (m, 1) np.array, the distances between u and v
+    '''
+    return _sphere_distance(u, v, _output(None, u, 1))
+
+
+def sphere_exponential_map(point, v_TpS, eps, out=None):
+    '''
+    Fused Sphere.exponential_map. out may be point or v_TpS.
+    '''
+    return _sphere_exponential_map(point, v_TpS, eps, _output(out, point))
+
+
+def sphere_log_map_with_distance(point0, point1, eps, out=None):
+    '''
+    Fused Sphere.log_map_with_distance. out must not overlap the points.
+    '''
+    return _sphere_log_map(point0, point1, eps, _output(out, point0),
+                           _output(None, point0, 1))
+
+
+def sphere_parallel_transport(vec_Tp0M, point_0, point_1, eps):
+    '''
+    Fused closed form Sphere.parallel_transport
+    '''
+    return _sphere_parallel_transport(vec_Tp0M, point_0, point_1, eps,
+                                      _output(None, vec_Tp0M))
+
+
+def hyperboloid_distance(u, v):
+    '''
+    Fused Hyperboloid.distance
+    :param u, v: (m, n_dims+1) np.arrays, each representing m points
+    :return: (m, 1) np.array, the distances between u and v
+    '''
+    return _hyperboloid_distance(u, v, _output(None, u, 1))
+
+
+def hyperboloid_exponential_map(point, v_TpS, eps, out=None):
+    '''
+    Fused Hyperboloid.exponential_map. out may be point or v_TpS.
+    '''
+    return _hyperboloid_exponential_map(point, v_TpS, eps, _output(out, point))
+
+
+def hyperboloid_log_map_with_distance(point0, point1, eps, out=None):
+    '''
+    Fused Hyperboloid.log_map_with_distance. out must not overlap the
+    points.
+    '''
+    return _hyperboloid_log_map(point0, point1, eps, _output(out, point0),
+                                _output(None, point0, 1))
+
+
+def hyperboloid_parallel_transport(vec_Tp0M, point_0, point_1, eps):
+    '''
+    Fused Hyperboloid.parallel_transport
+    '''
+    return _hyperboloid_parallel_transport(vec_Tp0M, point_0, point_1, eps,
+                                           _output(None, vec_Tp0M))
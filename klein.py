@@ -0,0 +1,256 @@
+from backend import sharded
+from conversions import klein_to_hyperboloid
+from hyperboloid import Hyperboloid
+from manifold import Manifold, _eps
+from metric import EuclideanMetric
+from numpy import arccosh, hstack, maximum, ones, sqrt, tanh, where, zeros
+from poincare import _project_to_ball
+from validation import validated
+
+
+class Klein(Manifold):
+    '''
+        Beltrami-Klein model of hyperbolic space: the open unit ball of R^n,
+        in which geodesics are straight chords. Its metric is
+        g_x(u, v) = u.v/(1 - |x|^2) + (x.u)(x.v)/(1 - |x|^2)^2.
+        Points and tangent vectors have n coordinates, and self.metric is the
+        Euclidean inner product of these coordinates.
+    '''
+    curvature = -1.
+    # Points are kept at Euclidean norm at most 1 - boundary_eps
+    boundary_eps = 1e-10
+
+    def __init__(self, n_dims):
+        '''
+
+        :param n_dims: dimensions of the manifold
+        '''
+        self.n_dims = n_dims
+        self.metric = EuclideanMetric(n_dims)
+        self._hyperboloid = Hyperboloid(n_dims)
+
+    def _gamma_sq(self, point):
+        '''
+        :param point: (m, n_dims) np.array, representing m points
+        :return: (m, 1) np.array, 1/(1 - |x|^2)
+        '''
+        return 1./(1. - self.metric.dot(point, point))
+
+    def inner_product(self, point, u, v):
+        '''
+        Inner product of tangent vectors under the Klein metric
+        :param point: (m, n_dims) np.array, representing m points
+        :param u, v: (m, n_dims) np.arrays, vectors in tangent spaces of point
+        :return: (m, 1) np.array
+        '''
+        gamma_sq = self._gamma_sq(point)
+        return gamma_sq*(self.metric.dot(u, v) + gamma_sq*
+                         self.metric.dot(point, u)*self.metric.dot(point, v))
+
+    def _tangent_norm(self, point, vector):
+        '''
+        Norm of tangent vectors under the Klein metric
+        :param point: (m, n_dims) np.array, representing m points
+        :param vector: (m, n_dims) np.array, m vectors in tangent spaces
+        :return: (m, 1) np.array
+        '''
+        return sqrt(self.inner_product(point, vector, vector))
+
+    def is_on_manifold(self, point):
+        '''
+        Determine whether point is inside the unit ball
+        :param point: (m, n_dims) np.array, representing m points
+        :return: (m, 1) np.array of booleans
+        '''
+        return self.metric.dot(point, point) < 1.
+
+    def is_in_tangent_space(self, point, vector):
+        '''
+        Every vector of R^n is in the tangent space of every point
+        :param point: (m, n_dims) np.array, representing m points
+        :param vector: (m, n_dims) np.array, representing m vectors
+        :return: (m, 1) np.array of True
+        '''
+        return ones((vector.shape[0], 1), dtype=bool)
+
+    def _tangent_residual(self, point, vector):
+        '''
+        Every vector is in the tangent space, for validation
+        :return: (m, 1) np.array of zeros
+        '''
+        return zeros(vector.shape[:-1] + (1,))
+
+    @validated(points=("u", "v"))
+    @sharded(n_cols=1)
+    def distance(self, u, v):
+        '''
+        Calculate the distance on the manifold between two points
+        d = arccosh((1 - u.v)/sqrt((1 - |u|^2)(1 - |v|^2)))
+        :param u, v:, (m, n_dims) np.arrays, each representing m points
+        :return: (m, 1) dimensional np.array, the distance between u and v
+        '''
+        arg = (1. - self.metric.dot(u, v))*sqrt(
+                                        self._gamma_sq(u)*self._gamma_sq(v))
+        return arccosh(maximum(arg, 1.))
+
+    def _distance_from_gram(self, gram, X, Y):
+        '''
+        Convert, in place, a matrix of Euclidean dot products between points
+        into the matrix of distances between them.
+        :param gram: (m, k) np.array, dot products between m and k points.
+                     Overwritten with the distances.
+        :param X, Y: (m, n_dims) and (k, n_dims) np.arrays, the points
+        :return: gram
+        '''
+        gram -= 1.
+        gram *= -sqrt(self._gamma_sq(X))
+        gram *= sqrt(self._gamma_sq(Y)).T
+        maximum(gram, 1., out=gram)
+        return arccosh(gram, out=gram)
+
+    @sharded(skipped="vector")
+    def project_to_tangent_space(self, point, vector, out=None,
+                                 workspace=None):
+        '''
+        The tangent space of every point is the whole of R^n, so vectors are
+        unchanged
+        :param point:  (m, n_dims) np.array, representing m points
+        :param vector: (m, n_dims) np.array, representing m vectors
+        :param out: optional (m, n_dims) np.array to write the result into
+        :param workspace: unused
+        :return: (m, n_dims) np.array, a copy of vector
+        '''
+        if out is None:
+            return vector.copy()
+        out[...] = vector
+        return out
+
+    def riemannian_gradient(self, point, euclidean_gradient):
+        '''
+        Apply the inverse Klein metric, (1 - |x|^2)(I - x x^T), to the
+        Euclidean gradient
+        :param point: (m, n_dims) np.array, representing m points
+        :param euclidean_gradient: (m, n_dims) np.array
+        :return: (m, n_dims) np.array, the Riemannian gradient
+        '''
+        return (euclidean_gradient -
+                self.metric.dot(point, euclidean_gradient)*point
+                )/self._gamma_sq(point)
+
+    def project_to_manifold(self, point):
+        '''
+        Shrink points on or outside the unit sphere back into the ball
+        :param point: (m, n_dims) np.array, representing m points
+        :return: (m, n_dims) np.array, m points in the ball
+        '''
+        return _project_to_ball(point, 1. - self.boundary_eps)
+
+    def retraction(self, point, v_TpS, kind="projection"):
+        '''
+        Cheap approximation of the exponential map, for small steps:
+        "projection" is point + v_TpS, which lies on the geodesic since
+        geodesics are straight, and "exp" is the exponential map itself.
+        :param point: (m, n_dims) np.array, representing m points
+        :param v_TpS: (m, n_dims) np.array, representing m tangent vectors
+        :param kind: "projection" or "exp"
+        :return: (m, n_dims) np.array, m points in the ball
+        '''
+        if kind == "second_order":
+            raise ValueError("Second order retraction is not available in the "
+                             "Klein model")
+        return super().retraction(point, v_TpS, kind)
+
+    @validated(points=("point",), vectors=(("v_TpS", "point"),))
+    @sharded(skipped="point")
+    def exponential_map(self, point, v_TpS, out=None, workspace=None):
+        '''
+        Follow geodesic in direction v_TpS from point and
+        return the resulting point. The geodesic is the chord through point
+        along v_TpS, and the point at distance |v_TpS| along it is
+        x + t v/(1 + t (x.v)/(1 - |x|^2)), with t = tanh(|v|)/|v|.
+
+        :param point: (m, n_dims) np.array, representing m points
+        :param v_TpS: (m, n_dims) np.array, representing m tangent vectors
+        :param out: optional (m, n_dims) np.array to write the result into.
+                    May be point itself.
+        :param workspace: unused
+        :return: (m, n_dims) np.array, m points along the geodesics
+        '''
+        norm_v_TpS = self._tangent_norm(point, v_TpS)
+        is_zero = norm_v_TpS < _eps(v_TpS)
+        t = where(is_zero, 1., tanh(norm_v_TpS)/where(is_zero, 1., norm_v_TpS))
+        scale = t/(1. + t*self._gamma_sq(point)*self.metric.dot(point, v_TpS))
+        result = self.project_to_manifold(point + scale*v_TpS)
+        if out is None:
+            return result
+        out[...] = result
+        return out
+
+    @validated(points=("point0", "point1"))
+    @sharded()
+    def logarithmic_map(self, point0, point1, out=None):
+        '''
+        Inverse of exponential map: the chord from point0 to point1, rescaled
+        to have the length of the geodesic distance
+
+        :param point0: (m, n_dims) np.array, representing m "base" points
+        :param point1: (m, n_dims) np.array, representing m "target" points
+        :param out: optional (m, n_dims) np.array to write the result into
+        :return: (m, n_dims) np.array, m tangent vectors at point0
+        '''
+        chord = point1 - point0
+        norm_chord = self._tangent_norm(point0, chord)
+        is_good = norm_chord > _eps(chord)
+        # For vanishing chords, the distance tends to the norm of the chord
+        scale = where(
+                        is_good,
+                        self.distance(point0, point1)/where(
+                                                    is_good, norm_chord, 1.),
+                        1.
+        )
+        if out is None:
+            return chord*scale
+        out[...] = chord*scale
+        return out
+
+    def _to_hyperboloid_tangent(self, point, vector):
+        '''
+        Differential of klein_to_hyperboloid at point, applied to vector
+        :param point: (m, n_dims) np.array, representing m points
+        :param vector: (m, n_dims) np.array, m tangent vectors at point
+        :return: (m, n_dims+1) np.array, m hyperboloid tangent vectors
+        '''
+        gamma = sqrt(self._gamma_sq(point))
+        time = gamma**3*self.metric.dot(point, vector)
+        return hstack([time, time*point + gamma*vector])
+
+    def _from_hyperboloid_tangent(self, point, h_vector):
+        '''
+        Differential of hyperboloid_to_klein, mapping hyperboloid tangent
+        vectors at the image of point back to Klein tangent vectors at point
+        :param point: (m, n_dims) np.array, representing m points
+        :param h_vector: (m, n_dims+1) np.array, m hyperboloid tangent vectors
+        :return: (m, n_dims) np.array, m tangent vectors at point
+        '''
+        gamma = sqrt(self._gamma_sq(point))
+        return (h_vector[:, 1:] - point*h_vector[:, :1])/gamma
+
+    @validated(points=("point_0", "point_1"),
+               vectors=(("vec_Tp0M", "point_0"),))
+    @sharded(skipped="vec_Tp0M")
+    def parallel_transport(self, vec_Tp0M, point_0, point_1):
+        '''
+        Parallel transport vector in tangent space of point 0 (Tp0M) to the
+        tangent space of point 1 (Tp1M), through the closed-form transport of
+        the hyperboloid and the differentials of the change of model.
+        :param vec_Tp0M: (m, n_dims) np.array, vector in Tp0M to transport
+        :param point_0: initial point where vec_Tp0M
+        :param point_1: final point to which vec_Tp0M will be transported
+        :return: vec_Tp0M after parallel transport to point 1
+        '''
+        h_vec = self._hyperboloid.parallel_transport(
+                                self._to_hyperboloid_tangent(point_0, vec_Tp0M),
+                                klein_to_hyperboloid(point_0),
+                                klein_to_hyperboloid(point_1)
+        )
+        return self._from_hyperboloid_tangent(point_1, h_vec)
@@ -1,10 +1,37 @@
-from numpy import finfo, float64, isclose, logical_and, maximum, where, zeros_like
+from backend import sharded
+from numpy import absolute, add, asarray, broadcast_shapes, broadcast_to, \
+    ceil, clip, einsum, empty, fill_diagonal, finfo, flatnonzero, float64, \
+    floating, full, inf, intp, isclose, issubdtype, linspace, logical_and, \
+    maximum, minimum, multiply, nan, ones, prod, reshape, result_type, sqrt, \
+    subtract, unique, where, zeros, zeros_like
+from validation import validated
 
 class Manifold:
     '''
         Base class for (pseudo-)Riemannian manifolds. Assumes n-dimensional
         manifolds are embedded in an (n+1)-dimensional ambient space
+
+        Row-wise methods document (m, n_dims+1) arrays, but their array
+        arguments may have any leading batch dimensions that broadcast
+        together as in NumPy. For example, a (1, n_dims+1) query point
+        against (m, n_dims+1) candidates needs no tiling, and (k, 1, n_dims+1)
+        against (m, n_dims+1) gives (k, m, ...) results. pairwise_distance
+        and frechet_mean take (m, n_dims+1) arrays only.
+
+        Row-wise methods also take a where argument, a boolean mask of the
+        rows to evaluate, so that sparse updates cost only the selected rows,
+        see backend.sharded.
     '''
+    # Sectional curvature, for manifolds of constant curvature
+    curvature = None
+    # backend.Backend that shards the rows of large calls across workers.
+    # None runs them in the calling thread, unless backend.use_backend is
+    # active.
+    backend = None
+    # validation.ValidationPolicy that checks the arguments of calls. None
+    # checks nothing, unless validation.use_validation is active.
+    validation = None
+
     def __init__(self, n_dims):
         '''
 
@@ -13,6 +40,16 @@ class Manifold:
         self.n_dims = n_dims
         self.metric = None
 
+    def __getstate__(self):
+        '''
+        Manifolds are pickled without their backend, whose pool of workers
+        cannot be pickled, and without their validation policy
+        '''
+        state = self.__dict__.copy()
+        state.pop("backend", None)
+        state.pop("validation", None)
+        return state
+
     def distance(self, u, v):
         '''
         Calculate the distance on the manifold between two points.
@@ -22,7 +59,74 @@ class Manifold:
         '''
         raise NotImplementedError("Should be implemented by subclass")
 
-    def exponential_map(self, point, v_TpS):
+    def _distance_from_gram(self, gram, X, Y):
+        '''
+        Convert, in place, a matrix of metric dot products between points into
+        the matrix of distances between them.
+        :param gram: (m, k) np.array, dot products between m and k points.
+                     Overwritten with the distances.
+        :param X: (m, n_dims+1) np.array, the points of the rows of gram
+        :param Y: (k, n_dims+1) np.array, the points of the columns of gram
+        :return: gram
+        '''
+        raise NotImplementedError("Should be implemented by subclass")
+
+    def pairwise_distance(self, X, Y=None, out=None, block_size=None):
+        '''
+        Calculate the distance on the manifold between every row of X and
+        every row of Y, through the metric Gram matrix of X and Y.
+        :param X: (m, n_dims+1) np.array, representing m points
+        :param Y: (k, n_dims+1) np.array, representing k points. If None,
+                  distances between all pairs of rows of X are returned.
+        :param out: optional (m, k) np.array to write the distances into
+        :param block_size: if given, fill the result in blocks of at most
+                           block_size x block_size, bounding the temporaries
+        :return: (m, k) np.array, element [a, b] is the distance between
+                 X[a] and Y[b]
+        '''
+        if block_size is None:
+            Z = X if Y is None else Y
+            gram = self._distance_from_gram(self.metric.gram(X, Z, out=out), X, Z)
+            if Y is None:
+                # Points are exactly zero distance from themselves
+                fill_diagonal(gram, 0.)
+            return gram
+
+        if out is None:
+            n_cols = X.shape[0] if Y is None else Y.shape[0]
+            out = empty((X.shape[0], n_cols), dtype=X.dtype)
+        for rows, cols, block in self.iter_pairwise_distance(X, Y, block_size):
+            out[rows, cols] = block
+        return out
+
+    def iter_pairwise_distance(self, X, Y=None, block_size=1024):
+        '''
+        Stream the pairwise distance matrix between X and Y in blocks, so
+        that distance matrices too large for memory can be consumed piecewise.
+        :param X: (m, n_dims+1) np.array, representing m points
+        :param Y: (k, n_dims+1) np.array, representing k points. If None,
+                  distances between all pairs of rows of X are streamed.
+        :param block_size: maximum number of rows and columns in each block
+        :return: generator of (rows, cols, block) where rows and cols are
+                 slices into the full (m, k) matrix and block holds the
+                 distances for them. block is reused between iterations:
+                 copy it if it has to be kept.
+        '''
+        Z = X if Y is None else Y
+        buffer = empty((block_size, block_size), dtype=X.dtype)
+        for row_start in range(0, X.shape[0], block_size):
+            rows = slice(row_start, min(row_start + block_size, X.shape[0]))
+            for col_start in range(0, Z.shape[0], block_size):
+                cols = slice(col_start, min(col_start + block_size, Z.shape[0]))
+                block = buffer[:rows.stop - rows.start, :cols.stop - cols.start]
+                self.metric.gram(X[rows], Z[cols], out=block)
+                self._distance_from_gram(block, X[rows], Z[cols])
+                if Y is None and row_start == col_start:
+                    # Points are exactly zero distance from themselves
+                    fill_diagonal(block, 0.)
+                yield rows, cols, block
+
+    def exponential_map(self, point, v_TpS, out=None, workspace=None):
         '''
         Follow geodesic in direction v_TpS from point and
         return the resulting point.
@@ -31,35 +135,169 @@ class Manifold:
                         manifold:
         :param v_TpS: (m, n_dims+1) np.array, representing m vectors projected to
                 tangent spaces of point:
+        :param out: optional (m, n_dims+1) np.array to write the result into.
+                    May be point itself.
+        :param workspace: optional (m, n_dims+1) np.array used as scratch
+                          space, to avoid allocating a temporary
         :return: (m, n_dims+1) np.array, m points on the manifold along the
                 geodesic chosen by v_TpS, from point
         '''
 
         raise NotImplementedError("Should be implemented by subclass")
 
-    def logarithmic_map(self, point0, point1):
+    def exponential_map_(self, point, v_TpS, workspace=None):
+        '''
+        In-place exponential map: overwrite point with the result of
+        exponential_map(point, v_TpS). Matches the allocating version exactly.
+        :param point: (m, n_dims+1) np.array, m points, overwritten
+        :param v_TpS: (m, n_dims+1) np.array, m vectors in tangent spaces of
+                      point
+        :param workspace: optional (m, n_dims+1) np.array of scratch space
+        :return: point
+        '''
+        return self.exponential_map(point, v_TpS, out=point, workspace=workspace)
+
+    @validated(points=("point0", "point1"))
+    @sharded()
+    def logarithmic_map(self, point0, point1, out=None):
         '''
         Inverse of exponential map
 
         :param point0: (m, n_dims) np.array, representing m "base" points:
         :param point1: (m, n_dims) np.array, representing m "target" points
+        :param out: optional (m, n_dims) np.array to write the result into.
+                    Must not overlap point0 or point1.
         :return: (m, n_dims) np.array, m vectors in tangent spaces of point0,
                 that would yield point1 if inserted in exponential map
         '''
         dot01 = self.metric.dot(point0, point1)
         dot00 = self.metric.dot(point0, point0)
-        v_Tp0M = point1 - (dot01/dot00)*point0
+        v_Tp0M = multiply(point0, dot01/dot00, out=out)
+        subtract(point1, v_Tp0M, out=v_Tp0M)
         dist = self.distance(point0, point1)
         norm_v_Tp0M = self.metric.norm(v_Tp0M)
 
-        # If v_Tp0M has zero norm, return the original point.
-        v_Tp0M_is_good = norm_v_Tp0M > finfo(float64).eps
+        # If v_Tp0M has zero norm, return it unscaled.
+        v_Tp0M_is_good = norm_v_Tp0M > _eps(v_Tp0M)
             #self.is_in_tangent_space(point0, v_Tp0M)
-        return where(
-                        v_Tp0M_is_good,
-                        v_Tp0M*(dist/norm_v_Tp0M),
-                        v_Tp0M,
-                     )
+        safe_norm = where(v_Tp0M_is_good, norm_v_Tp0M, 1.)
+        scale = where(v_Tp0M_is_good, dist/safe_norm, 1.)
+        return multiply(v_Tp0M, scale, out=v_Tp0M)
+
+    @validated(points=("point0", "point1"))
+    def log_map_with_distance(self, point0, point1, out=None):
+        '''
+        Logarithmic map and distance between the same points, computed
+        together. Manifolds with closed forms share the dot products and
+        norms between the two, and this generic version simply calls both.
+
+        :param point0: (m, n_dims+1) np.array, representing m "base" points
+        :param point1: (m, n_dims+1) np.array, representing m "target" points
+        :param out: optional (m, n_dims+1) np.array to write the logarithmic
+                    map into. Must not overlap point0 or point1.
+        :return: ((m, n_dims+1) np.array, m vectors in tangent spaces of
+                 point0, (m, 1) np.array, the distances between the points)
+        '''
+        return (self.logarithmic_map(point0, point1, out=out),
+                self.distance(point0, point1))
+
+    @validated(points=("point0", "point1"))
+    @sharded(skipped="point0")
+    def exp_log_roundtrip(self, point0, point1, t=1., out=None):
+        '''
+        Point reached after following the geodesic from point0 to point1
+        for the fraction t of its length: exp(point0, t log(point0, point1)).
+        Manifolds with closed forms skip the intermediate tangent vector.
+
+        :param point0: (m, n_dims+1) np.array, representing m "base" points
+        :param point1: (m, n_dims+1) np.array, representing m "target" points
+        :param t: float or (m, 1) np.array of fractions of the geodesics.
+                  Negative values go beyond point0, away from point1.
+        :param out: optional (m, n_dims+1) np.array to write the result into
+        :return: (m, n_dims+1) np.array, m points on the manifold
+        '''
+        return self.exponential_map(
+                                    point0,
+                                    t*self.logarithmic_map(point0, point1),
+                                    out=out
+        )
+
+    def geodesic(self, point0, point1, t, out=None):
+        '''
+        Points at K times along the geodesics from point0 to point1, the
+        logarithmic map or distance of each pair being computed only once.
+
+        :param point0: (m, n_dims+1) np.array, representing m "base" points.
+                       More batch dimensions broadcast, see Manifold.
+        :param point1: (m, n_dims+1) np.array, representing m "target" points
+        :param t: (K,) np.array of times, 0 at point0 and 1 at point1
+        :param out: optional C-contiguous (m, K, n_dims+1) np.array to write
+                    the result into
+        :return: (m, K, n_dims+1) np.array, the K points of each geodesic
+        '''
+        t = asarray(t).reshape(-1)
+        if out is None:
+            shape = broadcast_shapes(point0.shape, point1.shape)
+            out = empty(shape[:-1] + (t.shape[0], shape[-1]),
+                        dtype=result_type(point0, point1))
+        return self._geodesic_interpolator(point0, point1)(t, out)
+
+    def iter_geodesic(self, point0, point1, t, block_size=64):
+        '''
+        Stream the points of geodesic in blocks of times, for when the
+        (m, K, n_dims+1) array would not fit in memory. The logarithmic map
+        or distance of each pair is computed once for all the blocks.
+
+        :param point0: (m, n_dims+1) np.array, representing m "base" points
+        :param point1: (m, n_dims+1) np.array, representing m "target" points
+        :param t: (K,) np.array of times, 0 at point0 and 1 at point1
+        :param block_size: maximum number of times in each block
+        :return: generator of (times, block) where times is a slice of t
+                 and block the (m, len(t[times]), n_dims+1) points at those
+                 times. block is reused between iterations: copy it if it
+                 has to be kept.
+        '''
+        t = asarray(t).reshape(-1)
+        interpolate = self._geodesic_interpolator(point0, point1)
+        shape = broadcast_shapes(point0.shape, point1.shape)
+        n_points = prod(shape[:-1], dtype=intp)*shape[-1]
+        # Blocks are views of the start of the buffer, so that they are
+        # contiguous whatever their number of times
+        buffer = empty(n_points*min(block_size, t.shape[0]),
+                       dtype=result_type(point0, point1))
+        for start in range(0, t.shape[0], block_size):
+            times = slice(start, min(start + block_size, t.shape[0]))
+            n_times = times.stop - times.start
+            block = buffer[:n_points*n_times].reshape(
+                                        shape[:-1] + (n_times, shape[-1]))
+            yield times, interpolate(t[times], block)
+
+    def _geodesic_interpolator(self, point0, point1):
+        '''
+        Compute what the points along the geodesics from point0 to point1 at
+        all times depend on. Manifolds with closed form interpolation
+        override this; the generic version takes one logarithmic map and
+        follows it with exponential maps.
+        :param point0: (m, n_dims+1) np.array, representing m "base" points
+        :param point1: (m, n_dims+1) np.array, representing m "target" points
+        :return: function of a (K,) np.array of times and a C-contiguous
+                 (m, K, n_dims+1) np.array, writing the points at those times
+                 into the latter and returning it
+        '''
+        v_Tp0M = self.logarithmic_map(point0, point1)
+
+        def interpolate(t, out):
+            n_cols = out.shape[-1]
+            steps = multiply(t[:, None], v_Tp0M[..., None, :])
+            base = empty(out.shape, dtype=out.dtype)
+            base[...] = point0[..., None, :]
+            self.exponential_map(
+                                    base.reshape(-1, n_cols),
+                                    steps.reshape(-1, n_cols),
+                                    out=out.reshape(-1, n_cols)
+            )
+            return out
+        return interpolate
 
     def is_on_manifold(self, point):
         '''
@@ -81,21 +319,143 @@ class Manifold:
         dot_pv = self.metric.dot(point, vector)
         return isclose(dot_pv, zeros_like(dot_pv))
 
-    def project_to_tangent_space(self, point, vector):
+    def _manifold_residual(self, point):
+        '''
+        How far points are from the manifold, for validation. This default
+        only tells points on and off the manifold apart, as 0 and inf.
+        :param point: (m, n_dims+1) np.array, representing m points
+        :return: (m, 1) np.array, 0 for points on the manifold
+        '''
+        return where(self.is_on_manifold(point), 0., inf)
+
+    def _tangent_residual(self, point, vector):
+        '''
+        How far vectors are from the tangent spaces of points, for
+        validation: |point.vector|, relative to the Euclidean norms of point
+        and vector
+        :param point: (m, n_dims+1) np.array, representing m points
+        :param vector: (m, n_dims+1) np.array, representing m vectors
+        :return: (m, 1) np.array, 0 for vectors in the tangent spaces
+        '''
+        scale = sqrt(einsum("...i,...i->...", point, point)*
+                     einsum("...i,...i->...", vector, vector))[..., None]
+        return absolute(self.metric.dot(point, vector))/maximum(
+                                                    scale, finfo(float64).tiny)
+
+    @sharded(skipped="vector")
+    def project_to_tangent_space(self, point, vector, out=None,
+                                 workspace=None):
         '''
         Project vector into tangent space of point.
-        Since point is on hypersphere of radius 1, point.point = +1
         :param point:  (m, n_dims) np.array, representing m points on the
-                        hypersphere:
+                        manifold:
         :param vector: (m, n_dims) np.array, representing m vectors in ]
                         (n+1)-dimensional ambient space
+        :param out: optional (m, n_dims) np.array to write the result into.
+                    May be vector itself.
+        :param workspace: optional (m, n_dims) np.array used as scratch
+                          space, to avoid allocating a temporary
         :return: (m, n_dims) np.array, representing m vectors projected to
                 tangent spaces of point
         '''
         dot_ratio = self.metric.dot(point, vector)/self.metric.dot(point, point)
-        return vector - dot_ratio*point
+        return subtract(
+                            vector,
+                            multiply(dot_ratio, point, out=workspace),
+                            out=out
+        )
+
+    def project_to_tangent_space_(self, point, vector, workspace=None):
+        '''
+        In-place projection: overwrite vector with the result of
+        project_to_tangent_space(point, vector). Matches the allocating
+        version exactly.
+        :param point: (m, n_dims+1) np.array, representing m points
+        :param vector: (m, n_dims+1) np.array, m ambient vectors, overwritten
+        :param workspace: optional (m, n_dims+1) np.array of scratch space
+        :return: vector
+        '''
+        return self.project_to_tangent_space(
+                                                point,
+                                                vector,
+                                                out=vector,
+                                                workspace=workspace
+        )
 
-    def _pole_ladder_transport(self, vec_Tp0M, point_0, point_1):
+    def inner_product(self, point, u, v):
+        '''
+        Riemannian inner product of vectors in the tangent spaces of points.
+        It is that of the ambient coordinates, self.metric, for manifolds
+        embedded isometrically, such as Sphere and Hyperboloid. Models whose
+        metric depends on the point override it.
+        :param point: (m, n_dims+1) np.array, representing m points
+        :param u, v: (m, n_dims+1) np.arrays, vectors in tangent spaces of point
+        :return: (m, 1) np.array
+        '''
+        return self.metric.dot(u, v)
+
+    def riemannian_gradient(self, point, euclidean_gradient):
+        '''
+        Convert the gradient of a function with respect to the ambient
+        coordinates into its Riemannian gradient, a vector in the tangent
+        space of point.
+        :param point: (m, n_dims+1) np.array, representing m points
+        :param euclidean_gradient: (m, n_dims+1) np.array, the partial
+                                   derivatives with respect to each coordinate
+        :return: (m, n_dims+1) np.array, m vectors in tangent spaces of point
+        '''
+        return self.project_to_tangent_space(
+                                    point,
+                                    self.metric.raise_index(euclidean_gradient)
+        )
+
+    def project_to_manifold(self, point):
+        '''
+        Map ambient points back onto the manifold, leaving points already on
+        the manifold unchanged
+        :param point: (m, n_dims+1) np.array, representing m ambient points
+        :return: (m, n_dims+1) np.array, m points on the manifold
+        '''
+        raise NotImplementedError("Should be implemented by subclass")
+
+    def retraction(self, point, v_TpS, kind="projection"):
+        '''
+        Cheap approximation of the exponential map, for small steps.
+
+        "projection" steps along v_TpS in the ambient space and projects back
+        onto the manifold, using no transcendental functions. "second_order"
+        first adds the curvature term of the geodesic's Taylor expansion,
+        point + v_TpS - curvature*|v_TpS|^2/2 * point, and then projects.
+        "exp" is the exponential map itself.
+
+        The distance to exponential_map(point, v_TpS) is bounded by
+        C*|v_TpS|^(k+1) for a retraction of order k. On the sphere both
+        retractions are second order (the projection is the metric
+        projection). On the hyperboloid the projection is first order and
+        second_order is second order. tests/ and benchmarks/bench_retraction.py
+        measure the constants.
+        :param point: (m, n_dims+1) np.array, representing m points
+        :param v_TpS: (m, n_dims+1) np.array, m vectors in tangent spaces of
+                      point
+        :param kind: "projection", "second_order" or "exp"
+        :return: (m, n_dims+1) np.array, m points on the manifold
+        '''
+        if kind == "exp":
+            return self.exponential_map(point, v_TpS)
+        elif kind == "projection":
+            return self.project_to_manifold(point + v_TpS)
+        elif kind == "second_order":
+            if self.curvature is None:
+                raise ValueError(
+                    "Second order retraction needs a manifold of constant "
+                    "curvature")
+            half_sq_norm = 0.5*self.metric.dot(v_TpS, v_TpS)
+            return self.project_to_manifold(
+                        point + v_TpS - (self.curvature*half_sq_norm)*point)
+        raise ValueError("Unknown retraction: {}".format(kind))
+
+    def _pole_ladder_transport(self, vec_Tp0M, point_0, point_1,
+                               midpt_01=None):
         '''
             Parallel transport of vector in tangent space of point 0 to the
             tangent space of point 1 using pole ladder algorithm defined in
@@ -103,44 +463,299 @@ class Manifold:
         :param vec_Tp0M: vector to be transported
         :param point_0: initial point where vec_Tp0M
         :param point_1: final point to which vec_Tp0M will be transported
+        :param midpt_01: optional midpoint of the geodesic from point_0 to
+                         point_1, if already known
         :return: vec_Tp0M after parallel transport to point 1
         '''
-        # todo: check whether vector is in tangent space
-        midpt_01 = self.exponential_map(
-                                        point_0,
-                                        0.5 * self.logarithmic_map(point_0, point_1)
-                                        )
+        if midpt_01 is None:
+            midpt_01 = self.exp_log_roundtrip(point_0, point_1, 0.5)
         prime_0 = self.exponential_map(point_0, vec_Tp0M)
 
         # Compute reflection of prime_0 on opposite side of midpoint
-        prime_1 = self.exponential_map(
-                                        midpt_01,
-                                        -self.logarithmic_map(midpt_01, prime_0)
-                                      )
+        prime_1 = self.exp_log_roundtrip(midpt_01, prime_0, -1.)
         return -self.logarithmic_map(point_1, prime_1)
 
-    def parallel_transport(self, vec_Tp0M, point_0, point_1, n_steps = 10):
+    @validated(points=("point_0", "point_1"),
+               vectors=(("vec_Tp0M", "point_0"),))
+    @sharded(skipped="vec_Tp0M")
+    def parallel_transport(self, vec_Tp0M, point_0, point_1, n_steps = 10,
+                           tol=1e-8, max_steps=64):
         '''
         Parallel transport vector in tangent space of point 0 (Tp0M) to the tangent
         space of point 1 (Tp1M).
         :param vec_Tp0M: (m, n-dims+1) np.array, vector in Tp0M to be transported
         :param point_0: initial point where vec_Tp0M
         :param point_1: final point to which vec_Tp0M will be transported
-        :param n_steps: number of steps to break pole transport into
+        :param n_steps: number of steps to break pole transport into, or
+                        "adaptive" to choose it for each row from the change
+                        of the transport as its steps are doubled
+        :param tol: target error of the adaptive ladder
+        :param max_steps: most steps of the adaptive ladder for any row
         :return: vec_Tp0M after parallel transport to point 1
         '''
-        # todo: check whether vector is in tangent space
+        # Zero vectors, and vectors between equal points, are unchanged: only
+        # the other rows climb the ladder
+        is_moving = logical_and((vec_Tp0M != 0.).any(axis=-1),
+                                (point_0 != point_1).any(axis=-1))
+        if not is_moving.all():
+            return Manifold.parallel_transport(self, vec_Tp0M, point_0, point_1,
+                                               n_steps=n_steps, tol=tol,
+                                               max_steps=max_steps,
+                                               where=is_moving)
+        if n_steps == "adaptive":
+            return self._adaptive_pole_ladder(vec_Tp0M, point_0, point_1, tol,
+                                              max_steps)[0]
 
-        # Get rows that are actually changing in this batch. The others will stay the same.
-        point_a = point_0.copy()
+        ladder = self._ladder_points(point_0, point_1, n_steps)
         vec_TpaM = vec_Tp0M.copy()
 
         for i in range(n_steps):
-            point_b = self.exponential_map(
-                    point_a,
-                    (1 / (n_steps - i))*self.logarithmic_map(point_a, point_1)
-                )
-            vec_TpaM = self._pole_ladder_transport(vec_TpaM, point_a, point_b)
-            point_a = point_b
-
-        return vec_TpaM
\ No newline at end of file
+            vec_TpaM = self._pole_ladder_transport(
+                                                    vec_TpaM,
+                                                ladder[..., 2*i, :],
+                                                ladder[..., 2*i + 2, :],
+                                                midpt_01=ladder[..., 2*i + 1, :]
+            )
+
+        return vec_TpaM
+
+    def ladder_steps(self, dist, tol=1e-8, max_steps=64):
+        '''
+        A priori bound of the number of pole ladder steps needed for each
+        row to reach a target error. A step of length h errs by O(h^3)
+        relative to the vector, through the covariant derivative of the
+        curvature, so n steps along a geodesic of length d err by about
+        d^3/n^2. The adaptive ladder refines rows up to this bound, until the
+        error it measures is below tol.
+        :param dist: (m, 1) np.array, the lengths of the geodesics, or any
+                     (..., 1) np.array
+        :param tol: target error, relative to the norm of the vectors
+        :param max_steps: upper bound of the number of steps
+        :return: (m,) np.array of ints between 1 and max_steps
+        '''
+        n_steps = ceil(dist[..., 0]**1.5/sqrt(tol))
+        return clip(n_steps, 1, max_steps).astype(intp)
+
+    def _adaptive_pole_ladder(self, vec_Tp0M, point_0, point_1, tol, max_steps):
+        '''
+        Pole ladder with a number of steps chosen per row from the error it
+        measures. Every row starts with one step, and rows whose transport
+        changes by more than tol, relative to the norm of the vector, when
+        their number of steps is doubled, are refined again, up to
+        ladder_steps. Vectors are transported scaled down to well within the
+        injectivity radius, where the exponential and logarithmic maps are
+        accurate, and scaled back, as parallel transport is linear.
+        :return: vec_Tp0M after parallel transport to point 1, and the (m,)
+                 np.array of the numbers of steps taken by the flattened rows
+        '''
+        # Rows are selected by index, so broadcast batches are flattened
+        shape = broadcast_shapes(vec_Tp0M.shape, point_0.shape, point_1.shape)
+        vec_Tp0M, point_0, point_1 = (
+            broadcast_to(array, shape).reshape(-1, shape[-1])
+            for array in (vec_Tp0M, point_0, point_1)
+        )
+        max_row_steps = self.ladder_steps(self.distance(point_0, point_1), tol,
+                                          max_steps)
+        if self.curvature:
+            radius = 0.5/sqrt(abs(self.curvature))
+        else:
+            radius = 0.5
+        norm = sqrt(maximum(
+                    self.inner_product(point_0, vec_Tp0M, vec_Tp0M), 0.))
+        scale = where(norm > radius, norm/radius, 1.)
+        vec_Tp0M = vec_Tp0M/scale
+        # Errors are measured in the ambient coordinates
+        abs_tol = tol*sqrt(einsum("ai,ai->a", vec_Tp0M, vec_Tp0M))
+
+        steps = ones(max_row_steps.shape, dtype=intp)
+        vec_Tp1M = self._pole_ladder_rows(vec_Tp0M, point_0, point_1, steps)
+        rows = flatnonzero(steps < max_row_steps)
+        while rows.size > 0:
+            steps[rows] = minimum(2*steps[rows], max_row_steps[rows])
+            finer = self._pole_ladder_rows(vec_Tp0M[rows], point_0[rows],
+                                           point_1[rows], steps[rows])
+            error = sqrt(einsum("ai,ai->a", finer - vec_Tp1M[rows],
+                                finer - vec_Tp1M[rows]))
+            vec_Tp1M[rows] = finer
+            rows = rows[(error > abs_tol[rows]) &
+                        (steps[rows] < max_row_steps[rows])]
+
+        return (vec_Tp1M*scale).reshape(shape), steps
+
+    def _pole_ladder_rows(self, vec_Tp0M, point_0, point_1, steps):
+        '''
+        Pole ladder with its own number of steps for each row. Rows leave
+        the loop once their ladder is complete.
+        :param vec_Tp0M, point_0, point_1: (m, n_dims+1) np.arrays
+        :param steps: (m,) np.array of the numbers of steps
+        :return: (m, n_dims+1) np.array, vec_Tp0M after parallel transport
+        '''
+        vec_TpaM = vec_Tp0M.copy()
+        point_a = point_0.copy()
+        for i in range(steps.max(initial=0)):
+            # Rows whose ladder has more than i steps
+            rows = flatnonzero(steps > i)
+            n_rows = steps[rows, None]
+            point_b = self.exp_log_roundtrip(point_0[rows], point_1[rows],
+                                             (i + 1.)/n_rows)
+            is_last = (steps[rows] == i + 1)
+            point_b[is_last] = point_1[rows[is_last]]
+            vec_TpaM[rows] = self._pole_ladder_transport(
+                            vec_TpaM[rows],
+                            point_a[rows],
+                            point_b,
+                            midpt_01=self.exp_log_roundtrip(
+                                point_0[rows], point_1[rows], (i + 0.5)/n_rows)
+            )
+            point_a[rows] = point_b
+        return vec_TpaM
+
+    def _ladder_points(self, point_0, point_1, n_steps):
+        '''
+        Rungs of the n_steps pole ladder from point_0 to point_1 and the
+        midpoints between them, all computed from one geodesic
+        :return: (m, 2 n_steps + 1, n_dims+1) np.array, the rungs at even
+                 and the midpoints at odd indices
+        '''
+        ladder = self.geodesic(point_0, point_1, linspace(0., 1., 2*n_steps + 1))
+        ladder[..., 0, :] = point_0
+        ladder[..., -1, :] = point_1
+        return ladder
+
+    def transport_factors(self, point_0, point_1):
+        '''
+        Parallel transport from the tangent space of point_0 to that of
+        point_1 as a rank one update of the identity, for manifolds where it
+        has a closed form: transported vectors are
+        vector + image (covector . vector), see apply_transport_factors.
+        :param point_0: (m, n_dims+1) np.array, representing m initial points
+        :param point_1: (m, n_dims+1) np.array, representing m final points
+        :return: image, covector: (m, n_dims+1) np.arrays, the image of the
+                 unit direction of the geodesic and that direction with its
+                 index lowered by the metric
+        '''
+        raise NotImplementedError("No closed form transport for this manifold")
+
+    def apply_transport_factors(self, image, covector, vec_Tp0M):
+        '''
+        Parallel transport vectors with the factors of transport_factors
+        :param image, covector: (m, n_dims+1) np.arrays, or any arrays that
+                                broadcast against vec_Tp0M
+        :param vec_Tp0M: (m, n_dims+1) np.array of vectors in Tp0M
+        :return: vec_Tp0M after parallel transport
+        '''
+        return vec_Tp0M + image*einsum("...i,...i->...", covector,
+                                       vec_Tp0M)[..., None]
+
+    def _initial_mean(self, points, weights, groups, n_groups):
+        '''
+        Starting point of the Frechet mean iteration: the first point of each
+        group. Subclasses may provide a better, cheap estimate.
+        :param points: (N, n_dims+1) np.array, the points to average
+        :param weights: (N, 1) np.array, the weight of each point
+        :param groups: (N,) np.array of ints in [0, n_groups), group of each point
+        :param n_groups: number of groups
+        :return: (n_groups, n_dims+1) np.array, one initial mean per group
+        '''
+        initial = full((n_groups, points.shape[1]), nan, dtype=points.dtype)
+        labels, first = unique(groups, return_index=True)
+        initial[labels] = points[first]
+        return initial
+
+    def frechet_mean(self, points, weights=None, groups=None, n_groups=None,
+                     max_iter=100, tol=1e-10):
+        '''
+        Frechet (Karcher) mean of points, or of many groups of points at once,
+        by the fixed-point iteration mean <- exp(mean, weighted average of
+        log(mean, point)). All groups are iterated in one vectorised pass, and
+        groups whose update has converged stop being evaluated.
+        :param points: (N, n_dims+1) np.array, the points to average
+        :param weights: optional (N,) or (N, 1) np.array of non-negative
+                        weights. Defaults to equal weights.
+        :param groups: optional (N,) np.array of ints in [0, n_groups), the
+                       group of each point. Defaults to a single group.
+        :param n_groups: number of groups. Defaults to max(groups) + 1.
+        :param max_iter: maximum number of fixed-point iterations
+        :param tol: a group has converged when the norm of its update is
+                    below tol
+        :return: (n_groups, n_dims+1) np.array, the mean of each group. Groups
+                 without points have nan means.
+        '''
+        weights, groups, n_groups = _group_arguments(
+                                            points, weights, groups, n_groups)
+        total_weight = _group_sum(weights, groups, n_groups)
+        mean = self._initial_mean(points, weights, groups, n_groups)
+        # Steps below the resolution of the points' type cannot be resolved
+        tol = max(tol, _eps(points))
+
+        active_groups = flatnonzero(total_weight[:, 0] > 0.)
+        is_active = zeros(n_groups, dtype=bool)
+        is_active[active_groups] = True
+        for _ in range(max_iter):
+            if active_groups.size == 0:
+                break
+            # Only points of groups that have not yet converged are revisited
+            rows = flatnonzero(is_active[groups])
+            row_groups = groups[rows]
+            v_TpM = self.logarithmic_map(mean[row_groups], points[rows])
+            v_TpM *= weights[rows]
+            step = _group_sum(v_TpM, row_groups, n_groups)[active_groups]
+            step /= total_weight[active_groups]
+            # Squared norms, as rounding may make those of small steps in
+            # indefinite metrics negative
+            converged = self.inner_product(mean[active_groups], step,
+                                           step)[:, 0] < tol**2
+            mean[active_groups] = self.exponential_map(mean[active_groups], step)
+
+            is_active[active_groups[converged]] = False
+            active_groups = active_groups[~converged]
+
+        return mean
+
+
+def _eps(array):
+    '''
+    Machine epsilon of the type of array, so that thresholds follow the
+    precision of the data. Non-floating arrays use that of float64.
+    :param array: np.array
+    :return: float
+    '''
+    if issubdtype(array.dtype, floating):
+        return float(finfo(array.dtype).eps)
+    return float(finfo(float64).eps)
+
+
+def _group_arguments(points, weights, groups, n_groups):
+    '''
+    Fill in defaults for the weights and grouping of a set of points
+    :param points: (N, n_dims+1) np.array
+    :param weights: (N,) or (N, 1) np.array, or None for equal weights
+    :param groups: (N,) np.array of ints, or None for a single group
+    :param n_groups: number of groups, or None to infer from groups
+    :return: (N, 1) weights, (N,) groups and the number of groups
+    '''
+    if weights is None:
+        weights = ones((points.shape[0], 1), dtype=points.dtype)
+    else:
+        weights = reshape(asarray(weights, dtype=points.dtype), (-1, 1))
+    if groups is None:
+        groups = zeros(points.shape[0], dtype=intp)
+        n_groups = 1
+    else:
+        groups = asarray(groups, dtype=intp)
+        if n_groups is None:
+            n_groups = int(groups.max()) + 1 if groups.size else 0
+    return weights, groups, n_groups
+
+
+def _group_sum(values, groups, n_groups):
+    '''
+    Sum the rows of values belonging to each group
+    :param values: (N, k) np.array
+    :param groups: (N,) np.array of ints in [0, n_groups)
+    :param n_groups: number of groups
+    :return: (n_groups, k) np.array, the sum of the rows of each group
+    '''
+    sums = zeros((n_groups, values.shape[1]), dtype=values.dtype)
+    add.at(sums, groups, values)
+    return sums
@@ -1,31 +1,146 @@
-from numpy import einsum, eye, reshape, sqrt
+from numpy import array_equal, diag, diagonal, einsum, eye, float32, matmul, \
+    ones, result_type, sqrt
+from numpy.linalg import solve
+
+# Structures a metric tensor can have. dot and norm pick a kernel by structure:
+# identity and diagonal metrics cost O(n) per row, dense metrics O(n^2).
+IDENTITY = "identity"
+DIAGONAL = "diagonal"
+DENSE = "dense"
+
+
+def _working_dtype(*arrays):
+    '''
+    Floating point type in which products of arrays with the metric tensor
+    are computed: the type of the arrays, so that float32 data stays float32
+    rather than being promoted by the float64 metric tensor. Integer arrays
+    are computed in float64.
+    :param arrays: np.arrays
+    :return: np.dtype
+    '''
+    return result_type(float32, *(array.dtype for array in arrays))
+
 
 class Metric:
     '''
     Base class for metric
     '''
 
-    def __init__(self, n_dims):
+    def __init__(self, n_dims, metric=None):
         '''
 
         :param n_dims: dimensions of the space
+        :param metric: optional (n_dims, n_dims) np.array, the metric tensor.
+                        Its structure (identity, diagonal or dense) is detected
+                        so that the cheapest dot product kernel is used.
         '''
         self.n_dims = n_dims
         self.metric = None
+        self.signature = None
+        self.structure = DENSE
+        if metric is not None:
+            self._set_metric(metric)
+
+    def _set_metric(self, metric):
+        '''
+        Store metric tensor and classify its structure
+        :param metric: (n_dims, n_dims) np.array, the metric tensor
+        '''
+        self.metric = metric
+        signature = diagonal(metric).copy()
+        if array_equal(metric, eye(self.n_dims)):
+            self.structure = IDENTITY
+            self.signature = signature
+        elif array_equal(metric, diag(signature)):
+            self.structure = DIAGONAL
+            self.signature = signature
+        else:
+            self.structure = DENSE
+            self.signature = None
+
+    def _signature(self, *arrays):
+        '''
+        :param arrays: np.arrays the signature is to be applied to
+        :return: (n_dims,) np.array, the diagonal of the metric tensor in the
+                 working type of arrays
+        '''
+        return self.signature.astype(_working_dtype(*arrays), copy=False)
+
+    def _metric(self, *arrays):
+        '''
+        :param arrays: np.arrays the metric tensor is to be applied to
+        :return: (n_dims, n_dims) np.array, the metric tensor in the working
+                 type of arrays
+        '''
+        return self.metric.astype(_working_dtype(*arrays), copy=False)
 
     def dot(self, u, v):
         '''
-            Calculate dot_product for two vectors, u and v
-            :param u, v: (m, n_dims) np.arrays, each representing m vectors
-            :returns m, 1) u.v
+            Calculate dot_product for two vectors, u and v. Leading batch
+            dimensions broadcast as in NumPy, so one vector can be compared
+            with many without being tiled.
+            :param u, v: (..., n_dims) np.arrays of vectors, with
+                         broadcastable batch dimensions such as (m,) or (1,)
+            :returns (..., 1) np.array, u.v
+        '''
+        if self.structure == IDENTITY:
+            uv = einsum("...i,...i->...", u, v)
+        elif self.structure == DIAGONAL:
+            uv = einsum("i,...i,...i->...", self._signature(u, v), u, v)
+        else:
+            uv = einsum("...i,...i->...", u @ self._metric(u, v), v)
+        return uv[..., None]
+
+    def gram(self, u, v, out=None):
+        '''
+            Calculate dot products between all pairs of rows of u and v
+            with a single matrix multiplication
+            :param u: (m, n_dims) np.array, representing m vectors
+            :param v: (k, n_dims) np.array, representing k vectors
+            :param out: optional (m, k) np.array to write the result into
+            :return: (m, k) np.array, with element [a, b] equal to u[a].v[b]
+        '''
+        if self.structure == IDENTITY:
+            return matmul(u, v.T, out=out)
+        elif self.structure == DIAGONAL:
+            return matmul(u*self._signature(u, v), v.T, out=out)
+        else:
+            return matmul(u @ self._metric(u, v), v.T, out=out)
+
+    def raise_index(self, u):
+        '''
+        Apply the inverse metric tensor to u, turning covectors (such as
+        Euclidean gradients) into vectors
+        :param u: (..., n_dims) np.array of covectors
+        :return: (..., n_dims) np.array of vectors
+        '''
+        if self.structure == IDENTITY:
+            return u
+        elif self.structure == DIAGONAL:
+            return u/self._signature(u)
+        else:
+            flat = u.reshape(-1, self.n_dims)
+            return solve(self._metric(u), flat.T).T.reshape(u.shape)
+
+    def lower_index(self, u):
+        '''
+        Apply the metric tensor to u, turning vectors into covectors, so that
+        dot(u, v) equals lower_index(u).v
+        :param u: (..., n_dims) np.array of vectors
+        :return: (..., n_dims) np.array of covectors
         '''
-        return reshape(einsum("ij,ai,aj->a", self.metric, u, v), (-1, 1))
+        if self.structure == IDENTITY:
+            return u
+        elif self.structure == DIAGONAL:
+            return u*self._signature(u)
+        else:
+            return u @ self._metric(u)
 
     def norm(self, u):
         '''
         Calculate the norm of u
-        :param u: (m, n_dims) np.array, representing m vectors:
-        :return: (m, 1) dimensional np.array, representing the norm of u
+        :param u: (..., n_dims) np.array of vectors, such as (m, n_dims)
+        :return: (..., 1) dimensional np.array, representing the norm of u
         '''
         return sqrt(self.dot(u, u))
 
@@ -42,6 +157,8 @@ class EuclideanMetric(Metric):
         '''
         self.n_dims = n_dims
         self.metric = eye(n_dims)
+        self.signature = ones(n_dims)
+        self.structure = IDENTITY
 
 
 class MinkowskiMetric(Metric):
@@ -57,4 +174,6 @@ class MinkowskiMetric(Metric):
         '''
         self.n_dims = n_dims
         self.metric = eye(n_dims)
-        self.metric[0,0] = -1.
\ No newline at end of file
+        self.metric[0,0] = -1.
+        self.signature = diagonal(self.metric).copy()
+        self.structure = DIAGONAL
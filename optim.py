@@ -0,0 +1,204 @@
+from numpy import add, arange, asarray, intp, sqrt, unique, zeros
+
+
+def _touched_rows(params, grad, rows):
+    '''
+    Normalise the rows updated by an optimizer step. Gradients of rows that
+    appear several times are summed, as for a sparse gradient.
+    :param params: (N, n_dims+1) np.array, the parameter matrix
+    :param grad: (k, n_dims+1) np.array, gradients of the rows in rows, or
+                 (N, n_dims+1) gradients of all rows if rows is None
+    :param rows: (k,) np.array of row indices, or None for all rows
+    :return: ((r,) np.array of distinct row indices, (r, n_dims+1) np.array
+             of their gradients)
+    '''
+    grad = asarray(grad)
+    if rows is None:
+        if grad.shape != params.shape:
+            raise ValueError("grad has shape {}, expected {}".format(
+                                                        grad.shape, params.shape))
+        return arange(params.shape[0]), grad
+    rows = asarray(rows, dtype=intp)
+    if rows.shape[0] != grad.shape[0]:
+        raise ValueError("Got {} rows but {} gradients".format(
+                                                    rows.shape[0], grad.shape[0]))
+    rows, position = unique(rows, return_inverse=True)
+    if rows.shape[0] != grad.shape[0]:
+        summed = zeros((rows.shape[0], grad.shape[1]), dtype=grad.dtype)
+        add.at(summed, position, grad)
+        grad = summed
+    elif (position != arange(rows.shape[0])).any():
+        reordered = zeros(grad.shape, dtype=grad.dtype)
+        reordered[position] = grad
+        grad = reordered
+    return rows, grad
+
+
+class RiemannianOptimizer:
+    '''
+        Base class for optimizers of points on a manifold, stored as the rows
+        of a parameter matrix. A step only reads and writes the rows it is
+        given, so the cost of sparse updates does not depend on the size of
+        the matrix.
+    '''
+
+    def __init__(self, manifold, lr, retraction=False):
+        '''
+
+        :param manifold: Manifold on which the rows of the parameters lie
+        :param lr: learning rate
+        :param retraction: if True, or the name of a kind of
+                           Manifold.retraction, move points with that cheaper
+                           retraction instead of the exponential map
+        '''
+        self.manifold = manifold
+        self.lr = lr
+        self.retraction = retraction
+
+    def _move(self, point, v_TpS):
+        '''
+        Follow v_TpS from point, by exponential map or retraction
+        '''
+        if self.retraction:
+            kind = "projection" if self.retraction is True else self.retraction
+            return self.manifold.retraction(point, v_TpS, kind=kind)
+        # Rounding errors of the exponential map accumulate over many steps,
+        # so the result is mapped back onto the manifold
+        return self.manifold.project_to_manifold(
+                                    self.manifold.exponential_map(point, v_TpS))
+
+    def step(self, params, grad, rows=None):
+        '''
+        Update params in place along the negative Riemannian gradient
+        :param params: (N, n_dims+1) np.array, rows are points on the manifold
+        :param grad: Euclidean gradient with respect to the coordinates:
+                     (k, n_dims+1) np.array for the rows in rows, or
+                     (N, n_dims+1) np.array for all rows if rows is None
+        :param rows: optional (k,) np.array of the indices of updated rows.
+                     Repeated rows have their gradients summed.
+        :return: params
+        '''
+        raise NotImplementedError("Should be implemented by subclass")
+
+
+class RiemannianSGD(RiemannianOptimizer):
+    '''
+        Riemannian stochastic gradient descent:
+        x <- exp_x(-lr * grad f(x))
+    '''
+
+    def __init__(self, manifold, lr=0.01, retraction=False):
+        '''
+
+        :param manifold: Manifold on which the rows of the parameters lie
+        :param lr: learning rate
+        :param retraction: if True, or the name of a kind of
+                           Manifold.retraction, move points with that cheaper
+                           retraction instead of the exponential map
+        '''
+        super().__init__(manifold, lr, retraction)
+
+    def step(self, params, grad, rows=None):
+        '''
+        Update params in place: x <- exp_x(-lr * grad f(x)) for each row
+        :param params: (N, n_dims+1) np.array, rows are points on the manifold
+        :param grad: Euclidean gradient of the rows in rows, see
+                     RiemannianOptimizer.step
+        :param rows: optional (k,) np.array of the indices of updated rows
+        :return: params
+        '''
+        rows, grad = _touched_rows(params, grad, rows)
+        point = params[rows]
+        rgrad = self.manifold.riemannian_gradient(point, grad)
+        params[rows] = self._move(point, -self.lr*rgrad)
+        return params
+
+
+class RiemannianAdam(RiemannianOptimizer):
+    '''
+        Riemannian Adam (Becigneul & Ganea, arXiv:1810.00760). The first
+        moment is a tangent vector, carried to the new point after every step
+        by parallel transport, or by projection onto the new tangent space
+        when retraction is used. The second moment is the running mean of
+        squared gradient norms of each row.
+
+        Moments and step counts are kept per row, and rows that are not
+        touched by a step keep their state unchanged (lazy Adam), so bias
+        correction uses each row's own step count.
+    '''
+
+    def __init__(self, manifold, lr=0.001, betas=(0.9, 0.999), eps=1e-8,
+                 retraction=False):
+        '''
+
+        :param manifold: Manifold on which the rows of the parameters lie
+        :param lr: learning rate
+        :param betas: decay rates of the first and second moments
+        :param eps: added to the denominator for numerical stability
+        :param retraction: if True, or the name of a kind of
+                           Manifold.retraction, move points with that cheaper
+                           retraction and transport the first moment by
+                           projection, instead of exponential map and
+                           parallel transport
+        '''
+        super().__init__(manifold, lr, retraction)
+        self.betas = betas
+        self.eps = eps
+        self.first_moment = None
+        self.second_moment = None
+        self.n_steps = None
+
+    def _init_state(self, params):
+        '''
+        Allocate zero moments and step counts for every row of params
+        '''
+        self.first_moment = zeros(params.shape, dtype=params.dtype)
+        self.second_moment = zeros((params.shape[0], 1), dtype=params.dtype)
+        self.n_steps = zeros((params.shape[0], 1), dtype=intp)
+
+    def _transport(self, vector, point_0, point_1):
+        '''
+        Carry vector from the tangent space of point_0 to that of point_1,
+        by parallel transport or, with retraction, by projection alone. The
+        transported vector is also projected, to remove rounding errors.
+        '''
+        if not self.retraction:
+            vector = self.manifold.parallel_transport(vector, point_0, point_1)
+        return self.manifold.project_to_tangent_space(point_1, vector)
+
+    def step(self, params, grad, rows=None):
+        '''
+        Update params, and the moments of the updated rows, in place
+        :param params: (N, n_dims+1) np.array, rows are points on the manifold
+        :param grad: Euclidean gradient of the rows in rows, see
+                     RiemannianOptimizer.step
+        :param rows: optional (k,) np.array of the indices of updated rows
+        :return: params
+        '''
+        if self.first_moment is None:
+            self._init_state(params)
+        elif self.first_moment.shape != params.shape:
+            raise ValueError("params has shape {}, but optimizer state has {}"
+                             .format(params.shape, self.first_moment.shape))
+        beta1, beta2 = self.betas
+        rows, grad = _touched_rows(params, grad, rows)
+        point = params[rows]
+        rgrad = self.manifold.riemannian_gradient(point, grad)
+
+        n_steps = self.n_steps[rows] + 1
+        first_moment = beta1*self.first_moment[rows] + (1. - beta1)*rgrad
+        second_moment = beta2*self.second_moment[rows] + \
+                        (1. - beta2)*self.manifold.inner_product(point, rgrad,
+                                                                 rgrad)
+        first_unbiased = first_moment/(1. - beta1**n_steps)
+        second_unbiased = second_moment/(1. - beta2**n_steps)
+
+        new_point = self._move(
+                        point,
+                        -self.lr*first_unbiased/(sqrt(second_unbiased) + self.eps)
+        )
+        params[rows] = new_point
+        self.first_moment[rows] = self._transport(first_moment, point, new_point)
+        self.second_moment[rows] = second_moment
+        self.n_steps[rows] = n_steps
+        return params
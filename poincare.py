@@ -0,0 +1,262 @@
+from backend import sharded
+from manifold import Manifold, _eps
+from metric import EuclideanMetric
+from numpy import arccosh, arctanh, finfo, float64, maximum, minimum, \
+    multiply, ones, sqrt, tanh, where, zeros
+from validation import validated
+
+
+def _project_to_ball(point, max_norm):
+    '''
+    Shrink points radially so that none has a norm above max_norm
+    :param point: (m, n_dims) np.array, representing m points
+    :param max_norm: largest allowed Euclidean norm, below 1
+    :return: (m, n_dims) np.array, the points inside the ball of max_norm
+    '''
+    norm = sqrt((point*point).sum(axis=1, keepdims=True))
+    return point*minimum(1., max_norm/maximum(norm, finfo(float64).tiny))
+
+
+class PoincareBall(Manifold):
+    '''
+        Poincare ball model of hyperbolic space: the open unit ball of R^n
+        with the conformal metric lambda_x^2 * identity, where
+        lambda_x = 2/(1 - |x|^2). Unlike Hyperboloid, points and tangent
+        vectors have n coordinates rather than n+1, and self.metric is the
+        Euclidean inner product of these coordinates.
+    '''
+    curvature = -1.
+    # Points are kept at Euclidean norm at most 1 - boundary_eps, where the
+    # conformal factor is still finite
+    boundary_eps = 1e-10
+
+    def __init__(self, n_dims):
+        '''
+
+        :param n_dims: dimensions of the manifold
+        '''
+        self.n_dims = n_dims
+        self.metric = EuclideanMetric(n_dims)
+
+    def _conformal_factor(self, point):
+        '''
+        :param point: (m, n_dims) np.array, representing m points
+        :return: (m, 1) np.array, lambda_x = 2/(1 - |x|^2)
+        '''
+        return 2./(1. - self.metric.dot(point, point))
+
+    def is_on_manifold(self, point):
+        '''
+        Determine whether point is inside the unit ball
+        :param point: (m, n_dims) np.array, representing m points
+        :return: (m, 1) np.array of booleans
+        '''
+        return self.metric.dot(point, point) < 1.
+
+    def is_in_tangent_space(self, point, vector):
+        '''
+        Every vector of R^n is in the tangent space of every point
+        :param point: (m, n_dims) np.array, representing m points
+        :param vector: (m, n_dims) np.array, representing m vectors
+        :return: (m, 1) np.array of True
+        '''
+        return ones((vector.shape[0], 1), dtype=bool)
+
+    def _tangent_residual(self, point, vector):
+        '''
+        Every vector is in the tangent space, for validation
+        :return: (m, 1) np.array of zeros
+        '''
+        return zeros(vector.shape[:-1] + (1,))
+
+    @validated(points=("u", "v"))
+    @sharded(n_cols=1)
+    def distance(self, u, v):
+        '''
+        Calculate the distance on the manifold between two points
+        d = arccosh(1 + 2|u - v|^2/((1 - |u|^2)(1 - |v|^2)))
+        :param u, v:, (m, n_dims) np.arrays, each representing m points
+        :return: (m, 1) dimensional np.array, the distance between u and v
+        '''
+        diff = u - v
+        arg = 1. + 2.*self.metric.dot(diff, diff)/(
+                (1. - self.metric.dot(u, u))*(1. - self.metric.dot(v, v)))
+        return arccosh(maximum(arg, 1.))
+
+    def _distance_from_gram(self, gram, X, Y):
+        '''
+        Convert, in place, a matrix of Euclidean dot products between points
+        into the matrix of distances between them.
+        :param gram: (m, k) np.array, dot products between m and k points.
+                     Overwritten with the distances.
+        :param X, Y: (m, n_dims) and (k, n_dims) np.arrays, the points
+        :return: gram
+        '''
+        sq_X = self.metric.dot(X, X)
+        sq_Y = self.metric.dot(Y, Y).T
+        # |x - y|^2 = |x|^2 + |y|^2 - 2 x.y
+        gram *= -2.
+        gram += sq_X
+        gram += sq_Y
+        maximum(gram, 0., out=gram)
+        gram *= 2./(1. - sq_X)
+        gram /= 1. - sq_Y
+        gram += 1.
+        return arccosh(gram, out=gram)
+
+    def mobius_add(self, u, v):
+        '''
+        Mobius addition of points of the ball, u (+) v
+        :param u, v: (m, n_dims) np.arrays, each representing m points
+        :return: (m, n_dims) np.array
+        '''
+        uv = self.metric.dot(u, v)
+        sq_u = self.metric.dot(u, u)
+        sq_v = self.metric.dot(v, v)
+        return ((1. + 2.*uv + sq_v)*u + (1. - sq_u)*v)/(1. + 2.*uv + sq_u*sq_v)
+
+    def _gyration(self, u, v, w):
+        '''
+        Gyration gyr[u, v]w, the rotation relating u (+) (v (+) w) to
+        (u (+) v) (+) w. Linear in w.
+        :param u, v: (m, n_dims) np.arrays, each representing m points
+        :param w: (m, n_dims) np.array, representing m vectors
+        :return: (m, n_dims) np.array
+        '''
+        uv = self.metric.dot(u, v)
+        uw = self.metric.dot(u, w)
+        vw = self.metric.dot(v, w)
+        sq_u = self.metric.dot(u, u)
+        sq_v = self.metric.dot(v, v)
+        a = -uw*sq_v + vw + 2.*uv*vw
+        b = -vw*sq_u - uw
+        return w + 2.*(a*u + b*v)/(1. + 2.*uv + sq_u*sq_v)
+
+    @sharded(skipped="vector")
+    def project_to_tangent_space(self, point, vector, out=None,
+                                 workspace=None):
+        '''
+        The tangent space of every point is the whole of R^n, so vectors are
+        unchanged
+        :param point:  (m, n_dims) np.array, representing m points
+        :param vector: (m, n_dims) np.array, representing m vectors
+        :param out: optional (m, n_dims) np.array to write the result into
+        :param workspace: unused
+        :return: (m, n_dims) np.array, a copy of vector
+        '''
+        if out is None:
+            return vector.copy()
+        out[...] = vector
+        return out
+
+    def inner_product(self, point, u, v):
+        '''
+        Inner product of tangent vectors under the conformal metric
+        :param point: (m, n_dims) np.array, representing m points
+        :param u, v: (m, n_dims) np.arrays, vectors in tangent spaces of point
+        :return: (m, 1) np.array, lambda_x^2 u.v
+        '''
+        return self._conformal_factor(point)**2*self.metric.dot(u, v)
+
+    def riemannian_gradient(self, point, euclidean_gradient):
+        '''
+        Rescale the Euclidean gradient by the inverse conformal metric
+        :param point: (m, n_dims) np.array, representing m points
+        :param euclidean_gradient: (m, n_dims) np.array
+        :return: (m, n_dims) np.array, the Riemannian gradient
+        '''
+        return euclidean_gradient/self._conformal_factor(point)**2
+
+    def project_to_manifold(self, point):
+        '''
+        Shrink points on or outside the unit sphere back into the ball
+        :param point: (m, n_dims) np.array, representing m points
+        :return: (m, n_dims) np.array, m points in the ball
+        '''
+        return _project_to_ball(point, 1. - self.boundary_eps)
+
+    def retraction(self, point, v_TpS, kind="projection"):
+        '''
+        Cheap approximation of the exponential map, for small steps:
+        "projection" is the first order point + v_TpS, kept inside the ball,
+        and "exp" is the exponential map itself.
+        :param point: (m, n_dims) np.array, representing m points
+        :param v_TpS: (m, n_dims) np.array, representing m tangent vectors
+        :param kind: "projection" or "exp"
+        :return: (m, n_dims) np.array, m points in the ball
+        '''
+        if kind == "second_order":
+            raise ValueError("Second order retraction is not available in the "
+                             "Poincare ball")
+        return super().retraction(point, v_TpS, kind)
+
+    @validated(points=("point",), vectors=(("v_TpS", "point"),))
+    @sharded(skipped="point")
+    def exponential_map(self, point, v_TpS, out=None, workspace=None):
+        '''
+        Follow geodesic in direction v_TpS from point and
+        return the resulting point.
+        exp_x(v) = x (+) tanh(lambda_x |v|/2) v/|v|
+
+        :param point: (m, n_dims) np.array, representing m points
+        :param v_TpS: (m, n_dims) np.array, representing m tangent vectors
+        :param out: optional (m, n_dims) np.array to write the result into.
+                    May be point itself.
+        :param workspace: optional (m, n_dims) np.array used as scratch
+                          space for the scaled tangent vectors
+        :return: (m, n_dims) np.array, m points along the geodesics
+        '''
+        norm_v_TpS = self.metric.norm(v_TpS)
+        is_zero = norm_v_TpS < _eps(v_TpS)
+        coeff_v = where(
+            is_zero,
+            0.,
+            tanh(0.5*self._conformal_factor(point)*norm_v_TpS)/where(
+                                                    is_zero, 1., norm_v_TpS)
+        )
+        result = self.project_to_manifold(
+                    self.mobius_add(point, multiply(coeff_v, v_TpS, out=workspace)))
+        if out is None:
+            return result
+        out[...] = result
+        return out
+
+    @validated(points=("point0", "point1"))
+    @sharded()
+    def logarithmic_map(self, point0, point1, out=None):
+        '''
+        Inverse of exponential map
+        log_x(y) = 2/lambda_x artanh(|w|) w/|w|, w = (-x) (+) y
+
+        :param point0: (m, n_dims) np.array, representing m "base" points
+        :param point1: (m, n_dims) np.array, representing m "target" points
+        :param out: optional (m, n_dims) np.array to write the result into
+        :return: (m, n_dims) np.array, m tangent vectors at point0
+        '''
+        w = self.mobius_add(-point0, point1)
+        norm_w = self.metric.norm(w)
+        is_good = norm_w > _eps(w)
+        # For vanishing w, artanh(|w|)/|w| tends to 1
+        scale = where(
+                        is_good,
+                        arctanh(minimum(norm_w, 1. - self.boundary_eps))/where(
+                                                        is_good, norm_w, 1.),
+                        1.
+        )*(2./self._conformal_factor(point0))
+        return multiply(w, scale, out=out)
+
+    @validated(points=("point_0", "point_1"),
+               vectors=(("vec_Tp0M", "point_0"),))
+    @sharded(skipped="vec_Tp0M")
+    def parallel_transport(self, vec_Tp0M, point_0, point_1):
+        '''
+        Parallel transport vector in tangent space of point 0 (Tp0M) to the
+        tangent space of point 1 (Tp1M), along the geodesic:
+        P(v) = lambda_0/lambda_1 gyr[x_1, -x_0] v
+        :param vec_Tp0M: (m, n_dims) np.array, vector in Tp0M to transport
+        :param point_0: initial point where vec_Tp0M
+        :param point_1: final point to which vec_Tp0M will be transported
+        :return: vec_Tp0M after parallel transport to point 1
+        '''
+        return self._gyration(point_1, -point_0, vec_Tp0M)*(
+                self._conformal_factor(point_0)/self._conformal_factor(point_1))
@@ -0,0 +1,429 @@
+'''
+    Products of manifolds, for mixed-curvature embeddings. The coordinates
+    of all the factors are packed side by side into one (m, D) array, and
+    each operation is dispatched to the factors on views of their columns,
+    without copying:
+
+        product = ProductManifold([Sphere(2), (Hyperboloid(2), 4), Euclidean(8)])
+        product.offsets     # array([ 0,  3, 15, 23])
+        distances = product.distance(u, v)
+
+    A factor given as (manifold, n_copies) is stacked: its copies occupy
+    consecutive columns and are processed by a single call on an
+    (m*n_copies, k) batch, rather than one call per copy.
+'''
+from backend import sharded
+from inspect import signature
+from manifold import Manifold
+from metric import Metric
+from numpy import add, arange, broadcast_arrays, cumsum, empty, einsum, \
+    ndarray, repeat, result_type, sqrt, zeros
+from validation import validated
+
+
+class ProductManifold(Manifold):
+    '''
+        Cartesian product of manifolds, with the product metric: squared
+        distances and squared norms are the sums of those of the factors.
+        self.metric is the block diagonal metric of the coordinates, which
+        is only the product metric when no factor's metric depends on the
+        point. inner_product combines the metrics of the factors, including
+        those of PoincareBall and Klein.
+    '''
+
+    def __init__(self, factors):
+        '''
+
+        :param factors: sequence of Manifolds, or of (Manifold, n_copies)
+                        pairs for factors repeated n_copies times
+        '''
+        self.factors = [
+            factor if isinstance(factor, tuple) else (factor, 1)
+            for factor in factors
+        ]
+        widths = [factor.metric.n_dims*n_copies
+                  for factor, n_copies in self.factors]
+        # Column of the first coordinate of each factor, and the total width
+        self.offsets = cumsum([0] + widths)
+        self.slices = [slice(start, stop) for start, stop
+                       in zip(self.offsets[:-1], self.offsets[1:])]
+        self.n_dims = sum(factor.n_dims*n_copies
+                          for factor, n_copies in self.factors)
+        # Columns of every copy of every factor
+        self._copies = [
+            (factor, slice(cols.start + copy*factor.metric.n_dims,
+                           cols.start + (copy + 1)*factor.metric.n_dims))
+            for (factor, n_copies), cols in zip(self.factors, self.slices)
+            for copy in range(n_copies)
+        ]
+
+        tensor = zeros((self.offsets[-1], self.offsets[-1]))
+        for factor, cols in self._copies:
+            tensor[cols, cols] = factor.metric.metric
+        self.metric = Metric(self.offsets[-1], tensor)
+
+    @property
+    def curvature(self):
+        '''
+        Products are not of constant curvature, except for a single factor
+        '''
+        if len(self._copies) == 1:
+            return self._copies[0][0].curvature
+        return None
+
+    def _part(self, array, block):
+        '''
+        Columns of one factor in array, with the copies of a stacked factor
+        as consecutive rows
+        :param array: (m, D) np.array
+        :param block: index of the factor
+        :return: (m, k) view of array, or (m*n_copies, k) np.array
+        '''
+        factor, n_copies = self.factors[block]
+        part = array[:, self.slices[block]]
+        if n_copies == 1:
+            return part
+        return part.reshape(-1, factor.metric.n_dims)
+
+    def _apply(self, name, arrays, out=None, **kwargs):
+        '''
+        Call a row-wise method of every factor on its columns of arrays,
+        writing the results into the same columns of out
+        :param name: name of the method, whose result has as many columns
+                     as its first argument
+        :param arrays: sequence of (m, D) np.arrays, the array arguments
+        :param out: optional (m, D) np.array to write the result into
+        :param kwargs: further arguments of the method. Row-aligned
+                       np.arrays, such as (m, 1) times, are repeated for the
+                       copies of stacked factors.
+        :return: (m, D) np.array
+        '''
+        n_rows = arrays[0].shape[0]
+        if out is None:
+            out = empty((n_rows, self.offsets[-1]),
+                        dtype=result_type(*arrays))
+        for block, ((factor, n_copies), cols) in enumerate(
+                                            zip(self.factors, self.slices)):
+            method = getattr(factor, name)
+            parts = [self._part(array, block) for array in arrays]
+            part_kwargs = {
+                key: repeat(value, n_copies, axis=0)
+                if isinstance(value, ndarray) and value.ndim > 0 and
+                n_copies > 1 and value.shape[0] == n_rows else value
+                for key, value in kwargs.items()
+            }
+            if n_copies == 1 and "out" in signature(method).parameters:
+                method(*parts, out=out[:, cols], **part_kwargs)
+            else:
+                out[:, cols] = method(*parts, **part_kwargs).reshape(n_rows, -1)
+        return out
+
+    def _components(self, name, arrays):
+        '''
+        Call a method of every factor returning one column per row, such as
+        distance
+        :param name: name of the method
+        :param arrays: sequence of (m, D) np.arrays, the arguments
+        :return: (m, n_copies) np.array, one column per copy of a factor
+        '''
+        n_rows = arrays[0].shape[0]
+        components = empty((n_rows, len(self._copies)),
+                           dtype=result_type(*arrays))
+        column = 0
+        for block, (factor, n_copies) in enumerate(self.factors):
+            parts = [self._part(array, block) for array in arrays]
+            components[:, column:column + n_copies] = getattr(factor, name)(
+                                            *parts).reshape(n_rows, n_copies)
+            column += n_copies
+        return components
+
+    def factor_distances(self, u, v):
+        '''
+        Distances within each factor
+        :param u, v: (m, D) np.arrays, each representing m points
+        :return: (m, n_copies) np.array, one column per copy of a factor
+        '''
+        return self._components("distance", (u, v))
+
+    @validated(points=("u", "v"))
+    @sharded(n_cols=1)
+    def distance(self, u, v):
+        '''
+        Calculate the distance on the product, sqrt(sum of d_i^2), the
+        factor distances being combined in a single reduction
+        :param u, v: (m, D) np.arrays, each representing m points
+        :return: (m, 1) np.array, the distance between u and v
+        '''
+        return _root_sum_squares(self.factor_distances(u, v))
+
+    def pairwise_distance(self, X, Y=None, out=None, block_size=None):
+        '''
+        Calculate the distance between every row of X and every row of Y.
+        Product distances do not follow from a single Gram matrix, so the
+        matrix is always filled in blocks, see Manifold.pairwise_distance
+        '''
+        return super().pairwise_distance(X, Y, out=out,
+                                         block_size=block_size or 1024)
+
+    def iter_pairwise_distance(self, X, Y=None, block_size=1024):
+        '''
+        Stream the pairwise distance matrix in blocks, combining the blocks
+        of the factors, see Manifold.iter_pairwise_distance
+        '''
+        buffer = empty((block_size, block_size), dtype=X.dtype)
+        copy_blocks = zip(*(
+            factor.iter_pairwise_distance(
+                                            X[:, cols],
+                                            None if Y is None else Y[:, cols],
+                                            block_size
+            )
+            for factor, cols in self._copies
+        ))
+        for blocks in copy_blocks:
+            rows, cols, _ = blocks[0]
+            block = buffer[:rows.stop - rows.start, :cols.stop - cols.start]
+            block[...] = 0.
+            for _, _, copy_block in blocks:
+                block += copy_block**2
+            yield rows, cols, sqrt(block, out=block)
+
+    def inner_product(self, point, u, v):
+        '''
+        Sum of the inner products of tangent vectors in every factor, each
+        under the factor's own metric
+        :param point: (m, D) np.array, representing m points
+        :param u, v: (m, D) np.arrays, vectors in tangent spaces of point
+        :return: (m, 1) np.array
+        '''
+        return self._components("inner_product", (point, u, v)).sum(
+                                                        axis=1, keepdims=True)
+
+    def is_on_manifold(self, point):
+        '''
+        Points are on the product when they are on every factor
+        :param point: (m, D) np.array, representing m points
+        :return: (m, 1) np.array of booleans
+        '''
+        return self._components("is_on_manifold", (point,)).all(
+                                                    axis=1, keepdims=True)
+
+    def is_in_tangent_space(self, point, vector):
+        '''
+        Vectors are tangent to the product when tangent to every factor
+        :param point: (m, D) np.array, representing m points
+        :param vector: (m, D) np.array, representing m vectors
+        :return: (m, 1) np.array of booleans
+        '''
+        return self._components("is_in_tangent_space", (point, vector)).all(
+                                                    axis=1, keepdims=True)
+
+    def _manifold_residual(self, point):
+        '''
+        Largest residual of the factors, see Manifold._manifold_residual
+        :param point: (m, D) np.array, representing m points
+        :return: (m, 1) np.array, 0 for points on the product
+        '''
+        return self._components("_manifold_residual", (point,)).max(
+                                                    axis=1, keepdims=True)
+
+    def _tangent_residual(self, point, vector):
+        '''
+        Largest residual of the factors, see Manifold._tangent_residual
+        :param point: (m, D) np.array, representing m points
+        :param vector: (m, D) np.array, representing m vectors
+        :return: (m, 1) np.array, 0 for vectors tangent to the product
+        '''
+        return self._components("_tangent_residual",
+                                broadcast_arrays(point, vector)).max(
+                                                    axis=1, keepdims=True)
+
+    @sharded(skipped="vector")
+    def project_to_tangent_space(self, point, vector, out=None,
+                                 workspace=None):
+        '''
+        Project the columns of each factor into its tangent space
+        :param point: (m, D) np.array, representing m points
+        :param vector: (m, D) np.array, representing m ambient vectors
+        :param out: optional (m, D) np.array to write the result into
+        :param workspace: unused
+        :return: (m, D) np.array, the projected vectors
+        '''
+        return self._apply("project_to_tangent_space", (point, vector), out)
+
+    def riemannian_gradient(self, point, euclidean_gradient):
+        '''
+        Riemannian gradient of each factor, see Manifold.riemannian_gradient
+        '''
+        return self._apply("riemannian_gradient", (point, euclidean_gradient))
+
+    def project_to_manifold(self, point):
+        '''
+        Map the columns of each factor onto it
+        :param point: (m, D) np.array, representing m ambient points
+        :return: (m, D) np.array, m points on the product
+        '''
+        return self._apply("project_to_manifold", (point,))
+
+    def retraction(self, point, v_TpS, kind="projection"):
+        '''
+        Retraction of the given kind in every factor, see
+        Manifold.retraction
+        '''
+        return self._apply("retraction", (point, v_TpS), kind=kind)
+
+    @validated(points=("point",), vectors=(("v_TpS", "point"),))
+    @sharded(skipped="point")
+    def exponential_map(self, point, v_TpS, out=None, workspace=None):
+        '''
+        Follow geodesic in direction v_TpS from point, in every factor
+        :param point: (m, D) np.array, representing m points
+        :param v_TpS: (m, D) np.array, representing m tangent vectors
+        :param out: optional (m, D) np.array to write the result into.
+                    May be point itself.
+        :param workspace: unused
+        :return: (m, D) np.array, m points on the product
+        '''
+        return self._apply("exponential_map", (point, v_TpS), out)
+
+    @validated(points=("point0", "point1"))
+    @sharded()
+    def logarithmic_map(self, point0, point1, out=None):
+        '''
+        Inverse of exponential map, in every factor
+        :param point0: (m, D) np.array, representing m "base" points
+        :param point1: (m, D) np.array, representing m "target" points
+        :param out: optional (m, D) np.array to write the result into.
+                    Must not overlap point0 or point1.
+        :return: (m, D) np.array, m vectors in tangent spaces of point0
+        '''
+        return self._apply("logarithmic_map", (point0, point1), out)
+
+    @validated(points=("point0", "point1"))
+    def log_map_with_distance(self, point0, point1, out=None):
+        '''
+        Logarithmic map and distance, from the fused versions of the factors
+        :param point0: (m, D) np.array, representing m "base" points
+        :param point1: (m, D) np.array, representing m "target" points
+        :param out: optional (m, D) np.array to write the logarithmic map
+                    into. Must not overlap point0 or point1.
+        :return: ((m, D) np.array, m vectors in tangent spaces of point0,
+                 (m, 1) np.array, the distances between the points)
+        '''
+        n_rows = point0.shape[0]
+        if out is None:
+            out = empty(point0.shape, dtype=result_type(point0, point1))
+        components = empty((n_rows, len(self._copies)), dtype=out.dtype)
+        column = 0
+        for block, ((factor, n_copies), cols) in enumerate(
+                                            zip(self.factors, self.slices)):
+            v_Tp0M, dist = factor.log_map_with_distance(
+                            self._part(point0, block), self._part(point1, block))
+            out[:, cols] = v_Tp0M.reshape(n_rows, -1)
+            components[:, column:column + n_copies] = dist.reshape(
+                                                            n_rows, n_copies)
+            column += n_copies
+        return out, _root_sum_squares(components)
+
+    @validated(points=("point0", "point1"))
+    @sharded(skipped="point0")
+    def exp_log_roundtrip(self, point0, point1, t=1., out=None):
+        '''
+        exp(point0, t log(point0, point1)) in every factor, see
+        Manifold.exp_log_roundtrip
+        '''
+        return self._apply("exp_log_roundtrip", (point0, point1), out, t=t)
+
+    def _geodesic_interpolator(self, point0, point1):
+        '''
+        Interpolators of the factors, see Manifold.geodesic
+        '''
+        interpolators = [
+            factor._geodesic_interpolator(self._part(point0, block),
+                                          self._part(point1, block))
+            for block, (factor, _) in enumerate(self.factors)
+        ]
+
+        def interpolate(t, out):
+            n_rows, n_times = out.shape[:2]
+            for (factor, n_copies), cols, factor_interpolate in zip(
+                                self.factors, self.slices, interpolators):
+                width = factor.metric.n_dims
+                points = factor_interpolate(t, empty(
+                        (n_rows*n_copies, n_times, width), dtype=out.dtype))
+                # Copies of stacked factors are interleaved with the rows
+                out[:, :, cols] = points.reshape(
+                        n_rows, n_copies, n_times, width).transpose(
+                        0, 2, 1, 3).reshape(n_rows, n_times, n_copies*width)
+            return out
+        return interpolate
+
+    @validated(points=("point_0", "point_1"),
+               vectors=(("vec_Tp0M", "point_0"),))
+    @sharded(skipped="vec_Tp0M")
+    def parallel_transport(self, vec_Tp0M, point_0, point_1):
+        '''
+        Parallel transport in every factor
+        :param vec_Tp0M: (m, D) np.array, vector in Tp0M to transport
+        :param point_0: initial point where vec_Tp0M
+        :param point_1: final point to which vec_Tp0M will be transported
+        :return: (m, D) np.array, vec_Tp0M after parallel transport
+        '''
+        return self._apply("parallel_transport", (vec_Tp0M, point_0, point_1))
+
+    def transport_factors(self, point_0, point_1):
+        '''
+        Factors of the transport in every copy of every factor, side by
+        side, see apply_transport_factors. Raises NotImplementedError unless
+        every factor has them.
+        :param point_0: (m, D) np.array, representing m initial points
+        :param point_1: (m, D) np.array, representing m final points
+        :return: image, covector: (m, D) np.arrays
+        '''
+        n_rows = point_0.shape[0]
+        dtype = result_type(point_0, point_1)
+        image = empty((n_rows, self.offsets[-1]), dtype=dtype)
+        covector = empty((n_rows, self.offsets[-1]), dtype=dtype)
+        for block, (factor, cols) in enumerate(zip(self.factors, self.slices)):
+            factor_image, factor_covector = factor[0].transport_factors(
+                self._part(point_0, block), self._part(point_1, block))
+            image[:, cols] = factor_image.reshape(n_rows, -1)
+            covector[:, cols] = factor_covector.reshape(n_rows, -1)
+        return image, covector
+
+    def apply_transport_factors(self, image, covector, vec_Tp0M):
+        '''
+        Transport with one rank one update per copy of a factor: the
+        products of covector and vec_Tp0M are summed within each copy
+        :param image, covector: (m, D) np.arrays, see transport_factors
+        :param vec_Tp0M: (m, D) np.array of vectors in Tp0M
+        :return: vec_Tp0M after parallel transport
+        '''
+        starts = [cols.start for _, cols in self._copies]
+        widths = [factor.metric.n_dims for factor, _ in self._copies]
+        components = add.reduceat(covector*vec_Tp0M, starts, axis=-1)
+        return vec_Tp0M + image*repeat(components, widths, axis=-1)
+
+    def _initial_mean(self, points, weights, groups, n_groups):
+        '''
+        Starting point of the Frechet mean iteration of each factor. The
+        copies of a stacked factor are averaged as separate groups.
+        '''
+        initial = empty((n_groups, self.offsets[-1]), dtype=points.dtype)
+        for block, ((factor, n_copies), cols) in enumerate(
+                                            zip(self.factors, self.slices)):
+            copies = arange(n_copies)
+            initial[:, cols] = factor._initial_mean(
+                                self._part(points, block),
+                                repeat(weights, n_copies, axis=0),
+                                (groups[:, None]*n_copies + copies).reshape(-1),
+                                n_groups*n_copies
+            ).reshape(n_groups, -1)
+        return initial
+
+
+def _root_sum_squares(components):
+    '''
+    :param components: (m, k) np.array of distances or norms
+    :return: (m, 1) np.array, the square roots of the sums of their squares
+    '''
+    return sqrt(einsum("ai,ai->a", components, components))[:, None]
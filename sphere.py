@@ -1,7 +1,11 @@
 #import numpy as np
-from manifold import Manifold
+from backend import sharded
+import kernels
+from manifold import Manifold, _eps, _group_sum
 from metric import EuclideanMetric
-from numpy import arccos, cos, finfo, float, sin, sqrt, where
+from numpy import absolute, add, arccos, arctan2, clip, cos, multiply, sin, \
+    subtract, where
+from validation import validated
 
 class Sphere(Manifold):
     '''
@@ -9,6 +13,8 @@ class Sphere(Manifold):
         manifold is embedded in an (n+1)-dimensional ambient space.
         Assume radius of the sphere is 1.
     '''
+    curvature = 1.
+
     def __init__(self, n_dims):
         '''
 
@@ -17,15 +23,57 @@ class Sphere(Manifold):
         self.n_dims = n_dims
         self.metric = EuclideanMetric(n_dims+1)
 
+    def is_on_manifold(self, point):
+        '''
+        Determine whether point is on the unit sphere, point.point = 1
+        :param point: (m, n_dims+1) np.array, representing m points
+        :return: (m, 1) np.array of booleans
+        '''
+        return self._manifold_residual(point) <= 1e-8 + 16.*_eps(point)
+
+    def _manifold_residual(self, point):
+        '''
+        |point.point - 1|, for validation
+        :param point: (m, n_dims+1) np.array, representing m points
+        :return: (m, 1) np.array, 0 for points on the sphere
+        '''
+        return absolute(self.metric.dot(point, point) - 1.)
+
+    @validated(points=("u", "v"))
+    @sharded(n_cols=1)
     def distance(self, u, v):
         '''
-        Calculate the distance on the manifold between two points
+        Calculate the distance on the manifold between two points, as
+        d = 2 atan2(|u - v|, |u + v|). Unlike arccos(u.v), which loses half
+        the significant digits of d near 0 and pi, this is accurate to
+        rounding of the type of u and v at all distances, so float32 points
+        can be used.
         :param u, v:, (m, n_dims) np.arrays, each representing m vectors:
         :return: (m, 1) dimensional np.array, the distance between u and v
         '''
-        return arccos(self.metric.dot(u, v))
+        if kernels.applies(u, v):
+            return kernels.sphere_distance(u, v)
+        return 2.*arctan2(self.metric.norm(u - v), self.metric.norm(u + v))
 
-    def project_to_tangent_space(self, point, vector):
+    def _distance_from_gram(self, gram, X, Y):
+        '''
+        Convert, in place, a matrix of dot products between points into the
+        matrix of distances between them.
+        :param gram: (m, k) np.array, dot products between m and k points.
+                     Overwritten with the distances.
+        :param X, Y: (m, n_dims+1) and (k, n_dims+1) np.arrays, the points.
+                     Unused, as the dot products determine the distances.
+        :return: gram
+        '''
+        # Distances below about sqrt(eps) are not resolved by dot products:
+        # distance() is exact for them.
+        # Rounding can push dot products of (anti)parallel points beyond +-1
+        clip(gram, -1., 1., out=gram)
+        return arccos(gram, out=gram)
+
+    @sharded(skipped="vector")
+    def project_to_tangent_space(self, point, vector, out=None,
+                                 workspace=None):
         '''
         Project vector into tangent space of point.
         Since point is on hypersphere of radius 1, point.point = +1
@@ -33,12 +81,26 @@ class Sphere(Manifold):
                         hypersphere:
         :param vector: (m, n_dims) np.array, representing m vectors in ]
                         (n+1)-dimensional ambient space
+        :param out: optional (m, n_dims) np.array to write the result into.
+                    May be vector itself.
+        :param workspace: optional (m, n_dims) np.array used as scratch
+                          space, to avoid allocating a temporary
         :return: (m, n_dims) np.array, representing m vectors projected to
                 tangent spaces of point
         '''
-        return vector - self.metric.dot(point, vector)*point
+        return subtract(
+                            vector,
+                            multiply(
+                                        self.metric.dot(point, vector),
+                                        point,
+                                        out=workspace
+                            ),
+                            out=out
+        )
 
-    def exponential_map(self, point, v_TpS):
+    @validated(points=("point",), vectors=(("v_TpS", "point"),))
+    @sharded(skipped="point")
+    def exponential_map(self, point, v_TpS, out=None, workspace=None):
         '''
         Follow geodesic in direction v_TpS from point and
         return the resulting point.
@@ -47,41 +109,227 @@ class Sphere(Manifold):
                         hypersphere:
         :param v_TpS: (m, n_dims) np.array, representing m vectors projected to
                 tangent spaces of point:
+        :param out: optional (m, n_dims) np.array to write the result into.
+                    May be point itself.
+        :param workspace: optional (m, n_dims) np.array used as scratch
+                          space, to avoid allocating a temporary
         :return: (m, n_dims) np.array, m points on the hypersphere along the
                 geodesic chosen by v_TpS, from point
         '''
-        # todo: check whether vector is in tangent space
+        if kernels.applies(point, v_TpS):
+            return kernels.sphere_exponential_map(point, v_TpS, _eps(v_TpS),
+                                                  out=out)
 
         norm_v_TpS = self.metric.norm(v_TpS)
-        # If v_TpS has zero norm, return the original point.
-        # Correct behaviour and avoids division by zero in following calculation
-        return where(
-                        norm_v_TpS < finfo(float).eps,
-                        point,
-                        cos(norm_v_TpS) * point +
-                                            sin(norm_v_TpS) * (v_TpS/norm_v_TpS)
-                     )
+        # If v_TpS has zero norm, return the original point: the coefficients
+        # become (1, 0), which also avoids division by zero. Only the (m, 1)
+        # coefficients go through where, not the (m, n_dims) branches.
+        is_zero = norm_v_TpS < _eps(v_TpS)
+        coeff_point = where(is_zero, 1., cos(norm_v_TpS))
+        coeff_v = where(
+                            is_zero,
+                            0.,
+                            sin(norm_v_TpS)/where(is_zero, 1., norm_v_TpS)
+        )
+        step = multiply(coeff_v, v_TpS, out=workspace)
+        out = multiply(coeff_point, point, out=out)
+        return add(out, step, out=out)
+
+    @validated(points=("point0", "point1"))
+    @sharded()
+    def logarithmic_map(self, point0, point1, out=None):
+        '''
+        Inverse of exponential map, see log_map_with_distance
 
+        :param point0: (m, n_dims) np.array, representing m "base" points:
+        :param point1: (m, n_dims) np.array, representing m "target" points
+        :param out: optional (m, n_dims) np.array to write the result into.
+                    Must not overlap point0 or point1.
+        :return: (m, n_dims) np.array, m vectors in tangent spaces of point0,
+                that would yield point1 if inserted in exponential map
+        '''
+        return self.log_map_with_distance(point0, point1, out=out)[0]
 
-def logarithmic_map(self, point0, point1):
-    '''
-    Inverse of exponential map
+    @validated(points=("point0", "point1"))
+    def log_map_with_distance(self, point0, point1, out=None):
+        '''
+        Logarithmic map and distance, sharing the norms of the chord
+        point1 - point0 and of point1 + point0. The tangent vector is
+        v = (point1 - point0) + |point1 - point0|^2/2 point0, whose norm is
+        sin(d) = |point1 - point0||point1 + point0|/2, rescaled to norm
+        d = 2 atan2(|point1 - point0|, |point1 + point0|). This avoids the
+        cancellation of point1 - (point0.point1) point0 for nearby points.
+
+        :param point0: (m, n_dims) np.array, representing m "base" points:
+        :param point1: (m, n_dims) np.array, representing m "target" points
+        :param out: optional (m, n_dims) np.array to write the logarithmic
+                    map into. Must not overlap point0 or point1.
+        :return: ((m, n_dims) np.array, m vectors in tangent spaces of point0,
+                 (m, 1) np.array, the distances between the points)
+        '''
+        if kernels.applies(point0, point1):
+            return kernels.sphere_log_map_with_distance(point0, point1,
+                                                        _eps(point0), out=out)
+        v_Tp0M = subtract(point1, point0, out=out)
+        norm_diff = self.metric.norm(v_Tp0M)
+        norm_sum = self.metric.norm(point1 + point0)
+        v_Tp0M += (0.5*norm_diff**2)*point0
+        sin_dist = 0.5*norm_diff*norm_sum
+        dist = 2.*arctan2(norm_diff, norm_sum)
+
+        # Equal or antipodal points give a vanishing v_Tp0M: return it
+        # unscaled.
+        v_Tp0M_is_good = sin_dist > _eps(v_Tp0M)
+        safe_sin = where(v_Tp0M_is_good, sin_dist, 1.)
+        scale = where(v_Tp0M_is_good, dist/safe_sin, 1.)
+        return multiply(v_Tp0M, scale, out=v_Tp0M), dist
+
+    @validated(points=("point0", "point1"))
+    @sharded(skipped="point0")
+    def exp_log_roundtrip(self, point0, point1, t=1., out=None):
+        '''
+        exp(point0, t log(point0, point1)) in closed form, by spherical
+        linear interpolation:
+        (sin((1 - t) d) point0 + sin(t d) point1)/sin(d)
+
+        :param point0: (m, n_dims+1) np.array, representing m "base" points
+        :param point1: (m, n_dims+1) np.array, representing m "target" points
+        :param t: float or (m, 1) np.array of fractions of the geodesics
+        :param out: optional (m, n_dims+1) np.array to write the result into.
+                    May be point0 itself.
+        :return: (m, n_dims+1) np.array, m points on the sphere
+        '''
+        dist, sin_dist = self._arc(point0, point1)
+        coeff_0, coeff_1 = _slerp_coefficients(dist, sin_dist, t, _eps(point0))
+        step = coeff_1*point1
+        out = multiply(coeff_0, point0, out=out)
+        return add(out, step, out=out)
 
-    :param point0: (m, n_dims) np.array, representing m "base" points:
-    :param point1: (m, n_dims) np.array, representing m "target" points
-    :return: (m, n_dims) np.array, m vectors in tangent spaces of point0,
-            that would yield point1 if inserted in exponential map
+    def _arc(self, point0, point1):
+        '''
+        Length of the geodesics between point0 and point1, and its sine,
+        from the norms of point1 - point0 and point1 + point0
+        :return: ((m, 1) np.array, (m, 1) np.array), the distances and their
+                 sines
+        '''
+        norm_diff = self.metric.norm(point1 - point0)
+        norm_sum = self.metric.norm(point1 + point0)
+        return 2.*arctan2(norm_diff, norm_sum), 0.5*norm_diff*norm_sum
+
+    def _geodesic_interpolator(self, point0, point1):
+        '''
+        Spherical linear interpolation at any number of times, from the
+        lengths of the arcs computed once, see Manifold.geodesic
+        '''
+        dist, sin_dist = self._arc(point0, point1)
+        eps = _eps(point0)
+
+        def interpolate(t, out):
+            coeff_0, coeff_1 = _slerp_coefficients(
+                                    dist[..., None, :], sin_dist[..., None, :],
+                                    t[:, None], eps)
+            multiply(coeff_0, point0[..., None, :], out=out)
+            out += coeff_1*point1[..., None, :]
+            return out
+        return interpolate
+
+    def project_to_manifold(self, point):
+        '''
+        Map ambient points radially onto the sphere
+        :param point: (m, n_dims+1) np.array, representing m non-zero points
+        :return: (m, n_dims+1) np.array, m points on the sphere
+        '''
+        return point/self.metric.norm(point)
+
+    @validated(points=("point_0", "point_1"),
+               vectors=(("vec_Tp0M", "point_0"),))
+    @sharded(skipped="vec_Tp0M")
+    def parallel_transport(self, vec_Tp0M, point_0, point_1,
+                           method="closed_form", n_steps=10, tol=1e-8,
+                           max_steps=64):
+        '''
+        Parallel transport vector in tangent space of point 0 (Tp0M) to the
+        tangent space of point 1 (Tp1M), along the minimising geodesic.
+        :param vec_Tp0M: (m, n_dims+1) np.array, vector in Tp0M to transport
+        :param point_0: initial point where vec_Tp0M
+        :param point_1: final point to which vec_Tp0M will be transported
+        :param method: "closed_form" for the exact transport, or "pole_ladder"
+                       for the generic n_steps pole ladder of Manifold
+        :param n_steps: number of steps to break pole transport into, or
+                        "adaptive", only used by the pole ladder
+        :param tol, max_steps: options of the adaptive pole ladder, see
+                               Manifold.parallel_transport
+        :return: vec_Tp0M after parallel transport to point 1
+        '''
+        if method == "pole_ladder":
+            return super().parallel_transport(
+                                                vec_Tp0M,
+                                                point_0,
+                                                point_1,
+                                                n_steps=n_steps,
+                                                tol=tol,
+                                                max_steps=max_steps
+            )
+        elif method != "closed_form":
+            raise ValueError("Unknown transport method: {}".format(method))
+        if kernels.applies(vec_Tp0M, point_0, point_1):
+            return kernels.sphere_parallel_transport(vec_Tp0M, point_0, point_1,
+                                                     _eps(vec_Tp0M))
+
+        dirn, norm_dirn = self.log_map_with_distance(point_0, point_1)
+        unit_dirn = dirn/where(norm_dirn > _eps(dirn), norm_dirn, 1.)
+        # Only the component along the geodesic rotates, in the plane spanned
+        # by point_0 and the geodesic direction.
+        parallel_comp = self.metric.dot(vec_Tp0M, unit_dirn)
+        return vec_Tp0M + parallel_comp * (
+                -sin(norm_dirn) * point_0 + (cos(norm_dirn) - 1.) * unit_dirn)
+
+    def transport_factors(self, point_0, point_1):
+        '''
+        Closed form parallel transport as the rank one rotation of the
+        component along the geodesic, see parallel_transport and
+        Manifold.transport_factors
+        :param point_0: (m, n_dims+1) np.array, representing m initial points
+        :param point_1: (m, n_dims+1) np.array, representing m final points
+        :return: image, covector: (m, n_dims+1) np.arrays
+        '''
+        dirn, norm_dirn = self.log_map_with_distance(point_0, point_1)
+        unit_dirn = dirn/where(norm_dirn > _eps(dirn), norm_dirn, 1.)
+        image = -sin(norm_dirn)*point_0 + (cos(norm_dirn) - 1.)*unit_dirn
+        return image, unit_dirn
+
+    def _initial_mean(self, points, weights, groups, n_groups):
+        '''
+        Start the Frechet mean iteration from the extrinsic mean: the
+        weighted sum of the points, projected radially onto the sphere.
+        Groups whose points cancel out start from their first point instead.
+        '''
+        initial = _group_sum(weights*points, groups, n_groups)
+        norm = self.metric.norm(initial)
+        is_degenerate = (norm < _eps(initial))[:, 0]
+        initial /= where(is_degenerate[:, None], 1., norm)
+        if is_degenerate.any():
+            first_points = super()._initial_mean(points, weights, groups, n_groups)
+            initial[is_degenerate] = first_points[is_degenerate]
+        return initial
+
+
+def _slerp_coefficients(dist, sin_dist, t, eps):
+    '''
+    Coefficients of the end points in spherical linear interpolation,
+    (sin((1 - t) d) point0 + sin(t d) point1)/sin(d). Equal points
+    interpolate linearly, and antipodal points, whose geodesic is not
+    unique, stay at point0 as for logarithmic_map.
+    :param dist, sin_dist: np.arrays of the lengths of the arcs and their
+                           sines
+    :param t: np.array of times, broadcasting against dist
+    :param eps: machine epsilon of the points
+    :return: (coefficients of point0, coefficients of point1)
     '''
-    dot01 = self.metric.dot(point0, point1)
-    v_Tp0M = point1 - dot01 * point0
-    dist = self.distance(point0, point1)
-    norm_v_Tp0M = self.metric.norm(v_Tp0M)
-
-    # If v_Tp0M has zero norm, return the original point.
-    v_Tp0M_is_good = norm_v_Tp0M > finfo(float64).eps
-    # self.is_in_tangent_space(point0, v_Tp0M)
-    return where(
-        v_Tp0M_is_good,
-        v_Tp0M * (dist / norm_v_Tp0M),
-        v_Tp0M,
-    )
+    is_good = sin_dist > eps
+    safe_sin = where(is_good, sin_dist, 1.)
+    is_close = dist < 1.
+    coeff_0 = where(is_good, sin((1. - t)*dist)/safe_sin,
+                    where(is_close, 1. - t, 1.))
+    coeff_1 = where(is_good, sin(t*dist)/safe_sin, where(is_close, t, 0.))
+    return coeff_0, coeff_1
@@ -0,0 +1,256 @@
+'''
+    On-disk tables of points or tangent vectors, stored as .npy files and
+    accessed through np.memmap, and streaming of manifold operations from
+    input files to an output file block by block. Blocks of the inputs are
+    read ahead by a background thread while the previous block is being
+    transformed, and results are written straight into the memory-mapped
+    output, so memory use depends on the block size, not the table size:
+
+        points = ManifoldArray("points.npy")
+        tangents = points.apply(hyperboloid.logarithmic_map, "targets.npy",
+                                path="tangents.npy", block_size=65536)
+'''
+from batch import DEFAULT_CHUNK_SIZE, chunk_slices
+from inspect import signature
+from numpy import array, empty, float64, load, ndarray, result_type, save
+from numpy.lib.format import open_memmap
+from queue import Empty, Full, Queue
+import threading
+
+# Number of blocks read ahead of the one being transformed
+DEFAULT_PREFETCH = 2
+
+_DONE = object()
+
+
+class ManifoldArray:
+    '''
+        An (N, k) table of points or vectors in an .npy file, memory-mapped
+        rather than loaded
+    '''
+
+    def __init__(self, path, mode="r"):
+        '''
+
+        :param path: path of an .npy file
+        :param mode: np.memmap mode: "r" to read, "r+" to read and write
+        '''
+        self.path = path
+        self.data = load(path, mmap_mode=mode)
+
+    @classmethod
+    def create(cls, path, shape, dtype=float64):
+        '''
+        Create a new .npy file of uninitialised rows, opened for writing
+        :param path: path of the file, overwritten if it exists
+        :param shape: (N, k), the shape of the table
+        :param dtype: type of the table
+        :return: ManifoldArray opened with mode "r+"
+        '''
+        open_memmap(path, mode="w+", dtype=dtype, shape=shape).flush()
+        return cls(path, mode="r+")
+
+    @classmethod
+    def from_array(cls, path, points):
+        '''
+        Write an in-memory table to an .npy file and memory-map it
+        :param path: path of the file, overwritten if it exists
+        :param points: (N, k) np.array
+        :return: ManifoldArray opened with mode "r"
+        '''
+        save(path, points)
+        return cls(path)
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def flush(self):
+        '''
+        Write changes of a writable array back to its file
+        '''
+        self.data.flush()
+
+    def iter_blocks(self, block_size=DEFAULT_CHUNK_SIZE,
+                    prefetch=DEFAULT_PREFETCH):
+        '''
+        Read the table in consecutive blocks of rows
+        :param block_size: maximum number of rows per block
+        :param prefetch: number of blocks read ahead in a background thread,
+                         or 0 to read each block when it is requested
+        :return: generator of (rows, block), where rows is a slice of the
+                 table and block an in-memory copy of its rows
+        '''
+        for rows, (block,) in _read_blocks((self.data,), block_size, prefetch):
+            yield rows, block
+
+    def apply(self, func, *others, path, n_cols=None, dtype=None,
+              block_size=DEFAULT_CHUNK_SIZE, prefetch=DEFAULT_PREFETCH):
+        '''
+        Stream a row-wise operation over this table, see stream_apply
+        :param func: row-wise function, such as manifold.exponential_map
+        :param others: further row-aligned inputs of func: ManifoldArrays,
+                       paths of .npy files or np.arrays
+        :param path: path of the output .npy file
+        :return: ManifoldArray of the output
+        '''
+        return stream_apply(
+                            func,
+                            (self,) + others,
+                            path,
+                            n_cols=n_cols,
+                            dtype=dtype,
+                            block_size=block_size,
+                            prefetch=prefetch
+        )
+
+
+def _as_rows(source):
+    '''
+    :param source: ManifoldArray, path of an .npy file or np.array
+    :return: np.array or np.memmap of the rows of source
+    '''
+    if isinstance(source, ManifoldArray):
+        return source.data
+    if isinstance(source, ndarray):
+        return source
+    return load(source, mmap_mode="r")
+
+
+def _read_blocks(arrays, block_size, prefetch):
+    '''
+    Read row-aligned arrays in consecutive blocks of rows, optionally ahead
+    of time in a background thread. Errors of the reader are raised in the
+    consumer.
+    :param arrays: sequence of (N, ...) np.arrays or np.memmaps
+    :param block_size: maximum number of rows per block
+    :param prefetch: number of blocks read ahead, or 0 to read on demand
+    :return: generator of (rows, list of in-memory blocks)
+    '''
+    slices = chunk_slices(arrays[0].shape[0], block_size)
+    if prefetch < 1:
+        for rows in slices:
+            yield rows, [array(source[rows]) for source in arrays]
+        return
+
+    queue = Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def put(item):
+        # Give up once the consumer has stopped, rather than block forever
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def read():
+        try:
+            for rows in slices:
+                # Copying the rows makes the reads from disk happen here
+                if not put((rows, [array(source[rows]) for source in arrays])):
+                    return
+            put(_DONE)
+        except BaseException as error:
+            put(error)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    try:
+        while True:
+            try:
+                item = queue.get(timeout=0.1)
+            except Empty:
+                if not reader.is_alive() and queue.empty():
+                    raise RuntimeError("Block reader stopped unexpectedly")
+                continue
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        reader.join()
+
+
+def stream_apply(func, inputs, path, n_cols=None, dtype=None,
+                 block_size=DEFAULT_CHUNK_SIZE, prefetch=DEFAULT_PREFETCH):
+    '''
+    Apply a row-wise function to row-aligned tables block by block, writing
+    the result into a new memory-mapped .npy file. Functions taking an out
+    keyword write each block directly into the output file, and a scratch
+    workspace, if func takes one, is reused by every block.
+    :param func: function of one (b, ...) block per input, returning a
+                 (b, n_cols) np.array, such as manifold.logarithmic_map
+    :param inputs: sequence of ManifoldArrays, paths of .npy files or
+                   np.arrays, with the same number of rows
+    :param path: path of the output .npy file, overwritten if it exists
+    :param n_cols: number of columns of the result. Defaults to that of the
+                   first block computed, or, for functions taking out, to
+                   the number of columns of the first input. Blocks of any
+                   other width raise a ValueError.
+    :param dtype: type of the result. Defaults to the common type of the
+                  inputs.
+    :param block_size: maximum number of rows per block
+    :param prefetch: number of blocks of the inputs read ahead
+    :return: ManifoldArray of the output
+    '''
+    arrays = [_as_rows(source) for source in inputs]
+    n_rows = arrays[0].shape[0]
+    for source in arrays:
+        if source.shape[0] != n_rows:
+            raise ValueError(
+                "Inputs must have the same number of rows, got {} and {}".format(
+                    n_rows, source.shape[0]))
+    parameters = signature(func).parameters
+    takes_out = "out" in parameters
+    if n_cols is None and (takes_out or n_rows == 0):
+        n_cols = arrays[0].shape[1]
+    if dtype is None:
+        dtype = result_type(*(source.dtype for source in arrays))
+
+    workspace = None
+    if "workspace" in parameters:
+        workspace = empty(
+                    (min(block_size, n_rows), arrays[0].shape[1]), dtype=dtype)
+
+    output = None
+    if n_cols is not None:
+        output = open_memmap(path, mode="w+", dtype=dtype,
+                             shape=(n_rows, n_cols))
+    kwargs = {}
+    for rows, blocks in _read_blocks(arrays, block_size, prefetch):
+        if workspace is not None:
+            kwargs["workspace"] = workspace[:rows.stop - rows.start]
+        if takes_out:
+            func(*blocks, out=output[rows], **kwargs)
+            continue
+        result = func(*blocks, **kwargs)
+        if output is None:
+            output = open_memmap(path, mode="w+", dtype=dtype,
+                                 shape=(n_rows, result.shape[-1]))
+        # Narrower blocks, such as the (b, 1) distances, would broadcast
+        if result.shape != output[rows].shape:
+            raise ValueError(
+                "func returned a block of shape {}, expected {}".format(
+                    result.shape, output[rows].shape))
+        output[rows] = result
+    output.flush()
+    del output
+    return ManifoldArray(path)
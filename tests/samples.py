@@ -0,0 +1,14 @@
+'''
+    Random points on the manifolds, shared by the tests
+'''
+import numpy as np
+
+
+def random_sphere_points(m, n_dims, rng):
+    points = rng.standard_normal((m, n_dims+1))
+    return points/np.linalg.norm(points, axis=1, keepdims=True)
+
+def random_hyperboloid_points(m, n_dims, rng):
+    spatial = rng.standard_normal((m, n_dims))
+    time = np.sqrt(1. + np.sum(spatial**2, axis=1, keepdims=True))
+    return np.hstack([time, spatial])
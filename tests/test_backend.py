@@ -0,0 +1,187 @@
+from backend import ProcessBackend, ThreadBackend, sharded, use_backend
+from hyperboloid import Hyperboloid
+from samples import random_hyperboloid_points, random_sphere_points
+from sphere import Sphere
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+import pytest
+
+
+@pytest.mark.parametrize("manifold, sample", [
+    (Sphere(3), random_sphere_points),
+    (Hyperboloid(3), random_hyperboloid_points),
+])
+def test_thread_backend_matches_direct(manifold, sample):
+    rng = np.random.default_rng(0)
+    p0 = sample(103, 3, rng)
+    p1 = sample(103, 3, rng)
+    v = manifold.project_to_tangent_space(p0, rng.standard_normal(p0.shape))
+    expected = (
+        manifold.distance(p0, p1),
+        manifold.exponential_map(p0, v),
+        manifold.logarithmic_map(p0, p1),
+        manifold.parallel_transport(v, p0, p1),
+    )
+    backend = ThreadBackend(n_workers=3, min_rows=10)
+    try:
+        with use_backend(backend):
+            result = (
+                manifold.distance(p0, p1),
+                manifold.exponential_map(p0, v),
+                manifold.logarithmic_map(p0, p1),
+                manifold.parallel_transport(v, p0, p1),
+            )
+            out = np.empty_like(p0)
+            assert manifold.exponential_map(
+                        p0, v, out=out, workspace=np.empty_like(p0)) is out
+            assert_array_equal(out, expected[1])
+    finally:
+        backend.close()
+    for actual, wanted in zip(result, expected):
+        assert actual.shape == wanted.shape
+        assert_array_equal(actual, wanted)
+
+def test_instance_backend_and_nested_calls():
+    rng = np.random.default_rng(1)
+    sphere = Sphere(2)
+    p0 = random_sphere_points(40, 2, rng)
+    p1 = random_sphere_points(40, 2, rng)
+    v = sphere.project_to_tangent_space(p0, 0.1*rng.standard_normal(p0.shape))
+    expected = sphere.parallel_transport(v, p0, p1, method="pole_ladder")
+    # The pole ladder calls sharded methods from within each shard
+    sphere.backend = ThreadBackend(n_workers=2, min_rows=5)
+    try:
+        assert_array_equal(
+            sphere.parallel_transport(v, p0, p1, method="pole_ladder"),
+            expected
+        )
+    finally:
+        sphere.backend.close()
+    # Small batches are not split
+    assert sphere.backend.n_shards(9) == 1
+
+def test_float32_output():
+    rng = np.random.default_rng(2)
+    hyperb = Hyperboloid(2)
+    p0 = random_hyperboloid_points(50, 2, rng).astype(np.float32)
+    p1 = random_hyperboloid_points(50, 2, rng).astype(np.float32)
+    backend = ThreadBackend(n_workers=2, min_rows=10)
+    try:
+        with use_backend(backend):
+            assert hyperb.distance(p0, p1).dtype == np.float32
+    finally:
+        backend.close()
+
+def test_process_backend_matches_direct():
+    rng = np.random.default_rng(3)
+    hyperb = Hyperboloid(3)
+    p0 = random_hyperboloid_points(60, 3, rng)
+    p1 = random_hyperboloid_points(60, 3, rng)
+    v = hyperb.project_to_tangent_space(p0, rng.standard_normal(p0.shape))
+    backend = ProcessBackend(n_workers=2, min_rows=20)
+    try:
+        hyperb.backend = backend
+        assert_array_almost_equal(
+            hyperb.exponential_map(p0, v, workspace=np.empty_like(p0)),
+            Hyperboloid(3).exponential_map(p0, v)
+        )
+        assert_array_almost_equal(hyperb.distance(p0, p1),
+                                  Hyperboloid(3).distance(p0, p1))
+    finally:
+        backend.close()
+
+def test_broadcast_batches_are_sharded_on_first_axis():
+    rng = np.random.default_rng(4)
+    sphere = Sphere(2)
+    queries = random_sphere_points(20, 2, rng)[:, None, :]
+    candidates = random_sphere_points(30, 2, rng)
+    expected = (sphere.distance(queries, candidates),
+                sphere.logarithmic_map(queries, candidates))
+    backend = ThreadBackend(n_workers=3, min_rows=5)
+    try:
+        with use_backend(backend):
+            result = (sphere.distance(queries, candidates),
+                      sphere.logarithmic_map(queries, candidates))
+    finally:
+        backend.close()
+    for actual, wanted in zip(result, expected):
+        assert actual.shape == wanted.shape
+        assert_array_equal(actual, wanted)
+
+def test_masked_rows():
+    rng = np.random.default_rng(5)
+
+    class CountingSphere(Sphere):
+        n_rows = 0
+        def log_map_with_distance(self, point0, point1, out=None):
+            CountingSphere.n_rows += point0.shape[0]
+            return super().log_map_with_distance(point0, point1, out=out)
+
+    sphere = CountingSphere(2)
+    table = random_sphere_points(100, 2, rng)
+    targets = random_sphere_points(100, 2, rng)
+    is_updated = np.zeros(100, dtype=bool)
+    is_updated[[3, 50, 97]] = True
+
+    log = sphere.logarithmic_map(table, targets, where=is_updated)
+    assert CountingSphere.n_rows == 3
+    assert_array_equal(log[~is_updated], 0.)
+    assert_array_almost_equal(log[is_updated],
+                              sphere.logarithmic_map(table[is_updated],
+                                                     targets[is_updated]))
+    # (m, 1) masks, as from comparisons of (m, 1) norms, also select rows
+    assert_array_equal(sphere.distance(table, targets, where=is_updated[:, None]),
+                       np.where(is_updated[:, None],
+                                sphere.distance(table, targets), 0.))
+    expected = sphere.exponential_map(table, 0.5*log)
+    assert_array_equal(sphere.exponential_map(table, 0.5*log, where=is_updated),
+                       np.where(is_updated[:, None], expected, table))
+
+    # Rows of out outside the mask are left as they are, and rows selected
+    # from a broadcast batch are computed on their own
+    out = table.copy()
+    sphere.exponential_map(out, 0.5*log, out=out, where=is_updated)
+    assert_array_equal(out, np.where(is_updated[:, None], expected, table))
+    query = table[:1]
+    with use_backend(ThreadBackend(n_workers=2, min_rows=1)) as backend:
+        masked = sphere.exp_log_roundtrip(query, targets, 0.5,
+                                          where=is_updated)
+        assert_array_equal(sphere.exp_log_roundtrip(query, targets, 0.5,
+                                                    where=np.zeros(100, bool)),
+                           np.tile(query, (100, 1)))
+    backend.close()
+    assert_array_almost_equal(masked[is_updated],
+                              sphere.exp_log_roundtrip(query, targets[is_updated],
+                                                       0.5))
+    assert_array_equal(masked[~is_updated], np.tile(query, (97, 1)))
+
+def test_keyword_arrays_are_split_and_masked():
+    rng = np.random.default_rng(6)
+    hyperb = Hyperboloid(2)
+    p0 = random_hyperboloid_points(100, 2, rng)
+    p1 = random_hyperboloid_points(100, 2, rng)
+    v = hyperb.logarithmic_map(p0, p1)
+    is_updated = rng.random(100) < 0.2
+    expected = hyperb.exponential_map(p0, 0.5*v)
+
+    masked = hyperb.exponential_map(point=p0, v_TpS=0.5*v, where=is_updated)
+    assert_array_equal(masked, np.where(is_updated[:, None], expected, p0))
+    assert_array_equal(
+        hyperb.parallel_transport(v, point_0=p0, point_1=p1, where=is_updated),
+        np.where(is_updated[:, None], hyperb.parallel_transport(v, p0, p1), v))
+
+    class RecordingHyperboloid(Hyperboloid):
+        shard_rows = []
+        @sharded(n_cols=1)
+        def distance(self, u, v):
+            RecordingHyperboloid.shard_rows.append(u.shape[0])
+            return super().distance(u, v)
+    recording = RecordingHyperboloid(2)
+    with use_backend(ThreadBackend(n_workers=4, min_rows=10)) as backend:
+        out = np.empty_like(p0)
+        hyperb.exponential_map(point=p0, v_TpS=0.5*v, out=out)
+        distance = recording.distance(u=p0, v=p1)
+    backend.close()
+    assert_array_equal(out, expected)
+    assert_array_equal(distance, hyperb.distance(p0, p1))
+    assert sorted(RecordingHyperboloid.shard_rows) == [25, 25, 25, 25]
@@ -0,0 +1,66 @@
+from batch import BatchExecutor, apply_in_chunks, chunk_slices
+from hyperboloid import Hyperboloid
+from samples import random_hyperboloid_points, random_sphere_points
+from sphere import Sphere
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+import pytest
+
+
+def test_chunk_slices():
+    assert list(chunk_slices(5, 2)) == [slice(0, 2), slice(2, 4), slice(4, 5)]
+    assert list(chunk_slices(0, 2)) == []
+    with pytest.raises(ValueError):
+        list(chunk_slices(5, 0))
+
+def test_apply_in_chunks():
+    a = np.arange(10.).reshape(5, 2)
+    out = np.empty((5, 1))
+    apply_in_chunks(lambda x: x.sum(axis=1, keepdims=True), (a,), out, 2)
+    assert_array_equal(out, a.sum(axis=1, keepdims=True))
+    with pytest.raises(ValueError):
+        apply_in_chunks(lambda x, y: x, (a, a[:3]), out, 2)
+
+@pytest.mark.parametrize("manifold, sample", [
+    (Sphere(3), random_sphere_points),
+    (Hyperboloid(3), random_hyperboloid_points),
+])
+def test_batch_executor_matches_manifold(manifold, sample):
+    rng = np.random.default_rng(1)
+    p0 = sample(11, 3, rng)
+    p1 = sample(11, 3, rng)
+    v = manifold.project_to_tangent_space(p0, rng.standard_normal(p0.shape))
+    executor = BatchExecutor(manifold, chunk_size=4)
+
+    assert_array_almost_equal(
+                                executor.distance(p0, p1),
+                                manifold.distance(p0, p1)
+    )
+    assert_array_almost_equal(
+                                executor.exponential_map(p0, 0.1*v),
+                                manifold.exponential_map(p0, 0.1*v)
+    )
+    assert_array_almost_equal(
+                                executor.logarithmic_map(p0, p1),
+                                manifold.logarithmic_map(p0, p1)
+    )
+    assert_array_almost_equal(
+                                executor.project_to_tangent_space(p0, p1),
+                                manifold.project_to_tangent_space(p0, p1)
+    )
+    assert_array_almost_equal(
+                                executor.parallel_transport(v, p0, p1),
+                                manifold.parallel_transport(v, p0, p1)
+    )
+
+def test_batch_executor_writes_into_out():
+    rng = np.random.default_rng(2)
+    circle = Sphere(2)
+    p0 = random_sphere_points(7, 2, rng)
+    p1 = random_sphere_points(7, 2, rng)
+    out = np.empty((7, 1))
+    result = BatchExecutor(circle, chunk_size=3).distance(p0, p1, out=out)
+    assert result is out
+    assert_array_almost_equal(out, circle.distance(p0, p1))
+    with pytest.raises(ValueError):
+        BatchExecutor(circle).distance(p0, p1, out=np.empty((7, 3)))
@@ -0,0 +1,62 @@
+from cluster import ManifoldKMeans
+from hyperboloid import Hyperboloid
+from sphere import Sphere
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+import pytest
+
+
+def clustered_hyperboloid_points(rng, n_per_cluster=50):
+    centres = np.array([[-3., 0.], [3., 0.], [0., 3.]])
+    spatial = np.vstack([
+        centre + 0.1*rng.standard_normal((n_per_cluster, 2)) for centre in centres
+    ])
+    time = np.sqrt(1. + np.sum(spatial**2, axis=1, keepdims=True))
+    labels = np.repeat(np.arange(3), n_per_cluster)
+    return np.hstack([time, spatial]), labels
+
+def same_partition(labels, expected):
+    # Labels agree up to a permutation of cluster ids
+    pairs = set(zip(labels, expected))
+    return len(pairs) == len(set(labels)) == len(set(expected))
+
+def test_fit_recovers_clusters():
+    rng = np.random.default_rng(0)
+    points, expected = clustered_hyperboloid_points(rng)
+    hyperb = Hyperboloid(2)
+    kmeans = ManifoldKMeans(hyperb, 3, block_size=32).fit(points)
+    assert same_partition(kmeans.labels_, expected)
+    assert_array_equal(kmeans.predict(points), kmeans.labels_)
+    assert_array_equal(np.sort(kmeans.counts), [50, 50, 50])
+    assert_array_equal(
+                        hyperb.is_on_manifold(kmeans.centers),
+                        np.ones((3, 1), dtype=bool)
+    )
+
+def test_fit_on_sphere():
+    rng = np.random.default_rng(1)
+    angles = np.concatenate([
+        0.1*rng.standard_normal(30), 2. + 0.1*rng.standard_normal(30)])
+    points = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    kmeans = ManifoldKMeans(Sphere(1), 2).fit(points)
+    centre_angles = np.sort(np.arctan2(kmeans.centers[:, 1], kmeans.centers[:, 0]))
+    assert_array_almost_equal(
+                                centre_angles,
+                                [angles[:30].mean(), angles[30:].mean()],
+                                decimal=6
+    )
+
+def test_fit_minibatch_from_file(tmp_path):
+    rng = np.random.default_rng(2)
+    points, expected = clustered_hyperboloid_points(rng, n_per_cluster=200)
+    order = rng.permutation(points.shape[0])
+    np.save(tmp_path / "points.npy", points[order])
+
+    kmeans = ManifoldKMeans(Hyperboloid(2), 3)
+    kmeans.fit_minibatch(tmp_path / "points.npy", batch_size=100, n_epochs=2)
+    assert kmeans.counts.sum() == 2*points.shape[0]
+    assert same_partition(kmeans.predict(points), expected)
+
+def test_too_few_points():
+    with pytest.raises(ValueError):
+        ManifoldKMeans(Sphere(1), 3).fit(np.array([[1., 0.], [0., 1.]]))
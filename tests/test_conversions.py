@@ -0,0 +1,46 @@
+from conversions import hyperboloid_to_klein, hyperboloid_to_poincare, \
+    klein_to_hyperboloid, klein_to_poincare, poincare_to_hyperboloid, \
+    poincare_to_klein
+from hyperboloid import Hyperboloid
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+import pytest
+
+
+def random_points(m, n_dims, seed=0):
+    rng = np.random.default_rng(seed)
+    spatial = rng.standard_normal((m, n_dims))
+    time = np.sqrt(1. + np.sum(spatial**2, axis=1, keepdims=True))
+    return np.hstack([time, spatial])
+
+
+def test_round_trips():
+    points = random_points(50, 3)
+    poincare = hyperboloid_to_poincare(points)
+    klein = hyperboloid_to_klein(points)
+    assert (np.sum(poincare**2, axis=1) < 1.).all()
+    assert (np.sum(klein**2, axis=1) < 1.).all()
+    assert_array_almost_equal(poincare_to_hyperboloid(poincare), points)
+    assert_array_almost_equal(klein_to_hyperboloid(klein), points)
+    assert_array_almost_equal(poincare_to_klein(poincare), klein)
+    assert_array_almost_equal(klein_to_poincare(klein), poincare)
+    assert Hyperboloid(3).is_on_manifold(poincare_to_hyperboloid(poincare)).all()
+
+
+def test_out_buffers():
+    points = random_points(20, 4)
+    ball = np.empty((20, 4))
+    result = hyperboloid_to_poincare(points, out=ball)
+    assert result is ball
+    hyperboloid = np.empty((20, 5))
+    assert poincare_to_hyperboloid(ball, out=hyperboloid) is hyperboloid
+    assert_array_almost_equal(hyperboloid, points)
+    # Conversions between the balls may be done in place
+    expected = poincare_to_klein(ball)
+    assert poincare_to_klein(ball, out=ball) is ball
+    assert_array_equal(ball, expected)
+
+
+def test_out_shape_mismatch():
+    with pytest.raises(ValueError):
+        hyperboloid_to_klein(random_points(5, 2), out=np.empty((5, 3)))
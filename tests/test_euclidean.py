@@ -0,0 +1,23 @@
+from euclidean import Euclidean
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+
+
+def test_maps_and_distances():
+    rng = np.random.default_rng(0)
+    space = Euclidean(3)
+    u, v = rng.standard_normal((2, 10, 3))
+    assert_array_almost_equal(space.distance(u, v),
+                              np.linalg.norm(u - v, axis=1, keepdims=True))
+    assert_array_almost_equal(space.pairwise_distance(u, v),
+                              np.linalg.norm(u[:, None] - v[None], axis=2))
+    assert_array_equal(np.diag(space.pairwise_distance(u)), 0.)
+    log, dist = space.log_map_with_distance(u, v)
+    assert_array_almost_equal(space.exponential_map(u, log), v)
+    assert_array_almost_equal(dist, space.distance(u, v))
+    assert_array_almost_equal(space.exp_log_roundtrip(u, v, 0.25),
+                              0.75*u + 0.25*v)
+    assert_array_almost_equal(space.geodesic(u, v, [0., 0.5])[:, 1],
+                              0.5*(u + v))
+    assert_array_equal(space.parallel_transport(log, u, v), log)
+    assert space.is_on_manifold(u).all()
@@ -1,6 +1,9 @@
 from hyperboloid import Hyperboloid
+from manifold import Manifold
 import numpy as np
 from numpy.testing import assert_array_almost_equal, assert_array_equal
+from transport import TransportPlan
+import warnings
 
 
 def test_is_on_manifold():
@@ -207,3 +210,258 @@ def test_parallel_transport():
     print(v_Tp0M_ptd)
     assert_array_almost_equal(v_Tp0M, v_Tp0M_ptd)
 
+def test_pairwise_distance():
+    rapidities_x = np.array([0., 0.5, -2., 3.])
+    rapidities_y = np.array([0.25, 1.5, -1.])
+    X = np.stack([np.cosh(rapidities_x), np.sinh(rapidities_x)], axis=1)
+    Y = np.stack([np.cosh(rapidities_y), np.sinh(rapidities_y)], axis=1)
+
+    hyperb = Hyperboloid(1)
+    expected = np.abs(rapidities_x[:, None] - rapidities_y[None, :])
+    assert_array_almost_equal(hyperb.pairwise_distance(X, Y), expected)
+    assert_array_almost_equal(
+                                hyperb.pairwise_distance(X, Y, block_size=2),
+                                expected
+    )
+
+    expected = np.abs(rapidities_x[:, None] - rapidities_x[None, :])
+    assert_array_almost_equal(hyperb.pairwise_distance(X), expected)
+    blocks = list(hyperb.iter_pairwise_distance(X, block_size=3))
+    assert len(blocks) == 4
+    rows, cols, block = blocks[-1]
+    assert_array_almost_equal(block, expected[rows, cols])
+
+def test_out_and_in_place_variants_match():
+    rng = np.random.default_rng(0)
+    spatial = rng.standard_normal((6, 2))
+    p = np.hstack([np.sqrt(1. + np.sum(spatial**2, axis=1, keepdims=True)), spatial])
+    hyperb = Hyperboloid(2)
+    v = hyperb.project_to_tangent_space(p, rng.standard_normal((6, 3)))
+    v[0] = 0.
+
+    expected = hyperb.exponential_map(p, v)
+    out = np.empty_like(p)
+    assert hyperb.exponential_map(p, v, out=out, workspace=np.empty_like(p)) is out
+    assert_array_equal(out, expected)
+    p_copy = p.copy()
+    hyperb.exponential_map_(p_copy, v)
+    assert_array_equal(p_copy, expected)
+    assert_array_equal(expected[0], p[0])
+
+    ambient = rng.standard_normal((6, 3))
+    expected = hyperb.project_to_tangent_space(p, ambient)
+    assert_array_equal(
+                        hyperb.project_to_tangent_space(
+                                            p, ambient, out=np.empty_like(p)),
+                        expected
+    )
+    hyperb.project_to_tangent_space_(p, ambient, workspace=np.empty_like(p))
+    assert_array_equal(ambient, expected)
+
+    p1 = hyperb.exponential_map(p, v)
+    expected = hyperb.logarithmic_map(p, p1)
+    out = np.empty_like(p)
+    hyperb.logarithmic_map(p, p1, out=out)
+    assert_array_equal(out, expected)
+
+def test_frechet_mean():
+    # The 1-dimensional hyperboloid is isometric to the real line, so the
+    # mean of points is the point at the mean rapidity
+    rapidities = np.array([-1., 0.5, 2., 3., 3.5, -0.5, 1.])
+    groups = np.array([0, 0, 0, 1, 1, 2, 2])
+    weights = np.array([1., 1., 2., 1., 3., 1., 1.])
+    points = np.stack([np.cosh(rapidities), np.sinh(rapidities)], axis=1)
+
+    hyperb = Hyperboloid(1)
+    mean_rapidities = np.array([
+        np.average(rapidities[:3], weights=weights[:3]),
+        np.average(rapidities[3:5], weights=weights[3:5]),
+        np.mean(rapidities[5:]),
+    ])
+    expected = np.stack(
+                    [np.cosh(mean_rapidities), np.sinh(mean_rapidities)], axis=1)
+    assert_array_almost_equal(
+                            hyperb.frechet_mean(points, weights, groups),
+                            expected
+    )
+
+    # The Lorentzian centroid is exact for symmetric configurations, and on
+    # the manifold otherwise
+    centroid = hyperb.frechet_mean(points, weights, groups, method="centroid")
+    assert_array_almost_equal(centroid[2], expected[2])
+    assert_array_equal(hyperb.is_on_manifold(centroid), np.ones((3, 1), dtype=bool))
+
+    # Groups without points, or without weight, have nan means, without
+    # warnings from the other groups
+    weights[5:] = 0.
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        for method, nonempty in (("centroid", centroid), ("karcher", expected)):
+            mean = hyperb.frechet_mean(points, weights, groups, n_groups=4,
+                                       method=method)
+            assert np.isnan(mean[2:]).all()
+            assert_array_almost_equal(mean[:2], nonempty[:2])
+
+def test_retraction():
+    p = np.array([
+        [np.cosh(0.), np.sinh(0.)],
+        [np.cosh(1.), np.sinh(1.)],
+    ])
+    v = np.array([
+        [0., 1e-3],
+        [np.sinh(1.)*1e-3, np.cosh(1.)*1e-3],
+    ])
+    hyperb = Hyperboloid(1)
+    retracted = hyperb.retraction(p, v)
+    assert_array_equal(hyperb.is_on_manifold(retracted), np.ones((2, 1), dtype=bool))
+    # First order retraction agrees with the exponential map to second order
+    assert_array_almost_equal(retracted, hyperb.exponential_map(p, v), decimal=6)
+
+def test_riemannian_gradient():
+    # f(x) = -x.t has Euclidean gradient -eta t, and its Riemannian gradient
+    # points away from t, along the negative log map
+    p = np.array([[np.cosh(0.5), np.sinh(0.5)]])
+    t = np.array([[np.cosh(1.5), np.sinh(1.5)]])
+    hyperb = Hyperboloid(1)
+    rgrad = hyperb.riemannian_gradient(p, -t*hyperb.metric.signature)
+    assert_array_almost_equal(hyperb.metric.dot(p, rgrad), [[0.]])
+    log = hyperb.logarithmic_map(p, t)
+    assert_array_almost_equal(
+                        rgrad/hyperb.metric.norm(rgrad),
+                        -log/hyperb.metric.norm(log)
+    )
+
+def test_retraction_error_orders():
+    rng = np.random.default_rng(4)
+    spatial = rng.standard_normal((20, 3))
+    p = np.hstack([np.sqrt(1. + np.sum(spatial**2, axis=1, keepdims=True)), spatial])
+    hyperb = Hyperboloid(3)
+    direction = hyperb.project_to_tangent_space(p, rng.standard_normal((20, 4)))
+    direction /= hyperb.metric.norm(direction)
+
+    def max_error(kind, step_size):
+        v = step_size*direction
+        error = hyperb.retraction(p, v, kind) - hyperb.exponential_map(p, v)
+        return np.abs(error).max()
+
+    # Halving the step divides the error by 2^(order+1)
+    assert_array_equal(max_error("exp", 0.1), 0.)
+    assert 3.5 < max_error("projection", 0.02)/max_error("projection", 0.01) < 4.5
+    assert 7. < max_error("second_order", 0.02)/max_error("second_order", 0.01) < 9.
+    assert_array_equal(
+        hyperb.is_on_manifold(hyperb.retraction(p, direction, "second_order")),
+        np.ones((20, 1), dtype=bool)
+    )
+
+
+def test_float32_precision():
+    rng = np.random.default_rng(6)
+    spatial = rng.standard_normal((50, 3))
+    p0 = np.hstack([np.sqrt(1. + np.sum(spatial**2, axis=1, keepdims=True)),
+                    spatial])
+    hyperb = Hyperboloid(3)
+    # Distances from 1e-6 to 5, where arccosh(-u.v) is inaccurate
+    v = hyperb.project_to_tangent_space(p0, rng.standard_normal((50, 4)))
+    v *= np.logspace(-6, np.log10(5.), 50)[:, None]/hyperb._tangent_norm(v)
+    p1 = hyperb.exponential_map(p0, v)
+    expected = hyperb.distance(p0, p1)
+    assert_array_almost_equal(expected, hyperb._tangent_norm(v), decimal=12)
+
+    p0_32, p1_32 = p0.astype(np.float32), p1.astype(np.float32)
+    assert hyperb.is_on_manifold(p0_32).all()
+    distance = hyperb.distance(p0_32, p1_32)
+    assert distance.dtype == np.float32
+    # Rounding the points to float32 moves them by eps*|x^0|
+    np.testing.assert_allclose(distance, expected, rtol=1e-4, atol=1e-6)
+
+    log = hyperb.logarithmic_map(p0_32, p1_32)
+    assert log.dtype == np.float32
+    np.testing.assert_allclose(log, v, rtol=1e-3, atol=1e-5)
+    exp = hyperb.exponential_map(p0_32, v.astype(np.float32))
+    assert exp.dtype == np.float32
+    np.testing.assert_allclose(exp, p1, rtol=1e-5, atol=1e-5)
+
+def test_fused_log_map_and_roundtrip():
+    rng = np.random.default_rng(7)
+    hyperb = Hyperboloid(3)
+    spatial = rng.standard_normal((2, 20, 3))
+    p0, p1 = np.concatenate(
+        [np.sqrt(1. + np.sum(spatial**2, axis=2, keepdims=True)), spatial],
+        axis=2
+    )
+    p1[0] = p0[0]
+
+    log, dist = hyperb.log_map_with_distance(p0, p1)
+    assert_array_almost_equal(log, hyperb.logarithmic_map(p0, p1))
+    assert_array_almost_equal(dist, hyperb.distance(p0, p1))
+    assert_array_almost_equal(hyperb._tangent_norm(log), dist)
+
+    t = rng.uniform(-1., 2., (20, 1))
+    for fraction in (0.5, -1., t):
+        assert_array_almost_equal(
+                    hyperb.exp_log_roundtrip(p0, p1, fraction),
+                    hyperb.exponential_map(p0, fraction*log)
+        )
+    assert_array_almost_equal(hyperb.exp_log_roundtrip(p0, p1), p1)
+
+def test_geodesic():
+    rng = np.random.default_rng(8)
+    hyperb = Hyperboloid(3)
+    spatial = rng.standard_normal((2, 20, 3))
+    p0, p1 = np.concatenate(
+        [np.sqrt(1. + np.sum(spatial**2, axis=2, keepdims=True)), spatial],
+        axis=2
+    )
+    p1[0] = p0[0]
+    t = np.linspace(-0.5, 1.5, 9)
+
+    path = hyperb.geodesic(p0, p1, t)
+    assert path.shape == (20, 9, 4)
+    for k, time in enumerate(t):
+        assert_array_almost_equal(path[:, k],
+                                  hyperb.exp_log_roundtrip(p0, p1, time))
+    blocks = [block.copy() for _, block in hyperb.iter_geodesic(p0, p1, t, 4)]
+    assert_array_equal(np.concatenate(blocks, axis=1), path)
+
+def test_broadcasting():
+    rng = np.random.default_rng(10)
+    hyperb = Hyperboloid(3)
+    spatial = rng.standard_normal((31, 3))
+    points = np.hstack([np.sqrt(1. + np.sum(spatial**2, axis=1, keepdims=True)),
+                        spatial])
+    query, candidates = points[:1], points[1:]
+    tiled = np.tile(query, (30, 1))
+
+    assert_array_almost_equal(hyperb.distance(query, candidates),
+                              hyperb.distance(tiled, candidates))
+    log = hyperb.logarithmic_map(query, candidates)
+    assert_array_almost_equal(log, hyperb.logarithmic_map(tiled, candidates))
+    assert_array_almost_equal(hyperb.exponential_map(query, log), candidates)
+    assert_array_almost_equal(hyperb.parallel_transport(log, query, candidates),
+                              hyperb.parallel_transport(log, tiled, candidates))
+
+    queries = candidates[:5, None, :]
+    assert_array_almost_equal(hyperb.distance(queries, candidates)[..., 0],
+                              hyperb.pairwise_distance(candidates[:5], candidates))
+    assert hyperb.is_on_manifold(queries).shape == (5, 1, 1)
+    assert_array_almost_equal(hyperb.project_to_manifold(queries), queries)
+
+def test_pole_ladder_matches_closed_form_for_long_vectors():
+    # The ladder needs logarithmic maps that stay tangent for distant points
+    rng = np.random.default_rng(12)
+    hyperb = Hyperboloid(3)
+    spatial = rng.standard_normal((40, 3))
+    points = np.hstack([np.sqrt(1. + np.sum(spatial**2, axis=1, keepdims=True)),
+                        spatial])
+    p0, p1 = points[:20], points[20:]
+    v = hyperb.project_to_tangent_space(p0, rng.standard_normal((20, 4)))
+    v /= hyperb._tangent_norm(v)
+    for norm in (1., 2., 4.):
+        expected = hyperb.parallel_transport(norm*v, p0, p1)
+        for n_steps in (1, 2, 5, 10):
+            assert_array_almost_equal(
+                Manifold.parallel_transport(hyperb, norm*v, p0, p1,
+                                            n_steps=n_steps),
+                expected, decimal=9)
+        plan = TransportPlan(hyperb, p0, p1, method="pole_ladder")
+        assert_array_almost_equal(plan.transport(norm*v), expected, decimal=9)
@@ -0,0 +1,71 @@
+from hyperboloid import Hyperboloid
+from index import VantagePointTree
+from samples import random_hyperboloid_points, random_sphere_points
+from sphere import Sphere
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+import pytest
+
+
+@pytest.mark.parametrize("manifold, sample", [
+    (Sphere(2), random_sphere_points),
+    (Hyperboloid(2), random_hyperboloid_points),
+])
+def test_query_matches_brute_force(manifold, sample):
+    rng = np.random.default_rng(0)
+    points = sample(300, 2, rng)
+    queries = sample(10, 2, rng)
+    tree = VantagePointTree(manifold, points, leaf_size=8)
+    all_distances = manifold.pairwise_distance(queries, points)
+
+    distances, indices = tree.query(queries, k=5)
+    assert_array_equal(indices, np.argsort(all_distances, axis=1)[:, :5])
+    assert_array_almost_equal(distances, np.sort(all_distances, axis=1)[:, :5])
+
+    radius = np.median(all_distances)/4
+    radius_distances, radius_indices = tree.query_radius(queries, radius)
+    for row in range(queries.shape[0]):
+        expected = np.flatnonzero(all_distances[row] <= radius)
+        assert_array_equal(np.sort(radius_indices[row]), expected)
+        assert_array_almost_equal(
+                                    radius_distances[row],
+                                    np.sort(all_distances[row, expected])
+        )
+
+def test_query_fewer_points_than_k():
+    rng = np.random.default_rng(1)
+    points = random_sphere_points(3, 2, rng)
+    distances, indices = VantagePointTree(Sphere(2), points).query(points, k=4)
+    assert_array_equal(indices[:, 0], np.arange(3))
+    assert_array_equal(indices[:, 3], -np.ones(3))
+    assert np.all(np.isinf(distances[:, 3]))
+
+def test_deep_tree_and_empty_results():
+    rng = np.random.default_rng(3)
+    sphere = Sphere(2)
+    points = random_sphere_points(100, 2, rng)
+    queries = random_sphere_points(7, 2, rng)
+    all_distances = sphere.pairwise_distance(queries, points)
+    # Single point leaves, so that queries reach different depths
+    tree = VantagePointTree(sphere, points, leaf_size=1)
+    distances, indices = tree.query(queries, k=3)
+    assert_array_equal(indices, np.argsort(all_distances, axis=1)[:, :3])
+
+    radius = np.quantile(all_distances, 0.05)
+    radius_distances, radius_indices = tree.query_radius(queries, radius)
+    for row in range(queries.shape[0]):
+        assert_array_equal(np.sort(radius_indices[row]),
+                           np.flatnonzero(all_distances[row] <= radius))
+    radius_distances, radius_indices = tree.query_radius(queries, -1.)
+    assert [row.size for row in radius_indices] == [0]*7
+    assert tree.query(queries[:0], k=2)[0].shape == (0, 2)
+
+def test_save_load(tmp_path):
+    rng = np.random.default_rng(2)
+    hyperb = Hyperboloid(3)
+    points = random_hyperboloid_points(200, 3, rng)
+    queries = random_hyperboloid_points(5, 3, rng)
+    tree = VantagePointTree(hyperb, points, leaf_size=4)
+    tree.save(tmp_path / "tree.npz")
+    loaded = VantagePointTree.load(tmp_path / "tree.npz", hyperb)
+    assert_array_equal(loaded.query(queries, k=3)[1], tree.query(queries, k=3)[1])
@@ -0,0 +1,77 @@
+from instrument import Recorder, enable, disable, instrument
+import json
+from metric import Metric
+import numpy as np
+import pytest
+from samples import random_sphere_points
+from sphere import Sphere
+
+
+def test_instrument_records_nested_calls_and_restores_methods():
+    rng = np.random.default_rng(0)
+    sphere = Sphere(3)
+    p0 = random_sphere_points(50, 3, rng)
+    p1 = random_sphere_points(50, 3, rng)
+    v = sphere.logarithmic_map(p0, p1)
+    originals = (Sphere.exponential_map, Sphere.distance, Metric.dot)
+
+    with instrument() as recorder:
+        result = sphere.parallel_transport(v, p0, p1, method="pole_ladder",
+                                           n_steps=4)
+    np.testing.assert_array_almost_equal(
+        result,
+        sphere.parallel_transport(v, p0, p1, method="pole_ladder", n_steps=4)
+    )
+    assert (Sphere.exponential_map, Sphere.distance, Metric.dot) == originals
+
+    totals = {total["name"]: total for total in recorder.summary()}
+    assert totals["Sphere.parallel_transport"]["calls"] == 1
+    assert totals["Sphere.parallel_transport"]["rows"] == 50
+    assert totals["Manifold._pole_ladder_transport"]["calls"] == 4
+    # One geodesic gives every rung and midpoint, leaving one reflection
+    # per step
+    assert totals["Manifold.geodesic"]["calls"] == 1
+    assert totals["Sphere.exp_log_roundtrip"]["calls"] == 4
+    assert totals["Metric.dot"]["calls"] > 0
+    assert totals["Sphere.parallel_transport"]["bytes"] is None
+    # Times include nested calls
+    assert (totals["Sphere.parallel_transport"]["seconds"] >=
+            totals["Manifold._pole_ladder_transport"]["seconds"])
+    assert "Sphere.parallel_transport" in recorder.format_summary()
+
+def test_instrument_tracks_memory_and_exports_chrome_trace(tmp_path):
+    rng = np.random.default_rng(1)
+    sphere = Sphere(3)
+    p0 = random_sphere_points(1000, 3, rng)
+    p1 = random_sphere_points(1000, 3, rng)
+    with instrument(track_memory=True) as recorder:
+        sphere.logarithmic_map(p0, p1)
+    totals = {total["name"]: total for total in recorder.summary()}
+    # The result alone takes 1000*4 float64s
+    assert totals["Sphere.logarithmic_map"]["bytes"] >= 32000
+    assert (totals["Sphere.logarithmic_map"]["bytes"] >=
+            totals["Sphere.log_map_with_distance"]["bytes"])
+
+    path = tmp_path/"trace.json"
+    recorder.to_chrome_trace(str(path))
+    with open(path) as file:
+        events = json.load(file)["traceEvents"]
+    assert {event["name"] for event in events} == set(totals)
+    outer = next(event for event in events
+                 if event["name"] == "Sphere.logarithmic_map")
+    inner = next(event for event in events
+                 if event["name"] == "Sphere.log_map_with_distance")
+    assert outer["ph"] == "X" and outer["args"]["rows"] == 1000
+    assert outer["ts"] <= inner["ts"]
+    assert inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+
+def test_enable_twice_raises_and_disable_keeps_recorder():
+    recorder = Recorder()
+    assert enable(recorder) is recorder
+    try:
+        with pytest.raises(RuntimeError):
+            enable()
+    finally:
+        assert disable() is recorder
+    Sphere(2).distance(np.array([[1., 0., 0.]]), np.array([[0., 1., 0.]]))
+    assert recorder.records == []
@@ -0,0 +1,101 @@
+from hyperboloid import Hyperboloid
+import kernels
+from kernels import use_kernels
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_almost_equal
+import pytest
+from samples import random_hyperboloid_points, random_sphere_points
+from sphere import Sphere
+
+
+def sphere_pairs(rng):
+    p0 = random_sphere_points(20, 3, rng)
+    p1 = random_sphere_points(20, 3, rng)
+    # Equal and antipodal points
+    p1[0], p1[1] = p0[0], -p0[1]
+    return p0, p1
+
+def hyperboloid_pairs(rng):
+    p0 = random_hyperboloid_points(20, 3, rng)
+    p1 = random_hyperboloid_points(20, 3, rng)
+    p1[0] = p0[0]
+    return p0, p1
+
+CASES = [
+    (Sphere(3), sphere_pairs, "sphere"),
+    (Hyperboloid(3), hyperboloid_pairs, "hyperboloid"),
+]
+
+@pytest.mark.parametrize("manifold, sample, prefix", CASES)
+@pytest.mark.parametrize("dtype, tol", [(np.float64, 1e-10), (np.float32, 1e-4)])
+def test_kernels_match_numpy(manifold, sample, prefix, dtype, tol):
+    # Without numba the kernels run as plain Python, which checks the same
+    # arithmetic as the compiled versions
+    rng = np.random.default_rng(0)
+    p0, p1 = (p.astype(dtype) for p in sample(rng))
+    vec = manifold.project_to_tangent_space(
+                            p0, rng.standard_normal(p0.shape).astype(dtype))
+    eps = np.finfo(dtype).eps
+    kernel = lambda name: getattr(kernels, prefix + "_" + name)
+
+    with use_kernels(False):
+        distance = manifold.distance(p0, p1)
+        log, dist = manifold.log_map_with_distance(p0, p1)
+        exp = manifold.exponential_map(p0, vec)
+        transported = manifold.parallel_transport(vec, p0, p1)
+
+    assert_allclose(kernel("distance")(p0, p1), distance, rtol=tol, atol=tol)
+    fused_log, fused_dist = kernel("log_map_with_distance")(p0, p1, eps)
+    assert fused_log.dtype == dtype
+    assert_allclose(fused_log, log, rtol=tol, atol=tol)
+    assert_allclose(fused_dist, dist, rtol=tol, atol=tol)
+    assert_allclose(kernel("exponential_map")(p0, vec, eps), exp,
+                    rtol=tol, atol=tol)
+    assert_allclose(kernel("parallel_transport")(vec, p0, p1, eps),
+                    transported, rtol=tol, atol=tol)
+
+    # exponential_map may write over point
+    out = p0.copy()
+    kernel("exponential_map")(out, vec, eps, out=out)
+    assert_allclose(out, exp, rtol=tol, atol=tol)
+
+def test_applies():
+    rng = np.random.default_rng(1)
+    u, v = random_sphere_points(5, 2, rng), random_sphere_points(5, 2, rng)
+    with use_kernels(False):
+        assert not kernels.applies(u, v)
+    kernels._settings.append(True)
+    try:
+        assert kernels.applies(u, v)
+        assert kernels.applies(u[:, ::2], v[:, ::2])
+        assert not kernels.applies(u[:1], v)
+        assert not kernels.applies(u[None], v[None])
+        assert not kernels.applies(u, v.astype(np.float32))
+        assert not kernels.applies(u.astype(int), v.astype(int))
+    finally:
+        kernels._settings.pop()
+
+@pytest.mark.skipif(kernels.AVAILABLE, reason="numba is installed")
+def test_use_kernels_needs_numba():
+    with pytest.raises(ImportError):
+        with use_kernels():
+            pass
+
+@pytest.mark.parametrize("manifold, sample, prefix", CASES)
+def test_methods_dispatch_to_kernels(manifold, sample, prefix):
+    pytest.importorskip("numba")
+    rng = np.random.default_rng(2)
+    p0, p1 = sample(rng)
+    vec = manifold.logarithmic_map(p0, p1[::-1])
+    calls = lambda: (manifold.distance(p0, p1),
+                     manifold.logarithmic_map(p0, p1),
+                     manifold.exponential_map(p0, vec),
+                     manifold.parallel_transport(vec, p0, p1),
+                     # Broadcast batches fall back to NumPy
+                     manifold.distance(p0[:1], p1))
+    with use_kernels(True):
+        compiled = calls()
+    with use_kernels(False):
+        expected = calls()
+    for actual, wanted in zip(compiled, expected):
+        assert_array_almost_equal(actual, wanted, 10)
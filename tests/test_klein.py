@@ -0,0 +1,52 @@
+from conversions import hyperboloid_to_klein
+from hyperboloid import Hyperboloid
+from klein import Klein
+import numpy as np
+from numpy.testing import assert_array_almost_equal
+
+
+def random_points(m, n_dims, seed=0):
+    rng = np.random.default_rng(seed)
+    spatial = rng.standard_normal((m, n_dims))
+    time = np.sqrt(1. + np.sum(spatial**2, axis=1, keepdims=True))
+    return np.hstack([time, spatial])
+
+
+def test_distance_matches_hyperboloid():
+    u, v = random_points(40, 3, seed=1), random_points(40, 3, seed=2)
+    klein = Klein(3)
+    assert_array_almost_equal(
+        klein.distance(hyperboloid_to_klein(u), hyperboloid_to_klein(v)),
+        Hyperboloid(3).distance(u, v)
+    )
+    X, Y = hyperboloid_to_klein(u), hyperboloid_to_klein(v)
+    assert_array_almost_equal(np.diag(klein.pairwise_distance(X, Y)),
+                              klein.distance(X, Y)[:, 0])
+
+
+def test_exponential_logarithmic_round_trip():
+    rng = np.random.default_rng(3)
+    klein = Klein(3)
+    point = hyperboloid_to_klein(random_points(25, 3))
+    v = 0.5*rng.standard_normal((25, 3))
+    v[0] = 0.
+    end = klein.exponential_map(point, v)
+    assert klein.is_on_manifold(end).all()
+    assert_array_almost_equal(klein.distance(point, end),
+                              klein._tangent_norm(point, v))
+    assert_array_almost_equal(klein.logarithmic_map(point, end), v)
+
+
+def test_parallel_transport():
+    rng = np.random.default_rng(4)
+    klein = Klein(3)
+    p0 = hyperboloid_to_klein(random_points(25, 3, seed=5))
+    p1 = hyperboloid_to_klein(random_points(25, 3, seed=6))
+    v = rng.standard_normal((25, 3))
+    transported = klein.parallel_transport(v, p0, p1)
+    assert_array_almost_equal(klein._tangent_norm(p1, transported),
+                              klein._tangent_norm(p0, v))
+    assert_array_almost_equal(klein.parallel_transport(transported, p1, p0), v)
+    log01 = klein.logarithmic_map(p0, p1)
+    assert_array_almost_equal(klein.parallel_transport(log01, p0, p1),
+                              -klein.logarithmic_map(p1, p0))
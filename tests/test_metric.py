@@ -1,4 +1,5 @@
-from metric import EuclideanMetric, MinkowskiMetric
+from metric import DENSE, DIAGONAL, IDENTITY, EuclideanMetric, Metric, \
+    MinkowskiMetric
 import numpy as np
 from numpy.testing import assert_array_almost_equal
 
@@ -47,3 +48,85 @@ def test_norm():
     expected = np.array([[0.], [0.],[0.]])
     assert_array_almost_equal(eta.norm(v), expected)
 
+
+def test_structure():
+    assert EuclideanMetric(3).structure == IDENTITY
+    assert MinkowskiMetric(3).structure == DIAGONAL
+    assert_array_almost_equal(MinkowskiMetric(3).signature, [-1., 1., 1.])
+
+    assert Metric(2, np.eye(2)).structure == IDENTITY
+    assert Metric(2, np.diag([2., 3.])).structure == DIAGONAL
+    assert Metric(2, np.array([[1., 0.5], [0.5, 1.]])).structure == DENSE
+
+def test_dot_kernels_agree_with_dense():
+    rng = np.random.default_rng(0)
+    u = rng.standard_normal((5, 4))
+    v = rng.standard_normal((5, 4))
+    dense = np.array([
+                        [2., 0.5, 0., 0.],
+                        [0.5, 1., 0., 0.],
+                        [0., 0., -1., 0.],
+                        [0., 0., 0., 3.],
+    ])
+    for metric in (
+                    EuclideanMetric(4),
+                    MinkowskiMetric(4),
+                    Metric(4, np.diag([2., 1., -1., 3.])),
+                    Metric(4, dense),
+    ):
+        expected = np.einsum("ij,ai,aj->a", metric.metric, u, v).reshape(-1, 1)
+        assert_array_almost_equal(metric.dot(u, v), expected)
+
+def test_raise_index():
+    u = np.array([[1., 2.], [-3., 4.]])
+    assert_array_almost_equal(EuclideanMetric(2).raise_index(u), u)
+    assert_array_almost_equal(
+                                MinkowskiMetric(2).raise_index(u),
+                                [[-1., 2.], [3., 4.]]
+    )
+    dense = np.array([[2., 1.], [1., 3.]])
+    assert_array_almost_equal(Metric(2, dense).raise_index(u) @ dense, u)
+
+def test_lower_index():
+    rng = np.random.default_rng(3)
+    u = rng.standard_normal((4, 2))
+    v = rng.standard_normal((4, 2))
+    for metric in (EuclideanMetric(2), MinkowskiMetric(2),
+                   Metric(2, np.array([[2., 1.], [1., 3.]]))):
+        assert_array_almost_equal(
+                    np.sum(metric.lower_index(u)*v, axis=1, keepdims=True),
+                    metric.dot(u, v)
+        )
+        assert_array_almost_equal(metric.raise_index(metric.lower_index(u)), u)
+
+def test_float32_stays_float32():
+    rng = np.random.default_rng(1)
+    u = rng.standard_normal((5, 3)).astype(np.float32)
+    v = rng.standard_normal((5, 3)).astype(np.float32)
+    for metric in (
+                    EuclideanMetric(3),
+                    MinkowskiMetric(3),
+                    Metric(3, np.array([[2., 1., 0.], [1., 3., 0.], [0., 0., 1.]])),
+    ):
+        assert metric.dot(u, v).dtype == np.float32
+        assert metric.gram(u, v).dtype == np.float32
+        assert metric.raise_index(u).dtype == np.float32
+        assert_array_almost_equal(
+                                    metric.dot(u, v),
+                                    metric.dot(u.astype(np.float64),
+                                               v.astype(np.float64)),
+                                    decimal=5
+        )
+
+def test_dot_broadcasts_batch_dimensions():
+    rng = np.random.default_rng(4)
+    u = rng.standard_normal((1, 3))
+    v = rng.standard_normal((4, 5, 3))
+    for metric in (EuclideanMetric(3), MinkowskiMetric(3),
+                   Metric(3, np.array([[2., 1., 0.], [1., 3., 0.], [0., 0., 1.]]))):
+        expected = metric.dot(np.tile(u, (20, 1)), v.reshape(20, 3))
+        assert metric.dot(u, v).shape == (4, 5, 1)
+        assert_array_almost_equal(metric.dot(u, v).reshape(20, 1), expected)
+        # Spacelike vectors, whose Minkowski norms are real
+        assert metric.norm(v*[0., 1., 1.]).shape == (4, 5, 1)
+        assert_array_almost_equal(metric.raise_index(metric.lower_index(v)), v)
@@ -0,0 +1,65 @@
+from hyperboloid import Hyperboloid
+from optim import RiemannianAdam, RiemannianSGD
+from samples import random_hyperboloid_points, random_sphere_points
+from sphere import Sphere
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+import pytest
+
+
+def euclidean_gradient(manifold, target):
+    # Gradient of f(x) = -x.target, minimised at x = target on both manifolds
+    return -target*manifold.metric.signature
+
+@pytest.mark.parametrize("manifold, sample", [
+    (Sphere(2), random_sphere_points),
+    (Hyperboloid(2), random_hyperboloid_points),
+])
+@pytest.mark.parametrize("optimizer", [RiemannianSGD, RiemannianAdam])
+@pytest.mark.parametrize("retraction", [False, True])
+def test_sparse_steps_converge(manifold, sample, optimizer, retraction):
+    rng = np.random.default_rng(0)
+    params = sample(10, 2, rng)
+    target = sample(1, 2, rng)
+    initial = params.copy()
+    rows = np.array([1, 4, 7])
+    opt = optimizer(manifold, lr=0.05, retraction=retraction)
+    for _ in range(500):
+        grad = euclidean_gradient(manifold, np.repeat(target, 3, axis=0))
+        opt.step(params, grad, rows)
+
+    untouched = np.setdiff1d(np.arange(10), rows)
+    assert_array_equal(params[untouched], initial[untouched])
+    assert_array_almost_equal(params[rows], np.repeat(target, 3, axis=0), decimal=4)
+    assert_array_almost_equal(
+                manifold.metric.dot(params, params),
+                manifold.metric.dot(initial, initial)
+    )
+
+def test_repeated_rows_are_summed():
+    rng = np.random.default_rng(1)
+    sphere = Sphere(2)
+    params = random_sphere_points(5, 2, rng)
+    grad = rng.standard_normal((3, 3))
+
+    repeated = params.copy()
+    RiemannianSGD(sphere, lr=0.1).step(repeated, grad, np.array([3, 0, 3]))
+    summed = params.copy()
+    RiemannianSGD(sphere, lr=0.1).step(
+                    summed, np.stack([grad[1], grad[0] + grad[2]]), np.array([0, 3]))
+    assert_array_almost_equal(repeated, summed)
+
+def test_adam_dense_step_matches_sparse_step():
+    rng = np.random.default_rng(2)
+    hyperb = Hyperboloid(3)
+    params = random_hyperboloid_points(6, 3, rng)
+    grad = rng.standard_normal((6, 4))
+    dense = params.copy()
+    sparse = params.copy()
+    dense_opt = RiemannianAdam(hyperb, lr=0.01)
+    sparse_opt = RiemannianAdam(hyperb, lr=0.01)
+    for _ in range(3):
+        dense_opt.step(dense, grad)
+        sparse_opt.step(sparse, grad[::-1], np.arange(6)[::-1])
+    assert_array_almost_equal(dense, sparse)
+    assert_array_almost_equal(dense_opt.first_moment, sparse_opt.first_moment)
@@ -0,0 +1,87 @@
+from conversions import hyperboloid_to_poincare
+from hyperboloid import Hyperboloid
+import numpy as np
+from numpy.testing import assert_array_almost_equal
+from poincare import PoincareBall
+import pytest
+
+
+def random_points(m, n_dims, seed=0):
+    rng = np.random.default_rng(seed)
+    spatial = rng.standard_normal((m, n_dims))
+    time = np.sqrt(1. + np.sum(spatial**2, axis=1, keepdims=True))
+    return np.hstack([time, spatial])
+
+
+def test_distance_matches_hyperboloid():
+    u, v = random_points(40, 3, seed=1), random_points(40, 3, seed=2)
+    ball = PoincareBall(3)
+    assert_array_almost_equal(
+        ball.distance(hyperboloid_to_poincare(u), hyperboloid_to_poincare(v)),
+        Hyperboloid(3).distance(u, v)
+    )
+
+
+def test_pairwise_distance():
+    X = hyperboloid_to_poincare(random_points(30, 2, seed=1))
+    Y = hyperboloid_to_poincare(random_points(20, 2, seed=2))
+    ball = PoincareBall(2)
+    expected = ball.distance(np.repeat(X, 20, axis=0), np.tile(Y, (30, 1)))
+    assert_array_almost_equal(ball.pairwise_distance(X, Y),
+                              expected.reshape(30, 20))
+
+
+def test_exponential_logarithmic_round_trip():
+    rng = np.random.default_rng(3)
+    ball = PoincareBall(3)
+    point = hyperboloid_to_poincare(random_points(25, 3))
+    v = rng.standard_normal((25, 3))
+    v[0] = 0.
+    end = ball.exponential_map(point, v)
+    assert ball.is_on_manifold(end).all()
+    assert_array_almost_equal(ball.distance(point, end),
+                              np.sqrt(np.sum(v**2, axis=1, keepdims=True))
+                              *ball._conformal_factor(point))
+    assert_array_almost_equal(ball.logarithmic_map(point, end), v)
+
+
+def test_parallel_transport():
+    rng = np.random.default_rng(4)
+    ball = PoincareBall(3)
+    p0 = hyperboloid_to_poincare(random_points(25, 3, seed=5))
+    p1 = hyperboloid_to_poincare(random_points(25, 3, seed=6))
+    v = rng.standard_normal((25, 3))
+    transported = ball.parallel_transport(v, p0, p1)
+    # The Riemannian norm lambda_x |v| is preserved
+    assert_array_almost_equal(
+        ball._conformal_factor(p1)*ball.metric.norm(transported),
+        ball._conformal_factor(p0)*ball.metric.norm(v)
+    )
+    assert_array_almost_equal(ball.parallel_transport(transported, p1, p0), v)
+    # The initial velocity of the geodesic is carried to its final velocity
+    log01 = ball.logarithmic_map(p0, p1)
+    assert_array_almost_equal(ball.parallel_transport(log01, p0, p1),
+                              -ball.logarithmic_map(p1, p0))
+
+
+def test_second_order_retraction_unavailable():
+    ball = PoincareBall(2)
+    with pytest.raises(ValueError):
+        ball.retraction(np.zeros((1, 2)), np.ones((1, 2)), kind="second_order")
+
+
+def test_geodesic():
+    ball = PoincareBall(3)
+    p0 = hyperboloid_to_poincare(random_points(15, 3, seed=4))
+    p1 = hyperboloid_to_poincare(random_points(15, 3, seed=5))
+    t = np.linspace(0., 1., 5)
+    path = ball.geodesic(p0, p1, t)
+    assert path.shape == (15, 5, 3)
+    assert_array_almost_equal(path[:, 0], p0)
+    assert_array_almost_equal(path[:, -1], p1)
+    for k, time in enumerate(t):
+        assert_array_almost_equal(path[:, k],
+                                  ball.exp_log_roundtrip(p0, p1, time))
+    times, block = next(ball.iter_geodesic(p0, p1, t, block_size=2))
+    assert times == slice(0, 2)
+    assert_array_almost_equal(block, path[:, :2])
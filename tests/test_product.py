@@ -0,0 +1,204 @@
+from backend import ThreadBackend, use_backend
+from euclidean import Euclidean
+from hyperboloid import Hyperboloid
+from klein import Klein
+from manifold import Manifold
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_almost_equal, \
+    assert_array_equal
+from poincare import PoincareBall
+from product import ProductManifold
+import pytest
+from samples import random_hyperboloid_points, random_sphere_points
+from sphere import Sphere
+from transport import TransportPlan
+from validation import ValidationPolicy
+
+
+def random_points(m, rng):
+    '''
+    Points of S^2 x (H^2)^3 x R^4
+    '''
+    return np.hstack([random_sphere_points(m, 2, rng)] +
+                     [random_hyperboloid_points(m, 2, rng) for _ in range(3)] +
+                     [rng.standard_normal((m, 4))])
+
+@pytest.fixture
+def product():
+    return ProductManifold([Sphere(2), (Hyperboloid(2), 3), Euclidean(4)])
+
+def test_layout(product):
+    assert_array_equal(product.offsets, [0, 3, 12, 16])
+    assert product.n_dims == 12
+    assert product.curvature is None
+    assert ProductManifold([Sphere(2)]).curvature == 1.
+
+def test_distance_combines_factors(product):
+    rng = np.random.default_rng(0)
+    u, v = random_points(15, rng), random_points(15, rng)
+    factor_distances = np.hstack(
+        [Sphere(2).distance(u[:, :3], v[:, :3])] +
+        [Hyperboloid(2).distance(u[:, start:start+3], v[:, start:start+3])
+         for start in (3, 6, 9)] +
+        [np.linalg.norm(u[:, 12:] - v[:, 12:], axis=1, keepdims=True)]
+    )
+    assert_array_almost_equal(product.factor_distances(u, v), factor_distances)
+    assert_array_almost_equal(
+        product.distance(u, v),
+        np.sqrt(np.sum(factor_distances**2, axis=1, keepdims=True))
+    )
+    expected = product.distance(np.repeat(u, 15, axis=0), np.tile(v, (15, 1)))
+    assert_array_almost_equal(product.pairwise_distance(u, v, block_size=4),
+                              expected.reshape(15, 15))
+
+def test_maps_match_factors(product):
+    rng = np.random.default_rng(1)
+    u, v = random_points(15, rng), random_points(15, rng)
+    log, dist = product.log_map_with_distance(u, v)
+    assert_array_almost_equal(log, product.logarithmic_map(u, v))
+    assert_array_almost_equal(log[:, 6:9],
+                              Hyperboloid(2).logarithmic_map(u[:, 6:9], v[:, 6:9]))
+    assert_array_almost_equal(dist, product.distance(u, v))
+    assert_array_almost_equal(product.exponential_map(u, log), v)
+    out = np.empty_like(u)
+    assert product.exponential_map(u, log, out=out) is out
+
+    t = rng.uniform(0., 1., (15, 1))
+    assert_array_almost_equal(product.exp_log_roundtrip(u, v, t),
+                              product.exponential_map(u, t*log))
+    path = product.geodesic(u, v, [0., 0.5, 1.])
+    assert_array_almost_equal(path[:, 1], product.exp_log_roundtrip(u, v, 0.5))
+    assert_array_almost_equal(path[:, 2], v)
+
+def test_parallel_transport(product):
+    rng = np.random.default_rng(2)
+    u, v = random_points(15, rng), random_points(15, rng)
+    vector = product.project_to_tangent_space(u, rng.standard_normal(u.shape))
+    assert product.is_in_tangent_space(u, vector).all()
+    transported = product.parallel_transport(vector, u, v)
+    assert product.is_in_tangent_space(v, transported).all()
+    plan = TransportPlan(product, u, v)
+    assert_array_almost_equal(plan.transport(vector), transported)
+    assert_array_almost_equal(
+        plan.transport(np.stack([vector, 2.*vector], axis=1))[:, 1],
+        2.*transported)
+    assert_array_almost_equal(
+        Manifold.parallel_transport(product, vector, u, v, n_steps="adaptive"),
+        transported
+    )
+    # The factors are symmetric, so the measured error stops every row at
+    # its first refinement
+    _, steps = product._adaptive_pole_ladder(vector, u, v, 1e-8, 64)
+    assert (steps <= 2).all()
+
+def test_frechet_mean_of_stacked_factors():
+    rng = np.random.default_rng(3)
+    product = ProductManifold([(Sphere(2), 2), PoincareBall(2)])
+    sphere_points = random_sphere_points(20, 2, rng)
+    ball_points = 0.3*random_sphere_points(20, 1, rng)
+    points = np.hstack([sphere_points, -sphere_points, ball_points])
+    # Points near a pole, so that the means are well defined
+    points[:, 0] += 3.
+    points[:, 3] -= 3.
+    points = product.project_to_manifold(points)
+    mean = product.frechet_mean(points)
+    assert_array_almost_equal(mean[:, :3], -mean[:, 3:6])
+    assert_array_almost_equal(mean[:, :3],
+                              Sphere(2).frechet_mean(points[:, :3]))
+
+def test_masked_rows_and_sharding(product):
+    rng = np.random.default_rng(4)
+    u, v = random_points(40, rng), random_points(40, rng)
+    vector = product.logarithmic_map(u, v)
+    is_updated = rng.random(40) < 0.3
+    rows = is_updated.nonzero()[0]
+
+    assert_array_almost_equal(product.distance(u, v, where=is_updated)[rows],
+                              product.distance(u[rows], v[rows]))
+    assert_array_equal(product.distance(u, v, where=is_updated)[~is_updated],
+                       0.)
+    moved = product.exponential_map(u, 0.5*vector, where=is_updated)
+    assert_array_almost_equal(moved[rows],
+                              product.exponential_map(u[rows], 0.5*vector[rows]))
+    assert_array_equal(moved[~is_updated], u[~is_updated])
+    assert_array_almost_equal(
+        product.logarithmic_map(u, v, where=is_updated)[rows], vector[rows])
+    assert_array_almost_equal(
+        product.exp_log_roundtrip(u, v, 0.5, where=is_updated), moved)
+    transported = product.parallel_transport(vector, u, v, where=is_updated)
+    assert_array_almost_equal(transported[rows],
+                              product.parallel_transport(vector[rows], u[rows],
+                                                         v[rows]))
+    assert_array_equal(transported[~is_updated], vector[~is_updated])
+    ambient = rng.standard_normal(u.shape)
+    projected = product.project_to_tangent_space(u, ambient, where=is_updated)
+    assert_array_almost_equal(projected[rows],
+                              product.project_to_tangent_space(u[rows],
+                                                               ambient[rows]))
+    assert_array_equal(projected[~is_updated], ambient[~is_updated])
+
+    expected = product.parallel_transport(vector, u, v)
+    expected_projection = product.project_to_tangent_space(u, ambient)
+    with use_backend(ThreadBackend(n_workers=4, min_rows=8)) as backend:
+        assert_array_almost_equal(product.parallel_transport(vector, u, v),
+                                  expected)
+        assert_array_almost_equal(product.project_to_tangent_space(u, ambient),
+                                  expected_projection)
+    backend.close()
+
+def test_inner_product_of_point_dependent_factors():
+    rng = np.random.default_rng(5)
+    ball, klein = PoincareBall(2), Klein(2)
+    product = ProductManifold([Sphere(2), ball, (klein, 2)])
+    points = np.hstack([random_sphere_points(10, 2, rng)] +
+                       [0.5*random_sphere_points(10, 1, rng) for _ in range(3)])
+    u = product.project_to_tangent_space(points,
+                                         rng.standard_normal(points.shape))
+    v = product.project_to_tangent_space(points,
+                                         rng.standard_normal(points.shape))
+    expected = (np.sum(u[:, :3]*v[:, :3], axis=1, keepdims=True) +
+                ball.inner_product(points[:, 3:5], u[:, 3:5], v[:, 3:5]) +
+                klein.inner_product(points[:, 5:7], u[:, 5:7], v[:, 5:7]) +
+                klein.inner_product(points[:, 7:], u[:, 7:], v[:, 7:]))
+    assert_array_almost_equal(product.inner_product(points, u, v), expected)
+    # The metrics of the ball and Klein factors are not those of their
+    # coordinates
+    assert not np.allclose(product.metric.dot(u, v), expected)
+    # Norms are the lengths of the geodesics that the vectors generate
+    step = 0.1*u
+    assert_allclose(
+        np.sqrt(product.inner_product(points, step, step)),
+        product.distance(points, product.exponential_map(points, step)),
+        rtol=1e-8
+    )
+
+def test_validation_checks_every_factor(product):
+    rng = np.random.default_rng(6)
+    u, v = random_points(20, rng), random_points(20, rng)
+    vector = product.logarithmic_map(u, v)
+    drifted = u.copy()
+    # Off the hyperboloid of the second copy of the stacked factor
+    drifted[[3, 8], 6] += 0.1
+    off_tangent = vector.copy()
+    off_tangent[[3, 8], :3] += u[[3, 8], :3]
+
+    policy = ValidationPolicy("full", action="raise")
+    product.validation = policy
+    try:
+        product.exponential_map(u, vector)
+        product.parallel_transport(vector, u, v)
+        with pytest.raises(ValueError):
+            product.distance(drifted, v)
+        with pytest.raises(ValueError):
+            product.exponential_map(u, off_tangent)
+        with pytest.raises(ValueError):
+            product.parallel_transport(off_tangent, u, v)
+        assert policy.summary()["ProductManifold.distance:u"]["violations"] == 2
+
+        product.validation = ValidationPolicy("full", action="project")
+        assert_array_almost_equal(product.distance(drifted, v),
+                                  product.distance(u, v))
+        assert_array_almost_equal(product.exponential_map(u, off_tangent),
+                                  product.exponential_map(u, vector))
+    finally:
+        del product.validation
@@ -1,6 +1,6 @@
 from sphere import Sphere
 import numpy as np
-from numpy.testing import assert_array_almost_equal
+from numpy.testing import assert_array_almost_equal, assert_array_equal
 
 def test_distance():
     u = np.array([
@@ -187,4 +187,286 @@ def test_parallel_transport():
     print("")
     result = circle.parallel_transport(v, p0, p1)
     print(result)
-    assert_array_almost_equal(result, expected)#, decimal=
\ No newline at end of file
+    assert_array_almost_equal(result, expected)#, decimal=
+
+def test_pairwise_distance():
+    angles_x = np.array([0., 0.5, 2., 3.])
+    angles_y = np.array([0.25, 1.5, -1.])
+    X = np.stack([np.cos(angles_x), np.sin(angles_x)], axis=1)
+    Y = np.stack([np.cos(angles_y), np.sin(angles_y)], axis=1)
+
+    circle = Sphere(1)
+    expected = np.array([
+        circle.distance(np.tile(x, (Y.shape[0], 1)), Y)[:, 0] for x in X
+    ])
+    assert_array_almost_equal(circle.pairwise_distance(X, Y), expected)
+    assert_array_almost_equal(
+                                circle.pairwise_distance(X, Y, block_size=2),
+                                expected
+    )
+
+    self_distances = circle.pairwise_distance(X)
+    assert_array_almost_equal(self_distances, self_distances.T)
+    assert_array_almost_equal(np.diag(self_distances), np.zeros(4))
+    assert_array_almost_equal(self_distances[0, 3], 3.)
+    assert_array_almost_equal(
+                                circle.pairwise_distance(X, block_size=3),
+                                self_distances
+    )
+
+def test_out_and_in_place_variants_match():
+    rng = np.random.default_rng(0)
+    p = rng.standard_normal((6, 3))
+    p /= np.linalg.norm(p, axis=1, keepdims=True)
+    circle = Sphere(2)
+    v = circle.project_to_tangent_space(p, rng.standard_normal((6, 3)))
+    v[0] = 0.
+
+    expected = circle.exponential_map(p, v)
+    out = np.empty_like(p)
+    assert circle.exponential_map(p, v, out=out, workspace=np.empty_like(p)) is out
+    assert_array_equal(out, expected)
+    p_copy = p.copy()
+    circle.exponential_map_(p_copy, v)
+    assert_array_equal(p_copy, expected)
+    assert_array_equal(expected[0], p[0])
+
+    ambient = rng.standard_normal((6, 3))
+    expected = circle.project_to_tangent_space(p, ambient)
+    assert_array_equal(
+                        circle.project_to_tangent_space(
+                                            p, ambient, out=np.empty_like(p)),
+                        expected
+    )
+    circle.project_to_tangent_space_(p, ambient, workspace=np.empty_like(p))
+    assert_array_equal(ambient, expected)
+
+    p1 = circle.exponential_map(p, v)
+    expected = circle.logarithmic_map(p, p1)
+    out = np.empty_like(p)
+    circle.logarithmic_map(p, p1, out=out)
+    assert_array_equal(out, expected)
+
+def test_parallel_transport_closed_form_matches_pole_ladder():
+    rng = np.random.default_rng(3)
+    p0 = rng.standard_normal((8, 4))
+    p0 /= np.linalg.norm(p0, axis=1, keepdims=True)
+    p1 = rng.standard_normal((8, 4))
+    p1 /= np.linalg.norm(p1, axis=1, keepdims=True)
+    sphere = Sphere(3)
+    v = sphere.project_to_tangent_space(p0, rng.standard_normal((8, 4)))
+
+    result = sphere.parallel_transport(v, p0, p1)
+    assert_array_almost_equal(sphere.metric.dot(result, p1), np.zeros((8, 1)))
+    assert_array_almost_equal(sphere.metric.norm(result), sphere.metric.norm(v))
+    assert_array_almost_equal(
+                                sphere.parallel_transport(result, p1, p0),
+                                v
+    )
+    assert_array_almost_equal(
+        sphere.parallel_transport(v, p0, p1, method="pole_ladder", n_steps=20),
+        result,
+        decimal=3
+    )
+
+def test_frechet_mean():
+    # On the circle, the mean of nearby points is the mean of their angles
+    angles = np.array([0.1, 0.3, 0.8, 2., 2.5, 2.6, 2.9])
+    groups = np.array([0, 0, 0, 1, 1, 1, 1])
+    weights = np.array([1., 1., 2., 1., 1., 1., 1.])
+    points = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+
+    circle = Sphere(1)
+    mean_angles = np.array([
+        np.average(angles[:3], weights=weights[:3]),
+        np.mean(angles[3:]),
+    ])
+    expected = np.stack([np.cos(mean_angles), np.sin(mean_angles)], axis=1)
+    assert_array_almost_equal(
+                            circle.frechet_mean(points, weights, groups),
+                            expected
+    )
+    assert_array_almost_equal(
+                            circle.frechet_mean(points[3:]),
+                            expected[1:]
+    )
+
+def test_retraction():
+    p = np.array([
+                    [np.cos(0.), np.sin(0.)],
+                    [np.cos(1.), np.sin(1.)],
+    ])
+    v = np.array([
+                    [0., 1e-3],
+                    [-np.sin(1.)*1e-3, np.cos(1.)*1e-3],
+    ])
+    circle = Sphere(1)
+    retracted = circle.retraction(p, v)
+    assert_array_almost_equal(np.linalg.norm(retracted, axis=1), np.ones(2))
+    assert_array_almost_equal(retracted, circle.exponential_map(p, v), decimal=6)
+
+def test_retraction_error_orders():
+    rng = np.random.default_rng(4)
+    p = rng.standard_normal((20, 4))
+    p /= np.linalg.norm(p, axis=1, keepdims=True)
+    sphere = Sphere(3)
+    direction = sphere.project_to_tangent_space(p, rng.standard_normal((20, 4)))
+    direction /= sphere.metric.norm(direction)
+
+    def max_error(kind, step_size):
+        v = step_size*direction
+        error = sphere.retraction(p, v, kind) - sphere.exponential_map(p, v)
+        return np.abs(error).max()
+
+    # Halving the step divides the error by 2^(order+1)
+    assert_array_equal(max_error("exp", 0.1), 0.)
+    for kind in ("projection", "second_order"):
+        assert 7. < max_error(kind, 0.02)/max_error(kind, 0.01) < 9.
+
+def test_float32_precision():
+    rng = np.random.default_rng(6)
+    p0 = rng.standard_normal((50, 4))
+    p0 /= np.linalg.norm(p0, axis=1, keepdims=True)
+    sphere = Sphere(3)
+    # Distances from 1e-6 to nearly pi, where arccos(u.v) is inaccurate
+    v = sphere.project_to_tangent_space(p0, rng.standard_normal((50, 4)))
+    v *= np.logspace(-6, np.log10(3.1), 50)[:, None]/sphere.metric.norm(v)
+    p1 = sphere.exponential_map(p0, v)
+    expected = sphere.distance(p0, p1)
+    assert_array_almost_equal(expected, sphere.metric.norm(v), decimal=12)
+
+    p0_32, p1_32 = p0.astype(np.float32), p1.astype(np.float32)
+    distance = sphere.distance(p0_32, p1_32)
+    assert distance.dtype == np.float32
+    np.testing.assert_allclose(distance, expected, rtol=1e-5, atol=1e-7)
+
+    log = sphere.logarithmic_map(p0_32, p1_32)
+    assert log.dtype == np.float32
+    np.testing.assert_allclose(log, v, rtol=1e-4, atol=1e-6)
+    exp = sphere.exponential_map(p0_32, v.astype(np.float32))
+    assert exp.dtype == np.float32
+    np.testing.assert_allclose(exp, p1, atol=1e-6)
+
+def test_fused_log_map_and_roundtrip():
+    rng = np.random.default_rng(7)
+    sphere = Sphere(3)
+    p0 = rng.standard_normal((20, 4))
+    p0 /= np.linalg.norm(p0, axis=1, keepdims=True)
+    p1 = rng.standard_normal((20, 4))
+    p1 /= np.linalg.norm(p1, axis=1, keepdims=True)
+    p1[0] = p0[0]
+
+    log, dist = sphere.log_map_with_distance(p0, p1)
+    assert_array_almost_equal(log, sphere.logarithmic_map(p0, p1))
+    assert_array_almost_equal(dist, sphere.distance(p0, p1))
+    assert_array_almost_equal(sphere.metric.norm(log), dist)
+
+    t = rng.uniform(-1., 2., (20, 1))
+    for fraction in (0.5, -1., t):
+        assert_array_almost_equal(
+                    sphere.exp_log_roundtrip(p0, p1, fraction),
+                    sphere.exponential_map(p0, fraction*log)
+        )
+    assert_array_almost_equal(sphere.exp_log_roundtrip(p0, p1), p1)
+
+def test_geodesic():
+    rng = np.random.default_rng(8)
+    sphere = Sphere(3)
+    p0 = rng.standard_normal((20, 4))
+    p0 /= np.linalg.norm(p0, axis=1, keepdims=True)
+    p1 = rng.standard_normal((20, 4))
+    p1 /= np.linalg.norm(p1, axis=1, keepdims=True)
+    p1[0] = p0[0]
+    t = np.linspace(-0.5, 1.5, 9)
+
+    path = sphere.geodesic(p0, p1, t)
+    assert path.shape == (20, 9, 4)
+    for k, time in enumerate(t):
+        assert_array_almost_equal(path[:, k],
+                                  sphere.exp_log_roundtrip(p0, p1, time))
+    blocks = [block.copy() for _, block in sphere.iter_geodesic(p0, p1, t, 4)]
+    assert [block.shape[1] for block in blocks] == [4, 4, 1]
+    assert_array_equal(np.concatenate(blocks, axis=1), path)
+
+def test_adaptive_parallel_transport():
+    rng = np.random.default_rng(9)
+    sphere = Sphere(2)
+    dist = np.array([[1e-3], [0.5], [3.1], [0.999*np.pi]])
+    p0 = np.tile([[1., 0., 0.]], (4, 1))
+    p1 = np.hstack([np.cos(dist), np.sin(dist), np.zeros_like(dist)])
+    # Long vectors, beyond the reach of an unscaled ladder
+    v = sphere.project_to_tangent_space(p0, 3.*rng.standard_normal((4, 3)))
+    expected = sphere.parallel_transport(v, p0, p1)
+    # ladder_steps bounds the steps, from the lengths of the geodesics
+    assert_array_equal(sphere.ladder_steps(dist, tol=1e-4, max_steps=40),
+                       [1, 36, 40, 40])
+    assert_array_almost_equal(
+        sphere.parallel_transport(v, p0, p1, method="pole_ladder",
+                                  n_steps="adaptive"),
+        expected, decimal=10
+    )
+    # One step is exact on the sphere, so the error measured by doubling it
+    # stops every row that may take more than one step at two
+    _, steps = sphere._adaptive_pole_ladder(v, p0, p1, 1e-8, 64)
+    assert_array_equal(steps, [1, 2, 2, 2])
+
+    # A ladder that errs by O(1/n^2) is refined until it meets tol, and
+    # rows leave the ladder as they finish
+    class DriftingSphere(Sphere):
+        def _pole_ladder_transport(self, vec_Tp0M, point_0, point_1,
+                                   midpt_01=None):
+            vec_Tp1M = super()._pole_ladder_transport(vec_Tp0M, point_0,
+                                                      point_1, midpt_01)
+            return vec_Tp1M*(1. + 0.01*self.distance(point_0, point_1)**3)
+    drifting = DriftingSphere(2)
+    transported, steps = drifting._adaptive_pole_ladder(v, p0, p1, 1e-4, 40)
+    assert_array_equal(steps, [1, 8, 40, 40])
+    assert_array_almost_equal(transported[:2], expected[:2], decimal=3)
+
+def test_broadcasting():
+    rng = np.random.default_rng(10)
+    sphere = Sphere(3)
+    query = rng.standard_normal((1, 4))
+    query /= np.linalg.norm(query)
+    candidates = rng.standard_normal((30, 4))
+    candidates /= np.linalg.norm(candidates, axis=1, keepdims=True)
+    tiled = np.tile(query, (30, 1))
+
+    assert_array_almost_equal(sphere.distance(query, candidates),
+                              sphere.distance(tiled, candidates))
+    log = sphere.logarithmic_map(query, candidates)
+    assert_array_almost_equal(log, sphere.logarithmic_map(tiled, candidates))
+    assert_array_almost_equal(sphere.exponential_map(query, log), candidates)
+    assert_array_almost_equal(sphere.parallel_transport(log, query, candidates),
+                              sphere.parallel_transport(log, tiled, candidates))
+
+    # Many to many: (5, 1) queries against (30,) candidates
+    queries = np.stack([candidates[:5]], axis=1)
+    distances = sphere.distance(queries, candidates)
+    assert distances.shape == (5, 30, 1)
+    assert_array_almost_equal(distances[3], sphere.distance(candidates[3:4],
+                                                            candidates))
+    assert_array_almost_equal(distances[..., 0],
+                              sphere.pairwise_distance(candidates[:5], candidates))
+    path = sphere.geodesic(queries, candidates, [0., 0.5, 1.])
+    assert path.shape == (5, 30, 3, 4)
+    assert_array_almost_equal(path[:, :, 2], np.broadcast_to(candidates, (5, 30, 4)))
+
+def test_pole_ladder_skips_unmoved_rows():
+    rng = np.random.default_rng(11)
+    sphere = Sphere(2)
+    p0 = rng.standard_normal((6, 3))
+    p0 /= np.linalg.norm(p0, axis=1, keepdims=True)
+    p1 = rng.standard_normal((6, 3))
+    p1 /= np.linalg.norm(p1, axis=1, keepdims=True)
+    v = sphere.project_to_tangent_space(p0, rng.standard_normal((6, 3)))
+    # A zero vector, and a vector between equal points, are unchanged
+    v[1] = 0.
+    p1[4] = p0[4]
+
+    for n_steps in (3, "adaptive"):
+        transported = sphere.parallel_transport(v, p0, p1, method="pole_ladder",
+                                                n_steps=n_steps)
+        assert_array_equal(transported[[1, 4]], v[[1, 4]])
+        assert_array_almost_equal(transported,
+                                  sphere.parallel_transport(v, p0, p1))
@@ -0,0 +1,78 @@
+from hyperboloid import Hyperboloid
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+import pytest
+from samples import random_hyperboloid_points
+from sphere import Sphere
+from store import ManifoldArray, stream_apply
+import tracemalloc
+
+
+def test_create_and_iter_blocks(tmp_path):
+    store = ManifoldArray.create(str(tmp_path / "a.npy"), (10, 3))
+    store[:] = np.arange(30.).reshape(10, 3)
+    store.flush()
+    store = ManifoldArray(str(tmp_path / "a.npy"))
+    assert store.shape == (10, 3) and len(store) == 10
+    for prefetch in (0, 2):
+        blocks = list(store.iter_blocks(block_size=4, prefetch=prefetch))
+        assert [rows for rows, _ in blocks] == [
+                                    slice(0, 4), slice(4, 8), slice(8, 10)]
+        assert_array_equal(np.vstack([block for _, block in blocks]),
+                           np.arange(30.).reshape(10, 3))
+
+@pytest.mark.parametrize("prefetch", [0, 1, 3])
+def test_stream_apply_matches_in_memory(tmp_path, prefetch):
+    rng = np.random.default_rng(0)
+    hyperb = Hyperboloid(3)
+    p0 = random_hyperboloid_points(103, 3, rng)
+    p1 = random_hyperboloid_points(103, 3, rng)
+    store = ManifoldArray.from_array(str(tmp_path / "p0.npy"), p0)
+    np.save(str(tmp_path / "p1.npy"), p1)
+
+    log = store.apply(hyperb.logarithmic_map, str(tmp_path / "p1.npy"),
+                      path=str(tmp_path / "log.npy"), block_size=10,
+                      prefetch=prefetch)
+    assert_array_almost_equal(log[:], hyperb.logarithmic_map(p0, p1))
+    # exponential_map takes a workspace, reused by every block
+    exp = store.apply(hyperb.exponential_map, log,
+                      path=str(tmp_path / "exp.npy"), block_size=10,
+                      prefetch=prefetch)
+    assert_array_almost_equal(exp[:], p1)
+    # The width of the output is that of the blocks of distances, not of p0
+    dist = stream_apply(hyperb.distance, (p0, p1), str(tmp_path / "d.npy"),
+                        block_size=7, prefetch=prefetch)
+    assert dist.shape == (103, 1)
+    assert_array_almost_equal(dist[:], hyperb.distance(p0, p1))
+
+def test_stream_apply_errors(tmp_path):
+    points = np.ones((20, 3))
+    with pytest.raises(ValueError):
+        stream_apply(Sphere(2).distance, (points, points[:10]),
+                     str(tmp_path / "d.npy"))
+
+    def fail(block):
+        raise KeyError("boom")
+    with pytest.raises(KeyError):
+        stream_apply(fail, (points,), str(tmp_path / "f.npy"), block_size=5)
+    # Blocks narrower than the output are not broadcast across its columns
+    with pytest.raises(ValueError):
+        stream_apply(Sphere(2).distance, (points, points),
+                     str(tmp_path / "d.npy"), n_cols=3)
+
+def test_memory_does_not_grow_with_rows(tmp_path):
+    rng = np.random.default_rng(1)
+    points = rng.standard_normal((50000, 8))
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+    store = ManifoldArray.from_array(str(tmp_path / "p.npy"), points)
+    del points
+    block_size = 1000
+    tracemalloc.start()
+    try:
+        store.apply(Sphere(7).project_to_tangent_space, store,
+                    path=str(tmp_path / "t.npy"), block_size=block_size)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # A handful of blocks, far below the 3.2MB of each table
+    assert peak < 20*block_size*8*8
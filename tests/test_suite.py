@@ -0,0 +1,29 @@
+from benchmarks.suite import compare, main, run
+import json
+
+
+def test_run_covers_every_operation():
+    results = run(["sphere", "hyperboloid", "poincare", "klein", "metric"],
+                  [1, 20], [2], ["float32", "float64"], min_time=1e-4, log=None)
+    keys = {(r["manifold"], r["operation"], r["m"], r["dtype"]) for r in results}
+    assert ("sphere", "parallel_transport[pole_ladder]", 20, "float32") in keys
+    assert ("metric", "dot[dense]", 1, "float64") in keys
+    assert all(r["seconds"] > 0. and r["peak_bytes"] >= 0 for r in results)
+    assert run(["sphere"], [1000], [2], ["float64"], max_bytes=100,
+               log=None) == []
+
+def test_compare_flags_regressions(tmp_path):
+    baseline = run(["sphere"], [10], [2], ["float64"], min_time=1e-4, log=None)
+    current = [dict(result) for result in baseline]
+    current[0]["seconds"] *= 2.
+    rows = compare(baseline, current, threshold=0.5)
+    assert len(rows) == len(baseline)
+    assert rows[0][-1] and not any(row[-1] for row in rows[1:])
+
+    for path, results in (("base.json", baseline), ("cur.json", current)):
+        with open(str(tmp_path / path), "w") as file:
+            json.dump({"results": results}, file)
+    assert main(["--compare", str(tmp_path / "base.json"),
+                 str(tmp_path / "cur.json"), "--threshold", "0.5"]) == 1
+    assert main(["--compare", str(tmp_path / "base.json"),
+                 str(tmp_path / "base.json")]) == 0
@@ -0,0 +1,98 @@
+from euclidean import Euclidean
+from hyperboloid import Hyperboloid
+from manifold import Manifold
+import numpy as np
+from numpy.testing import assert_array_almost_equal
+from poincare import PoincareBall
+from product import ProductManifold
+import pytest
+from samples import random_hyperboloid_points, random_sphere_points
+from sphere import Sphere
+from transport import TransportCache, TransportPlan
+
+
+@pytest.mark.parametrize("manifold, sample", [
+    (Sphere(3), random_sphere_points),
+    (Hyperboloid(3), random_hyperboloid_points),
+])
+def test_plans_match_parallel_transport(manifold, sample):
+    rng = np.random.default_rng(0)
+    p0, p1 = sample(20, 3, rng), sample(20, 3, rng)
+    vectors = np.stack([
+        manifold.project_to_tangent_space(p0, rng.standard_normal(p0.shape))
+        for _ in range(3)
+    ], axis=1)
+
+    linear = TransportPlan(manifold, p0, p1)
+    assert linear.method == "linear"
+    # Two rank one factors per pair, rather than a dense matrix
+    assert linear.nbytes == 2*p0.nbytes
+    assert_array_almost_equal(linear.transport(vectors[:, 0]),
+                              manifold.parallel_transport(vectors[:, 0], p0, p1))
+    transported = linear.transport(vectors)
+    assert transported.shape == (20, 3, 4)
+    for r in range(3):
+        assert_array_almost_equal(
+            transported[:, r],
+            manifold.parallel_transport(vectors[:, r], p0, p1))
+
+    ladder = TransportPlan(manifold, p0, p1, n_steps=5, method="pole_ladder")
+    assert ladder.ladder.shape == (20, 11, 4)
+    assert_array_almost_equal(
+        ladder.transport(vectors[:, 0]),
+        Manifold.parallel_transport(manifold, vectors[:, 0], p0, p1, n_steps=5)
+    )
+    assert_array_almost_equal(ladder.transport(vectors)[:, 2],
+                              ladder.transport(vectors[:, 2]))
+
+def test_linear_plan_needs_closed_form():
+    rng = np.random.default_rng(1)
+    ball = PoincareBall(2)
+    p0 = random_hyperboloid_points(5, 2, rng)[:, 1:]/4.
+    p1 = random_hyperboloid_points(5, 2, rng)[:, 1:]/4.
+    with pytest.raises(NotImplementedError):
+        TransportPlan(ball, p0, p1, method="linear")
+    assert TransportPlan(ball, p0, p1).method == "pole_ladder"
+    with pytest.raises(ValueError):
+        TransportPlan(ball, p0, p1, method="geodesic")
+
+def test_cache_reuses_and_evicts_plans():
+    rng = np.random.default_rng(2)
+    sphere = Sphere(2)
+    pairs = [(random_sphere_points(10, 2, rng), random_sphere_points(10, 2, rng))
+             for _ in range(3)]
+    plan_bytes = TransportPlan(sphere, *pairs[0]).nbytes
+    cache = TransportCache(max_bytes=2*plan_bytes)
+
+    first = cache.plan(sphere, *pairs[0])
+    assert cache.plan(sphere, pairs[0][0].copy(), pairs[0][1].copy()) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.plan(sphere, *pairs[1])
+    cache.plan(sphere, *pairs[0])
+    # The least recently used plan, for pairs[1], makes room for pairs[2]
+    cache.plan(sphere, *pairs[2])
+    assert len(cache) == 2 and cache.nbytes == 2*plan_bytes
+    assert cache.plan(sphere, *pairs[0]) is first
+    cache.plan(sphere, *pairs[1])
+    assert cache.misses == 4
+
+    v = sphere.project_to_tangent_space(pairs[0][0], rng.standard_normal((10, 3)))
+    assert_array_almost_equal(cache.transport(sphere, v, *pairs[0]),
+                              sphere.parallel_transport(v, *pairs[0]))
+    cache.clear()
+    assert len(cache) == 0 and cache.nbytes == 0
+
+def test_cache_keeps_plans_of_manifolds_apart():
+    rng = np.random.default_rng(3)
+    # Products of the same width, with their factors in different orders,
+    # and points on both
+    first = ProductManifold([Sphere(2), Euclidean(3)])
+    second = ProductManifold([Euclidean(3), Sphere(2)])
+    p0, p1 = (np.hstack([random_sphere_points(10, 2, rng),
+                         random_sphere_points(10, 2, rng)]) for _ in range(2))
+    cache = TransportCache()
+    for manifold in (first, second, first):
+        v = manifold.project_to_tangent_space(p0, rng.standard_normal(p0.shape))
+        assert_array_almost_equal(cache.transport(manifold, v, p0, p1),
+                                  manifold.parallel_transport(v, p0, p1))
+    assert (cache.hits, cache.misses) == (1, 2)
@@ -0,0 +1,169 @@
+from backend import ThreadBackend, use_backend
+from hyperboloid import Hyperboloid
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+from poincare import PoincareBall
+import pickle
+import pytest
+from samples import random_hyperboloid_points, random_sphere_points
+from sphere import Sphere
+from validation import ValidationPolicy, use_validation
+
+
+def test_residuals():
+    rng = np.random.default_rng(0)
+    sphere, hyperb = Sphere(2), Hyperboloid(2)
+    points = random_sphere_points(4, 2, rng)
+    assert_array_almost_equal(sphere._manifold_residual(points), 0.)
+    assert sphere.is_on_manifold(points).all()
+    assert_array_almost_equal(sphere._manifold_residual(1.1*points), 0.21)
+    assert not sphere.is_on_manifold(1.1*points).any()
+
+    points = random_hyperboloid_points(4, 2, rng)
+    assert_array_almost_equal(hyperb._manifold_residual(points), 0.)
+    assert np.isinf(hyperb._manifold_residual(-points)).all()
+    vectors = hyperb.project_to_tangent_space(points,
+                                              rng.standard_normal((4, 3)))
+    assert_array_almost_equal(hyperb._tangent_residual(points, vectors), 0.)
+    assert (hyperb._tangent_residual(points, points) > 0.05).all()
+    assert_array_equal(PoincareBall(2)._tangent_residual(points[:, 1:],
+                                                          vectors[:, 1:]), 0.)
+
+def test_full_validation_records_and_acts():
+    rng = np.random.default_rng(1)
+    sphere = Sphere(2)
+    p0, p1 = random_sphere_points(50, 2, rng), random_sphere_points(50, 2, rng)
+    v = sphere.project_to_tangent_space(p0, rng.standard_normal((50, 3)))
+    drifted = p0.copy()
+    drifted[[4, 7]] *= 1.01
+
+    policy = ValidationPolicy("full", action="record")
+    with use_validation(policy):
+        sphere.exponential_map(p0, v)
+        sphere.distance(drifted, p1)
+        # Only the outermost call is checked
+        sphere.parallel_transport(v, p0, p1, method="pole_ladder", n_steps=3)
+    stats = policy.summary()
+    assert set(stats) == {
+        "Sphere.exponential_map:point", "Sphere.exponential_map:v_TpS",
+        "Sphere.distance:u", "Sphere.distance:v",
+        "Sphere.parallel_transport:point_0", "Sphere.parallel_transport:point_1",
+        "Sphere.parallel_transport:vec_Tp0M",
+    }
+    assert stats["Sphere.distance:u"]["checked"] == 50
+    assert stats["Sphere.distance:u"]["violations"] == 2
+    assert stats["Sphere.distance:u"]["max_residual"] == pytest.approx(0.0201)
+    assert stats["Sphere.distance:v"]["violations"] == 0
+    assert stats["Sphere.exponential_map:v_TpS"]["calls"] == 1
+    policy.reset()
+    assert policy.summary() == {}
+
+    with use_validation(ValidationPolicy("full", action="raise")):
+        with pytest.raises(ValueError):
+            sphere.logarithmic_map(drifted, p1)
+        with pytest.raises(ValueError):
+            sphere.exponential_map(p0, v + 0.1*p0)
+    with use_validation(ValidationPolicy("full", action="warn")):
+        with pytest.warns(RuntimeWarning):
+            sphere.distance(drifted, p1)
+
+    # Re-projection repairs the arguments, not the caller's arrays
+    with use_validation(ValidationPolicy("full", action="project")):
+        assert_array_almost_equal(sphere.distance(drifted, p1),
+                                  sphere.distance(p0, p1))
+        assert_array_almost_equal(sphere.exponential_map(p0, v + 0.1*p0),
+                                  sphere.exponential_map(p0, v))
+    assert drifted[4, 0] == 1.01*p0[4, 0]
+
+def test_sampled_validation():
+    rng = np.random.default_rng(2)
+    hyperb = Hyperboloid(2)
+    p0 = random_hyperboloid_points(10000, 2, rng)
+    p1 = random_hyperboloid_points(10000, 2, rng)
+    drifted = p0.copy()
+    drifted[::2, 0] += 0.1
+
+    hyperb.validation = ValidationPolicy("sampled", fraction=0.01,
+                                         action="project", seed=0)
+    try:
+        distance = hyperb.distance(drifted, p1)
+        # Points are sampled from their own rows, not from the broadcast batch
+        hyperb.logarithmic_map(p0[:1], p1)
+        hyperb.exp_log_roundtrip(p0[:, None], p1[:20], 0.5)
+        stats = hyperb.validation.summary()
+    finally:
+        del hyperb.validation
+    assert 50 < stats["Hyperboloid.distance:u"]["checked"] <= 100
+    assert 0.3 < stats["Hyperboloid.distance:u"]["violation_rate"] < 0.7
+    assert stats["Hyperboloid.logarithmic_map:point0"]["checked"] == 1
+    assert 50 < stats["Hyperboloid.exp_log_roundtrip:point0"]["checked"] <= 100
+    assert stats["Hyperboloid.exp_log_roundtrip:point1"]["checked"] <= 16
+    # A violation in the sample re-projects every row
+    assert_array_almost_equal(distance,
+                              hyperb.distance(hyperb.project_to_manifold(drifted),
+                                              p1))
+
+def test_validation_is_off_in_shards_and_pickles():
+    rng = np.random.default_rng(3)
+    sphere = Sphere(2)
+    p0, p1 = random_sphere_points(100, 2, rng), random_sphere_points(100, 2, rng)
+    sphere.validation = ValidationPolicy("full", action="record")
+    with use_backend(ThreadBackend(n_workers=4, min_rows=10)) as backend:
+        sphere.logarithmic_map(p0, p1)
+    backend.close()
+    stats = sphere.validation.summary()
+    assert stats["Sphere.logarithmic_map:point0"] == dict(
+        stats["Sphere.logarithmic_map:point0"], calls=1, checked=100)
+    assert "Sphere.log_map_with_distance:point0" not in stats
+    assert pickle.loads(pickle.dumps(sphere)).validation is None
+
+    with use_validation(ValidationPolicy("off")):
+        sphere.validation = None
+        sphere.distance(2.*p0, p1)
+    with pytest.raises(ValueError):
+        ValidationPolicy("often")
+    with pytest.raises(ValueError):
+        ValidationPolicy(action="ignore")
+
+def test_validation_follows_where():
+    rng = np.random.default_rng(4)
+    sphere = Sphere(2)
+    p0, p1 = random_sphere_points(20, 2, rng), random_sphere_points(20, 2, rng)
+    v = sphere.logarithmic_map(p0, p1)
+    is_updated = np.zeros(20, dtype=bool)
+    is_updated[[2, 5, 11]] = True
+    drifted = p0.copy()
+    drifted[[4, 5]] *= 1.1
+    off_tangent = v + 0.1*p0
+
+    # Rows outside the mask are neither checked nor rewritten
+    with use_validation(ValidationPolicy("full", action="raise")):
+        sphere.distance(drifted, p1, where=~np.isin(np.arange(20), [4, 5]))
+        sphere.exponential_map(p0, np.where(is_updated[:, None], v, off_tangent),
+                               where=is_updated)
+        with pytest.raises(ValueError):
+            sphere.distance(drifted, p1, where=is_updated)
+
+    policy = ValidationPolicy("full", action="project")
+    with use_validation(policy):
+        out = drifted.copy()
+        sphere.exponential_map(out, off_tangent, out=out, where=is_updated)
+        transported = sphere.parallel_transport(off_tangent, p0[:1], p1,
+                                                where=is_updated)
+    stats = policy.summary()
+    assert stats["Sphere.exponential_map:point"]["checked"] == 3
+    assert stats["Sphere.exponential_map:point"]["violations"] == 1
+    assert stats["Sphere.exponential_map:v_TpS"]["checked"] == 3
+    # A point broadcast against the batch is checked once
+    assert stats["Sphere.parallel_transport:point_0"]["checked"] == 1
+    assert_array_equal(out[~is_updated], drifted[~is_updated])
+    assert_array_almost_equal(
+        out[is_updated],
+        sphere.exponential_map(sphere.project_to_manifold(drifted[is_updated]),
+                               v[is_updated]))
+    assert_array_equal(transported[~is_updated], off_tangent[~is_updated])
+    assert_array_almost_equal(
+        transported[is_updated],
+        sphere.parallel_transport(
+            sphere.project_to_tangent_space(p0[:1], off_tangent[is_updated]),
+            p0[:1], p1[is_updated]))
@@ -0,0 +1,179 @@
+'''
+    Transport plans, for when vectors are parallel transported again and
+    again between the same pairs of points. A plan precomputes what the
+    transport depends on besides the vectors: the rank one factors of the
+    transport on manifolds where it has a closed form, so that any number
+    of vectors per pair are transported in a single pass, and otherwise the
+    rungs and midpoints of the pole ladder. Plans are kept by a
+    TransportCache, which evicts the least recently used ones once their
+    total size exceeds a memory budget:
+
+        cache = TransportCache(max_bytes=2**28)
+        for vectors in batches:
+            transported = cache.transport(sphere, vectors, point_0, point_1)
+'''
+from collections import OrderedDict
+from hashlib import blake2b
+from numpy import repeat
+
+# Memory budget of a TransportCache, in bytes
+DEFAULT_CACHE_BYTES = 2**28
+
+PLAN_METHODS = ("auto", "linear", "pole_ladder")
+
+
+class TransportPlan:
+    '''
+        Parallel transport from the tangent spaces of m points point_0 to
+        those of m points point_1, precomputed for repeated use
+    '''
+
+    def __init__(self, manifold, point_0, point_1, n_steps=10, method="auto"):
+        '''
+
+        :param manifold: Manifold the points are on
+        :param point_0: (m, n_dims+1) np.array, representing m initial points
+        :param point_1: (m, n_dims+1) np.array, representing m final points
+        :param n_steps: number of steps of the pole ladder
+        :param method: "linear" to use the factors of the closed form
+                       transport, see Manifold.transport_factors,
+                       "pole_ladder" to cache the geometry of the generic
+                       pole ladder of Manifold.parallel_transport, or "auto"
+                       for "linear" where the manifold has a closed form
+        '''
+        if method not in PLAN_METHODS:
+            raise ValueError("Unknown transport method: {}".format(method))
+        self.manifold = manifold
+        self.n_steps = n_steps
+        self.factors = None
+        self.ladder = None
+        if method != "pole_ladder":
+            try:
+                self.factors = manifold.transport_factors(point_0, point_1)
+            except NotImplementedError:
+                if method == "linear":
+                    raise
+        if self.factors is None:
+            self.ladder = manifold._ladder_points(point_0, point_1, n_steps)
+        self.method = "pole_ladder" if self.factors is None else "linear"
+
+    @property
+    def nbytes(self):
+        '''
+        Memory held by the plan, in bytes
+        '''
+        if self.factors is None:
+            return self.ladder.nbytes
+        return sum(factor.nbytes for factor in self.factors)
+
+    def transport(self, vec_Tp0M):
+        '''
+        Parallel transport vectors with the plan
+        :param vec_Tp0M: (m, n_dims+1) np.array, one vector in the tangent
+                         space of each point_0, or (m, r, n_dims+1) np.array,
+                         r vectors per point
+        :return: np.array of the same shape, the vectors transported to the
+                 tangent spaces of point_1
+        '''
+        if self.factors is not None:
+            image, covector = self.factors
+            if vec_Tp0M.ndim == 3:
+                image, covector = image[:, None], covector[:, None]
+            return self.manifold.apply_transport_factors(image, covector,
+                                                         vec_Tp0M)
+
+        ladder = self.ladder
+        vectors = vec_Tp0M
+        if vec_Tp0M.ndim == 3:
+            # Each point is repeated once per vector
+            ladder = repeat(ladder, vec_Tp0M.shape[1], axis=0)
+            vectors = vec_Tp0M.reshape(-1, vec_Tp0M.shape[2])
+        for i in range(self.n_steps):
+            vectors = self.manifold._pole_ladder_transport(
+                                                    vectors,
+                                                    ladder[:, 2*i],
+                                                    ladder[:, 2*i + 2],
+                                                    midpt_01=ladder[:, 2*i + 1]
+            )
+        return vectors.reshape(vec_Tp0M.shape)
+
+
+def _key(manifold, point_0, point_1, n_steps, method):
+    '''
+    Key of a plan in a TransportCache, with a digest of the points' bytes.
+    Plans are only shared by the manifold instance that made them: equal
+    widths do not make manifolds equal, as for products of the same factors
+    in different orders. The cached plan refers to its manifold, so the id
+    cannot be reused while the plan is kept.
+    '''
+    digest = blake2b(digest_size=16)
+    for point in (point_0, point_1):
+        digest.update(str((point.shape, point.dtype.str)).encode())
+        digest.update(point.tobytes())
+    return (id(manifold), n_steps, method, digest.digest())
+
+
+class TransportCache:
+    '''
+        Least recently used cache of TransportPlans, bounded by the total
+        memory of the plans. Plans are looked up by the values of the end
+        points and the manifold instance, so callers need not keep the plans
+        themselves.
+    '''
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        '''
+
+        :param max_bytes: memory budget of the cached plans, in bytes.
+                          Plans larger than this are used but not kept.
+        '''
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._plans = OrderedDict()
+
+    def __len__(self):
+        return len(self._plans)
+
+    def clear(self):
+        '''
+        Drop every cached plan
+        '''
+        self._plans.clear()
+        self.nbytes = 0
+
+    def plan(self, manifold, point_0, point_1, n_steps=10, method="auto"):
+        '''
+        The plan for transport between point_0 and point_1, from the cache
+        if an identical one was made before
+        :param manifold, point_0, point_1, n_steps, method: see TransportPlan
+        :return: TransportPlan
+        '''
+        key = _key(manifold, point_0, point_1, n_steps, method)
+        plan = self._plans.get(key)
+        if plan is not None:
+            self.hits += 1
+            self._plans.move_to_end(key)
+            return plan
+
+        self.misses += 1
+        plan = TransportPlan(manifold, point_0, point_1, n_steps, method)
+        if plan.nbytes <= self.max_bytes:
+            self._plans[key] = plan
+            self.nbytes += plan.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._plans.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return plan
+
+    def transport(self, manifold, vec_Tp0M, point_0, point_1, n_steps=10,
+                  method="auto"):
+        '''
+        Parallel transport vec_Tp0M with the cached plan for its end points
+        :param vec_Tp0M: (m, n_dims+1) or (m, r, n_dims+1) np.array, see
+                         TransportPlan.transport
+        :return: np.array of the same shape, the transported vectors
+        '''
+        return self.plan(manifold, point_0, point_1, n_steps,
+                         method).transport(vec_Tp0M)
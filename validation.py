@@ -0,0 +1,366 @@
+'''
+    Checks that the points passed to Manifold methods are on the manifold,
+    and that the vectors are in the tangent spaces of their points. A
+    ValidationPolicy is configured like a backend, either on the manifold
+    instance,
+
+        sphere.validation = ValidationPolicy("sampled", fraction=0.01)
+
+    or for a block of code,
+
+        with use_validation(ValidationPolicy("full", action="raise")):
+            sphere.exponential_map(point, v_TpS)
+
+    In "sampled" mode only a random fraction of the rows of each argument
+    is checked, so that production runs can watch for data drift at a small
+    fraction of the cost of the call. Each check updates the ViolationStats
+    of its method and argument, and rows off the manifold are recorded,
+    warned about, raised on or re-projected, as chosen by the action.
+
+    Only the outermost call is checked: methods that other methods call,
+    such as the exponential maps of a pole ladder, and shards of a sharded
+    call are not checked again. Calls with a where mask only check, and
+    re-project, the rows that enter the selected rows of the batch.
+'''
+from backend import _batch_shape, _bind, in_shard
+from contextlib import contextmanager
+from functools import wraps
+from inspect import signature
+from numpy import asarray, broadcast_shapes, broadcast_to, ceil, ndarray, \
+    unique, unravel_index
+from numpy.random import default_rng
+import threading
+import warnings
+
+VALIDATION_MODES = ("off", "sampled", "full")
+VALIDATION_ACTIONS = ("record", "warn", "raise", "project")
+
+# Policies installed by use_validation, innermost last
+_default_policies = []
+# Marks threads that are inside a checked call
+_state = threading.local()
+
+
+@contextmanager
+def use_validation(policy):
+    '''
+    Check the arguments of every manifold without its own policy with
+    policy, for the duration of the with block
+    :param policy: ValidationPolicy, or None not to check
+    '''
+    _default_policies.append(policy)
+    try:
+        yield policy
+    finally:
+        _default_policies.pop()
+
+
+def _policy_for(manifold):
+    '''
+    :param manifold: Manifold whose method is called
+    :return: the ValidationPolicy to check the call with, or None
+    '''
+    policy = manifold.validation
+    if policy is None and _default_policies:
+        policy = _default_policies[-1]
+    if (policy is None or policy.mode == "off" or
+            getattr(_state, "in_check", False) or in_shard()):
+        return None
+    return policy
+
+
+class ViolationStats:
+    '''
+        Running statistics of the residuals of one argument of one method.
+        Residuals are 0 for valid rows, see Manifold._manifold_residual and
+        Manifold._tangent_residual.
+    '''
+
+    def __init__(self):
+        self.n_calls = 0
+        self.n_checked = 0
+        self.n_violations = 0
+        self.max_residual = 0.
+        self.total_residual = 0.
+
+    @property
+    def violation_rate(self):
+        '''
+        Fraction of the checked rows that were violations
+        '''
+        return self.n_violations/max(self.n_checked, 1)
+
+    @property
+    def mean_residual(self):
+        '''
+        Mean residual of the checked rows
+        '''
+        return self.total_residual/max(self.n_checked, 1)
+
+    def update(self, residual, is_violation):
+        '''
+        Add the residuals of the rows checked by one call
+        :param residual: (k, 1) np.array of residuals
+        :param is_violation: (k, 1) np.array of booleans
+        '''
+        self.n_calls += 1
+        self.n_checked += residual.shape[0]
+        self.n_violations += int(is_violation.sum())
+        if residual.size > 0:
+            self.max_residual = max(self.max_residual, float(residual.max()))
+            self.total_residual += float(residual.sum())
+
+    def as_dict(self):
+        return {
+            "calls": self.n_calls,
+            "checked": self.n_checked,
+            "violations": self.n_violations,
+            "violation_rate": self.violation_rate,
+            "max_residual": self.max_residual,
+            "mean_residual": self.mean_residual,
+        }
+
+
+class ValidationPolicy:
+    '''
+        How, and how much, to check the arguments of Manifold methods, and
+        the statistics of the checks made so far
+    '''
+
+    def __init__(self, mode="sampled", fraction=0.01, tol=1e-6, action="warn",
+                 min_rows=16, seed=None):
+        '''
+
+        :param mode: "off", "sampled" to check a random fraction of the rows
+                     of each argument, or "full" to check every row
+        :param fraction: fraction of the rows checked in sampled mode
+        :param tol: largest residual of a valid row
+        :param action: what to do about violations: "record" them in the
+                       statistics only, "warn" with a RuntimeWarning, "raise"
+                       a ValueError, or "project" the rows off the manifold
+                       back onto it, or into the tangent space. In sampled
+                       mode, a violation makes the projection check every
+                       row of the argument.
+        :param min_rows: fewest rows checked per argument in sampled mode
+        :param seed: seed of the random choice of rows
+        '''
+        if mode not in VALIDATION_MODES:
+            raise ValueError("Unknown validation mode: {}".format(mode))
+        if action not in VALIDATION_ACTIONS:
+            raise ValueError("Unknown validation action: {}".format(action))
+        self.mode = mode
+        self.fraction = fraction
+        self.tol = tol
+        self.action = action
+        self.min_rows = min_rows
+        self.stats = {}
+        self._rng = default_rng(seed)
+        self._lock = threading.Lock()
+
+    def reset(self):
+        '''
+        Clear the statistics
+        '''
+        with self._lock:
+            self.stats = {}
+
+    def summary(self):
+        '''
+        :return: dict of the statistics of each checked "Class.method:argument",
+                 as dicts, see ViolationStats.as_dict
+        '''
+        with self._lock:
+            return {key: stats.as_dict() for key, stats in self.stats.items()}
+
+    def _sample(self, batch_shape, used=None):
+        '''
+        :param batch_shape: shape of the batch dimensions of an argument
+        :param used: optional boolean np.array of shape batch_shape, the
+                     rows that may be checked
+        :return: tuple of np.arrays, index of the rows to check, or None for
+                 every row
+        '''
+        if used is None:
+            n_rows = 1
+            for size in batch_shape:
+                n_rows *= size
+        else:
+            candidates = used.nonzero()
+            n_rows = candidates[0].size
+        n_sampled = max(self.min_rows, int(ceil(self.fraction*n_rows)))
+        if self.mode == "full" or n_sampled >= n_rows:
+            return None if used is None else candidates
+        # Drawing with replacement costs O(n_sampled), rather than O(n_rows)
+        with self._lock:
+            flat = unique(self._rng.integers(0, n_rows, n_sampled))
+        if used is None:
+            return unravel_index(flat, batch_shape)
+        return tuple(index[flat] for index in candidates)
+
+    def _record(self, key, residual):
+        '''
+        Update the statistics of key and act on its violations
+        :param residual: (k, 1) np.array of the residuals of checked rows
+        :return: (k, 1) np.array of booleans, the violations
+        '''
+        is_violation = residual > self.tol
+        with self._lock:
+            self.stats.setdefault(key, ViolationStats()).update(residual,
+                                                                is_violation)
+        n_violations = int(is_violation.sum())
+        if n_violations > 0 and self.action in ("warn", "raise"):
+            message = "{} of {} checked rows of {} are invalid, with " \
+                      "residuals up to {:.3g}".format(
+                            n_violations, residual.shape[0], key,
+                            float(residual.max()))
+            if self.action == "raise":
+                raise ValueError(message)
+            warnings.warn(message, RuntimeWarning, stacklevel=4)
+        return is_violation
+
+    def check_points(self, manifold, key, point, used=None):
+        '''
+        Check that points are on the manifold
+        :param manifold: Manifold the points should be on
+        :param key: name of the checked argument in the statistics
+        :param point: (m, n_dims+1) np.array of points
+        :param used: optional (m,) boolean np.array, the rows to check
+        :return: point, or a copy re-projected onto the manifold
+        '''
+        index = self._sample(point.shape[:-1], used)
+        rows = point if index is None else point[index]
+        residual = manifold._manifold_residual(rows).reshape(-1, 1)
+        is_violation = self._record(key, residual)
+        if self.action != "project" or not is_violation.any():
+            return point
+        if index is not None:
+            residual = manifold._manifold_residual(point)
+        is_bad = residual.reshape(point.shape[:-1]) > self.tol
+        if used is not None:
+            is_bad &= used
+        bad = is_bad.nonzero()
+        point = point.copy()
+        point[bad] = manifold.project_to_manifold(point[bad])
+        return point
+
+    def check_vectors(self, manifold, key, point, vector, used=None):
+        '''
+        Check that vectors are in the tangent spaces of points
+        :param manifold: Manifold the points are on
+        :param key: name of the checked argument in the statistics
+        :param point: (m, n_dims+1) np.array of points
+        :param vector: (m, n_dims+1) np.array of vectors
+        :param used: optional (m,) boolean np.array, the rows to check
+        :return: vector, or a copy projected into the tangent spaces
+        '''
+        shape = broadcast_shapes(point.shape, vector.shape)
+        index = self._sample(shape[:-1], used)
+        if index is None:
+            residual = manifold._tangent_residual(point, vector)
+        else:
+            residual = manifold._tangent_residual(
+                                        broadcast_to(point, shape)[index],
+                                        broadcast_to(vector, shape)[index])
+        is_violation = self._record(key, residual.reshape(-1, 1))
+        if self.action != "project" or not is_violation.any():
+            return vector
+        if index is not None:
+            residual = manifold._tangent_residual(point, vector)
+        is_bad = broadcast_to(residual, shape[:-1] + (1,))[..., 0] > self.tol
+        if used is not None:
+            is_bad = is_bad & used
+        bad = is_bad.nonzero()
+        vector = broadcast_to(vector, shape).copy()
+        vector[bad] = manifold.project_to_tangent_space(
+                                        broadcast_to(point, shape)[bad],
+                                        vector[bad])
+        return vector
+
+
+def _used_rows(where, batch_shape, shape):
+    '''
+    Rows of an argument that enter the rows of a batch selected by where
+    :param where: boolean mask of the rows of the batch, see sharded
+    :param batch_shape: shape of the batch, (m, ..., k)
+    :param shape: shape of the argument, broadcasting to batch_shape
+    :return: boolean np.array of shape shape[:-1]
+    '''
+    where = asarray(where, dtype=bool)
+    if where.ndim == len(batch_shape):
+        where = where[..., 0]
+    where = broadcast_to(where, batch_shape[:-1])
+    # Rows broadcast against several rows of the batch are used by any
+    n_leading = len(batch_shape) - len(shape)
+    where = where.any(axis=tuple(range(n_leading)))
+    axes = tuple(axis for axis, size in enumerate(shape[:-1])
+                 if size == 1 and where.shape[axis] != 1)
+    return where.any(axis=axes, keepdims=True)
+
+
+def _argument(args, kwargs, name, position):
+    '''
+    :return: the argument name of a call, at position in args, or None
+    '''
+    if position < len(args):
+        return args[position]
+    return kwargs.get(name)
+
+
+def validated(points=(), vectors=()):
+    '''
+    Decorator for Manifold methods whose arguments are checked by the
+    manifold's ValidationPolicy, when one is configured
+    :param points: names of the arguments that are points
+    :param vectors: (vector name, point name) pairs of the arguments that
+                    are vectors in the tangent spaces of points
+    :return: decorator
+    '''
+    def decorate(method):
+        method_signature = signature(method)
+        names = list(method_signature.parameters)[1:]
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            policy = _policy_for(self)
+            if policy is None:
+                return method(self, *args, **kwargs)
+            prefix = "{}.{}:".format(type(self).__name__, method.__name__)
+            where = kwargs.get("where")
+            if where is not None:
+                batch_shape = _batch_shape(_bind(
+                        method_signature, self, args,
+                        {key: value for key, value in kwargs.items()
+                         if key != "where"}))
+            used = lambda shape: (None if where is None else
+                                  _used_rows(where, batch_shape, shape))
+            args = list(args)
+
+            def replace(name, value):
+                if names.index(name) < len(args):
+                    args[names.index(name)] = value
+                else:
+                    kwargs[name] = value
+
+            _state.in_check = True
+            try:
+                for name in points:
+                    point = _argument(args, kwargs, name, names.index(name))
+                    if isinstance(point, ndarray):
+                        replace(name, policy.check_points(
+                                        self, prefix + name, point,
+                                        used(point.shape)))
+                for name, point_name in vectors:
+                    vector = _argument(args, kwargs, name, names.index(name))
+                    point = _argument(args, kwargs, point_name,
+                                      names.index(point_name))
+                    if isinstance(vector, ndarray) and \
+                            isinstance(point, ndarray):
+                        replace(name, policy.check_vectors(
+                                        self, prefix + name, point, vector,
+                                        used(broadcast_shapes(point.shape,
+                                                              vector.shape))))
+                return method(self, *args, **kwargs)
+            finally:
+                _state.in_check = False
+        return wrapper
+    return decorate